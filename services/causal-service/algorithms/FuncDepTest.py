@@ -1,8 +1,37 @@
 from . import common
 from causallearn.search.Granger.Granger import Granger
 from causallearn.search.FCMBased.ANM.ANM import ANM
-from typing import List, Optional, Dict, Set
+from typing import List, Optional, Dict, Set, Tuple
 from pydantic import Field
+from .cit import pairwisePValues
+from .skeleton import SKELETON_WORKERS
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+# dependent pairs needed before the orientation is sent to a process pool
+ORIENT_MIN_PAIRS = 8
+ORIENT_BASE_SAMPLES = 128
+
+workerSample = None
+
+def initOrientWorker(sample: np.ndarray):
+    global workerSample
+    workerSample = sample
+
+def anmPairs(pairs: List[Tuple[int, int]], sample: Optional[np.ndarray] = None) -> List[Tuple[float, float]]:
+    """ANM p-values (i -> j, j -> i) of each pair of columns of the sample."""
+    sample = workerSample if sample is None else sample
+    anm = ANM()
+    return [anm.cause_or_effect(sample[:, i:i+1], sample[:, j:j+1]) for i, j in pairs]
+
+def orientPairs(sample: np.ndarray, pairs: List[Tuple[int, int]], workers: int) -> List[Tuple[float, float]]:
+    if workers <= 1 or len(pairs) < ORIENT_MIN_PAIRS:
+        return anmPairs(pairs, sample)
+    size = max(1, -(-len(pairs) // (workers * 4)))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'),
+                             initializer=initOrientWorker, initargs=(sample,)) as pool:
+        return [p for ps in pool.map(anmPairs, [pairs[i:i+size] for i in range(0, len(pairs), size)]) for p in ps]
 
 import math
 class FuncDepTestParams(common.OptionalParams, title="FuncDepTest Algorithm"):
@@ -22,12 +51,22 @@ class FuncDepTestParams(common.OptionalParams, title="FuncDepTest Algorithm"):
         description="The independence test to use for causal discovery",
         options=common.getOpts(common.IDepTestItems),
     )
+    kciRank: Optional[int] = Field(
+        default=50, title="KCI近似秩", # 'KCI Rank',
+        description="kci only: rank of the low-rank kernel matrices. Higher is closer to the exact test and slower.",
+        ge=10, le=500, multiple_of=1
+    )
+    kciMaxRows: Optional[int] = Field(
+        default=2000, title="KCI最大行数", # 'KCI Max Rows',
+        description="kci only: the tests run on at most this many rows, a fixed random subset of the table.",
+        ge=200, le=200000, multiple_of=1
+    )
     alpha: Optional[float] = Field(
         default=-12, title="log10(显著性阈值)", # "Alpha",
         description="desired significance level (float) in (0, 1). Default: log10(0.005).",
         ge=-16, lt=0.0
     )
-    orient: Optional[float] = Field(
+    orient: Optional[str] = Field(
         default='ANM', title="方向判断算法",
         options=common.getOpts({'ANM': "ANM"})
     )
@@ -36,48 +75,39 @@ class FuncDepTestParams(common.OptionalParams, title="FuncDepTest Algorithm"):
         description="对不同算法有不同阈值",
         gt=0.0, le=5
     )
+    o_samples: Optional[int] = Field(
+        default=0, title="方向判断采样行数", # "Orientation Samples",
+        description="Rows used to orient each dependent pair. 0: 128 times the cube root of the number of worker processes, about the time of a sequential run on 128 rows",
+        ge=0
+    )
 
 class FuncDepTest(common.AlgoInterface):
     ParamType = FuncDepTestParams
     def __init__(self, dataSource: List[common.IRow], fields: List[common.IFieldMeta], params: Optional[ParamType] = ParamType(), **kwargs):
-        print("FuncDepTest", fields, params)
         super(FuncDepTest, self).__init__(dataSource=dataSource, fields=fields, params=params)
         
     def calc(self, params: Optional[ParamType] = ParamType(), focusedFields: List[str] = [], bgKnowledgesPag: Optional[List[common.BgKnowledgePag]] = [], **kwargs):
         array = self.selectArray(focusedFields=focusedFields, params=params)
-        d = len(focusedFields)
-        import itertools, numpy as np
+        # encoded columns, one-hot encodings may add some
+        d = array.shape[1]
         res = np.zeros((d, d))
-        o_test = None
-        anm = ANM()
-        G = Granger()
-        if params.orient == 'ANM':
-            o_test = lambda x, y: anm.cause_or_effect(x, y)
         # coef = np.corrcoef(array, rowvar=False)
-        from causallearn.utils.cit import CIT
         # cit = CIT(array, 'fisherz')
-        cit = CIT(array, params.indep_test)
-        coeff_p = np.zeros((d, d))
-        for i in range(d):
-            for j in range(d):
-                if i != j: coeff_p[i, j] = coeff_p[j, i] = cit(i, j, [])
-        print(coeff_p)
+        cit = self.getCIT(array, params.indep_test, alpha=10 ** params.alpha, **common.citOptions(params.indep_test, params))
+        coeff_p = pairwisePValues(cit, d)
         linear_threshold = 1e-18
         threshold = 10 ** params.o_alpha
-        max_samples = 128
-        array = array[np.random.choice(range(array.shape[0]), min(array.shape[0], max_samples), replace=False).tolist(),:]
-        for i in range(d):
-            for j in range(i):
-                if coeff_p[i, j] < 10 ** params.alpha:
-                    a, b = o_test(array[:, i:i+1], array[:, j:j+1])
-                    print(f"indep: {i}, {j}, {coeff_p[i, j]}")
-                    print("Orient model p:", a, b)
-                    if a * threshold < b:
-                        res[i, j], res[j, i] = -1, 1
-                    elif a > b * threshold: 
-                        res[i, j], res[j, i] = 1, -1
-                    # else: res[i, j], res[j, i] = -1, -1
-                # elif coeff_p[i, j] <= linear_threshold: # linear res[i, j], res[j, i] = 1, 1
+        workers = SKELETON_WORKERS
+        max_samples = params.o_samples or int(ORIENT_BASE_SAMPLES * max(1, workers) ** (1 / 3))
+        sample = array[np.random.default_rng(0).choice(array.shape[0], min(array.shape[0], max_samples), replace=False)]
+        pairs = [(i, j) for i in range(d) for j in range(i) if coeff_p[i, j] < 10 ** params.alpha]
+        for (i, j), (a, b) in zip(pairs, orientPairs(sample, pairs, workers)):
+            if a * threshold < b:
+                res[i, j], res[j, i] = -1, 1
+            elif a > b * threshold: 
+                res[i, j], res[j, i] = 1, -1
+            # else: res[i, j], res[j, i] = -1, -1
+            # elif coeff_p[i, j] <= linear_threshold: # linear res[i, j], res[j, i] = 1, 1
                     
         # for i in range(d):
         #     for j in range(i):
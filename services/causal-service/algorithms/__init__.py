@@ -1,33 +1,75 @@
-from typing import Dict, Any
+"""
+Registry of the causal discovery algorithms.
+
+The module of an algorithm is imported on first use of DICT[algoName] (or algorithms.<algoName>),
+so that starting a service worker does not import causallearn, lingam and dowhy.
+"""
+import importlib
 import typing
+from typing import Dict, Any, Iterator, Mapping
 
 from .common import AlgoInterface
-from .causallearn.PC import PC
-from .causallearn.FCI import FCI
-from .causallearn.CD_NOD import CD_NOD
-from .causallearn.GES import GES
-from .causallearn.ExactSearch import ExactSearch
-from .causallearn.GIN import GIN
-from .causallearn.GRaSP import GRaSP
-from .causallearn.CAM_UV import CAM_UV
-from .causallearn.RCD import RCD
-from .causallearn.XLearner import XLearner
-from .dowhy.Explainer import Explainer
-
-from .FuncDepTest import FuncDepTest
-
-DICT: Dict[str, typing.Type[Any]] = {
-    'XLearner': XLearner,
-    'CD_NOD': CD_NOD,
-    'PC': PC,
-    # 'FCI': FCI,
-    'GES': GES,
-    'ExactSearch': ExactSearch,
-    'GIN': GIN,
-    'GRaSP': GRaSP,
-    'CAM_UV': CAM_UV,
-    'RCD': RCD,
-    'FuncDepTest': FuncDepTest,
-    'Explainer': Explainer
+
+# algoName: module defining the class algoName
+MODULES: Dict[str, str] = {
+    'XLearner': '.causallearn.XLearner',
+    'CD_NOD': '.causallearn.CD_NOD',
+    'PC': '.causallearn.PC',
+    'FCI': '.causallearn.FCI',
+    'GES': '.causallearn.GES',
+    'ExactSearch': '.causallearn.ExactSearch',
+    'GIN': '.causallearn.GIN',
+    'GRaSP': '.causallearn.GRaSP',
+    'CAM_UV': '.causallearn.CAM_UV',
+    'RCD': '.causallearn.RCD',
+    'FuncDepTest': '.FuncDepTest',
+    'Explainer': '.dowhy.Explainer',
 }
-from .common import registerCausalRequest, CausalRequest
\ No newline at end of file
+
+def load(algoName: str) -> typing.Type[AlgoInterface]:
+    algo = getattr(importlib.import_module(MODULES[algoName], __name__), algoName)
+    # as the eager imports did, algorithms.<algoName> is the class, also where it shadows its module
+    globals()[algoName] = algo
+    return algo
+
+class Registry(Mapping):
+    """Algorithms served by name, imported on first access; iterating the names does not import them."""
+    def __init__(self, names: typing.List[str]):
+        self.names = names
+
+    def __getitem__(self, algoName: str) -> typing.Type[AlgoInterface]:
+        if algoName not in self.names:
+            raise KeyError(algoName)
+        algo = globals().get(algoName)
+        return algo if isinstance(algo, type) else load(algoName)
+
+    def __contains__(self, algoName) -> bool:
+        return algoName in self.names
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+DICT: Mapping[str, typing.Type[Any]] = Registry([
+    'XLearner',
+    'CD_NOD',
+    'PC',
+    # 'FCI',
+    'GES',
+    'ExactSearch',
+    'GIN',
+    'GRaSP',
+    'CAM_UV',
+    'RCD',
+    'FuncDepTest',
+    'Explainer',
+])
+
+def __getattr__(name: str):
+    if name in MODULES:
+        return load(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+from .common import registerCausalRequest, CausalRequest
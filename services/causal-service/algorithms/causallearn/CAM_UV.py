@@ -3,10 +3,10 @@ import traceback
 from pydantic import Field
 
 from algorithms.common import getOpts, IDepTestItems, ICatEncodeType, IQuantEncodeType, UCPriorityItems, UCRuleItems, AlgoInterface, IRow, IDataSource, IFieldMeta, IFields
-from algorithms.common import transDataSource, OptionalParams, ScoreFunctions
+from algorithms.common import transDataSource, OptionalParams, ScoreFunctions, HsicMethods
 import algorithms.common as common
 
-from causallearn.search.FCMBased.lingam import CAMUV
+from algorithms.hsic import camuv, HSIC
 from causallearn.graph.GeneralGraph import GeneralGraph
 from causallearn.graph.Node import Node
 
@@ -21,6 +21,16 @@ class CAM_UVParams(OptionalParams, title="CAM-UV Algorithm(暂不支持背景知
         description="the maximum number of variables to infer causal relationships. This is equivalent to d in the paper.",
         ge=0, le=0, multiple_of=1
     )
+    hsicMethod: Optional[str] = Field(
+        default='auto', title="HSIC计算方式", # 'HSIC Method',
+        description="Exact HSIC tests are quadratic in the number of rows; the approximations are linear, see algorithms.hsic.",
+        options=getOpts(HsicMethods)
+    )
+    hsicRank: Optional[int] = Field(
+        default=100, title="HSIC近似秩", # 'HSIC Rank',
+        description="Rank of the approximate Gram matrices (icl, rff).",
+        ge=10, le=1000, multiple_of=1
+    )
 
 class CAM_UV(AlgoInterface):
     ParamType = CAM_UVParams
@@ -46,7 +56,8 @@ class CAM_UV(AlgoInterface):
         if params.num_explanatory_vals == 0:
             params.num_explanatory_vals = array.shape[1]
         
-        P, U = CAMUV.execute(array, params.alpha, params.num_explanatory_vals)
+        test = HSIC(params.hsicMethod, params.hsicRank, 'median', n=array.shape[0])
+        P, U = camuv(array, params.alpha, params.num_explanatory_vals, test)
         import numpy as np
         d = len(self.focusedFields)
         dag = np.zeros((d, d), dtype=int)
@@ -61,5 +72,6 @@ class CAM_UV(AlgoInterface):
             'matrix': pag.tolist(),
             'unobserved': U,
             'fields': self.safeFieldMeta(self.focusedFields),
+            'extra': {'hsicMethod': test.method},
         }
         
\ No newline at end of file
@@ -5,6 +5,7 @@ import numpy as np
 
 from algorithms.common import getOpts, IDepTestItems, ICatEncodeType, IQuantEncodeType, UCPriorityItems, UCRuleItems, AlgoInterface, IRow, IDataSource, IFieldMeta, IFields
 from algorithms.common import transDataSource, OptionalParams
+from algorithms.constraint import cdnodAlg, alphaSweep, progress
 import algorithms.common as common
 
 from causallearn.search.ConstraintBased.CDNOD import cdnod
@@ -80,7 +81,7 @@ class CD_NOD(AlgoInterface):
                 self.bk.add_forbidden_by_node(node[f_ind[k.src]], node[f_ind[k.tar]])
         return self.bk
     
-    def calc(self, params: Optional[ParamType] = ParamType(), focusedFields: List[str] = [], bgKnowledgesPag: Optional[List[common.BgKnowledgePag]] = [], **kwargs):
+    def calc(self, params: Optional[ParamType] = ParamType(), focusedFields: List[str] = [], bgKnowledgesPag: Optional[List[common.BgKnowledgePag]] = [], sessionId: Optional[str] = None, alphas: Optional[List[float]] = None, deadline: Optional[float] = None, **kwargs):
         # if params.c_indx == '$field':
         #     if params.c_indx_field not in focusedFields:
         #         raise f"$field {params.c_indx_field} not existed"
@@ -92,27 +93,45 @@ class CD_NOD(AlgoInterface):
             # print(args['c_indx'].dtype)
             c_indx_field = IFieldMeta(fid='$id', name='ID', semanticType='ordinal')
         else:
-            args['c_indx'] = self.data.loc[:, [params.c_indx]].to_numpy()
+            args['c_indx'] = self.dataSource.loc[:, [params.c_indx]].to_numpy()
             c_indx_field = [f for f in self.fields if f.fid == params.c_indx][0]
         # print("==========================\nc_indx=", args['c_indx'])
         if params.c_indx in focusedFields:
             focusedFields = [ f for f in focusedFields if f != params.c_indx ]
         array = self.selectArray(focusedFields=focusedFields, params=params)
+        c_indx_full = args['c_indx']
+        if self.sampleOrder is not None:
+            args['c_indx'] = c_indx_full[common.sampleRows(self.sampleOrder, self.sampleSizes[0])]
         
         common.checkLinearCorr(array)
         # self.__class__.cache_path = '/tmp/cd-nod.json'
         self.__class__.cache_path = None
-        self.cg = cdnod(array, **args, background_knowledge=None, cache_path=self.__class__.cache_path, verbose=self.__class__.verbose)
         fields = [ *[f for f in self.focusedFields if f.fid != params.c_indx], c_indx_field ]
         
+        bk = None
         if bgKnowledgesPag and len(bgKnowledgesPag) > 0:
             f_ind = {f.fid: i for (i, f) in enumerate(fields)}
             bk = self.constructBgKnowledgePag(bgKnowledgesPag=bgKnowledgesPag, f_ind=f_ind)
+        if params.mvcdnod:
             self.cg = cdnod(array, **args, background_knowledge=bk, cache_path=self.__class__.cache_path, verbose=self.__class__.verbose)
+            extra = alphaSweep(lambda alpha: (cdnod(array, **{**args, 'alpha': alpha}, background_knowledge=bk).G.graph.tolist(), {}), alphas, None)
+        else:
+            data_aug = np.concatenate((array, args['c_indx']), axis=1)
+            cit = self.getCIT(data_aug, params.indep_test, tag=f'c_indx={params.c_indx}', alpha=[params.alpha, *(alphas or [])],
+                              full=None if self.sampleOrder is None else np.concatenate((self.fullArray, c_indx_full), axis=1))
+            run = lambda alpha: cdnodAlg(data_aug, cit, alpha, params.stable, params.uc_rule, params.uc_priority,
+                                         background_knowledge=bk, verbose=self.__class__.verbose,
+                                         sessionId=sessionId, sessionKey=('CD_NOD', self.fingerprint, params.c_indx, params.indep_test), deadline=deadline)
+            self.cg = run(params.alpha)
+            extra = {
+                **progress(self.cg),
+                **alphaSweep(lambda alpha: (lambda cg: (cg.G.graph.tolist(), progress(cg)))(run(alpha)), alphas, getattr(self.cg, 'max_pvalues', None)),
+            }
         
         l = self.cg.G.graph.tolist()
         return {
             'data': l,
             'matrix': l,
             'fields': self.safeFieldMeta(fields),
+            'extra': extra,
         }
\ No newline at end of file
@@ -7,7 +7,7 @@ from algorithms.common import getOpts, IDepTestItems, ICatEncodeType, IQuantEnco
 from algorithms.common import transDataSource, OptionalParams, ScoreFunctions, SearchMethods
 import algorithms.common as common
 
-from causallearn.search.ScoreBased.ExactSearch import bic_exact_search
+from algorithms.score import exactSearch, localScore, EXACT_SEARCH_MB
 
 class ESParams(OptionalParams, title="Exact Search Algorithm"):
     """
@@ -38,6 +38,11 @@ class ESParams(OptionalParams, title="Exact Search Algorithm"):
         description="The maximum number of parents a node can have. If used, this means using the k-learn procedure. Can drastically speed up algorithms. If None, no max on parents. Default is 0, which means no restriction.",
         ge=0, le=8, multiple_of=1,
     )
+    memoryBudget: Optional[int] = Field(
+        default=EXACT_SEARCH_MB, title="内存预算(MB)", # 'Memory Budget (MB)',
+        description="Memory the search may use. maxP is lowered until the parent graphs fit it, and a search which can not fit it (dp order graph, astar running out of it) fails rather than exhausting the memory of the server.",
+        ge=16, le=EXACT_SEARCH_MB, multiple_of=1,
+    )
 
 class ExactSearch(AlgoInterface):
     ParamType = ESParams
@@ -62,8 +67,10 @@ class ExactSearch(AlgoInterface):
         # common.checkLinearCorr(array)
         f_ind = {f: i for i, f in enumerate(focusedFields)}
         super_graph, include_graph = self.constructGraph(bgKnowledges=bgKnowledges, f_ind=f_ind, focusedFields=focusedFields)
-        self.dag_est, self.search_stats = bic_exact_search(
+        score = localScore(array, 'local_score_BIC_exact', key=self.fingerprint)
+        self.dag_est, self.search_stats = exactSearch(
             array,
+            score,
             super_graph=super_graph,
             include_graph=include_graph,
             search_method=params.search_method,
@@ -72,6 +79,7 @@ class ExactSearch(AlgoInterface):
             k=params.k,
             verbose=self.__class__.verbose,
             max_parents=params.maxP if params.maxP else None,
+            max_bytes=(params.memoryBudget or EXACT_SEARCH_MB) << 20,
         )
         self.pag = np.zeros_like(self.dag_est)
         n = self.dag_est.shape[0]
@@ -87,5 +95,11 @@ class ExactSearch(AlgoInterface):
             'data': l,
             'matrix': pag,
             'fields': self.safeFieldMeta(self.focusedFields),
-            'stats': self.search_stats
+            'stats': self.search_stats,
+            'extra': {
+                'scoresComputed': score.computed,
+                # lowered to fit the memory budget
+                'maxP': self.search_stats['max_parents'],
+                'estimatedMB': round(self.search_stats['estimated_bytes'] / (1 << 20), 1),
+            },
         }
\ No newline at end of file
@@ -8,10 +8,11 @@ from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, Field
 
 from algorithms.common import getOpts, IDepTestItems, ICatEncodeType, IQuantEncodeType, UCPriorityItems, UCRuleItems, AlgoInterface, IRow, IDataSource, IFieldMeta, IFields
-from algorithms.common import transDataSource, OptionalParams
+from algorithms.common import transDataSource, OptionalParams, citOptions
 import algorithms.common as common
 
 from causallearn.search.ConstraintBased.FCI import fci
+from algorithms.constraint import fciAlg, fciNodes, progress
 from causallearn.utils.PCUtils import SkeletonDiscovery
 from causallearn.utils.PCUtils.BackgroundKnowledge import BackgroundKnowledge
 from causallearn.utils.PCUtils.BackgroundKnowledgeOrientUtils import orient_by_background_knowledge
@@ -39,6 +40,16 @@ class FCIParams(OptionalParams):
         description="Independence test method function.  Default: ‘fisherz’",
         options=getOpts(IDepTestItems),
     )
+    kciRank: Optional[int] = Field(
+        default=50, title="KCI近似秩", # 'KCI Rank',
+        description="kci only: rank of the low-rank kernel matrices. Higher is closer to the exact test and slower.",
+        ge=10, le=500, multiple_of=1
+    )
+    kciMaxRows: Optional[int] = Field(
+        default=2000, title="KCI最大行数", # 'KCI Max Rows',
+        description="kci only: the tests run on at most this many rows, a fixed random subset of the table.",
+        ge=200, le=200000, multiple_of=1
+    )
     alpha: Optional[float] = Field(
         default=0.05, title="显著性阈值", # "Alpha",
         description="Significance level of individual partial correlation tests. Default: 0.05.",
@@ -61,7 +72,7 @@ class FCI(AlgoInterface):
         super(FCI, self).__init__(dataSource, fields, params)
         
     def constructBgKnowledge(self, bgKnowledges: Optional[List[common.BgKnowledge]] = [], f_ind: Dict[str, int] = {}):
-        node = self.G.get_nodes()
+        node = fciNodes(len(f_ind))
         self.bk = BackgroundKnowledge()
         for k in bgKnowledges:
             if k.type > common.bgKnowledge_threshold[1]:
@@ -71,19 +82,19 @@ class FCI(AlgoInterface):
         return self.bk
     
     
-    def calc(self, params: Optional[ParamType] = ParamType(), focusedFields: List[str] = [], bgKnowledges: Optional[List[common.BgKnowledge]] = [], **kwargs):
+    def calc(self, params: Optional[ParamType] = ParamType(), focusedFields: List[str] = [], bgKnowledges: Optional[List[common.BgKnowledge]] = [], deadline: Optional[float] = None, **kwargs):
         array = self.selectArray(focusedFields=focusedFields, params=params)
         # common.checkLinearCorr(array)
-        print(array, array.min(), array.max())
-        self.G, self.edges = fci(array, **params.__dict__, background_knowledge=None, cache_path=self.__class__.cache_path, verbose=self.__class__.verbose)
-        
+        bk = None
         if bgKnowledges and len(bgKnowledges) > 0:
             bk = self.constructBgKnowledge(bgKnowledges=bgKnowledges, f_ind={fid: i for i, fid in enumerate(focusedFields)})
-            self.G, self.edges = fci(array, **params.__dict__, background_knowledge=bk, cache_path=self.__class__.cache_path, verbose=self.__class__.verbose)
+        cit = self.getCIT(array, params.independence_test_method, alpha=params.alpha, **citOptions(params.independence_test_method, params))
+        self.G, self.edges = fciAlg(array, cit, **{k: v for k, v in params.__dict__.items() if k != 'independence_test_method'}, background_knowledge=bk, verbose=self.__class__.verbose, deadline=deadline)
         l = self.G.graph.tolist()
         return {
             'data': l,
             'matrix': l,
             'fields': self.safeFieldMeta(self.focusedFields),
-            'edges': self.edges
+            'edges': self.edges,
+            'extra': progress(self.G),
         }
\ No newline at end of file
@@ -6,7 +6,7 @@ from algorithms.common import getOpts, IDepTestItems, ICatEncodeType, IQuantEnco
 from algorithms.common import transDataSource, OptionalParams, ScoreFunctions
 import algorithms.common as common
 
-from causallearn.search.ScoreBased.GES import ges
+from algorithms.score import ges, localScore
 
 class GESParams(OptionalParams, title="GES Algorithm(暂不支持背景知识)"):
     """
@@ -46,13 +46,15 @@ class GES(AlgoInterface):
     def calc(self, params: Optional[ParamType] = ParamType(), focusedFields: List[str] = [], bgKnowledgesPag: Optional[List[common.BgKnowledgePag]] = [], **kwargs):
         array = self.selectArray(focusedFields=focusedFields, params=params)
         common.checkLinearCorr(array)
-        self.Record = ges(array, score_func=params.score_func, maxP=params.maxP if params.maxP else None)
+        score = localScore(array, params.score_func, key=self.fingerprint)
+        self.Record = ges(array, score, maxP=params.maxP if params.maxP else None)
     
         l = self.Record['G'].graph.tolist()
         return {
             'data': l,
             'matrix': l,
             'fields': self.safeFieldMeta(self.focusedFields),
+            'extra': {'scoresComputed': score.computed},
             # 'Record': json.dumps(self.Record)
         }
             # 'Record': self.Record
\ No newline at end of file
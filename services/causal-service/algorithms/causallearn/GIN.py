@@ -29,7 +29,6 @@ class GINParams(OptionalParams, title="GIN Algorithm(暂不支持背景知识)")
 class GIN(AlgoInterface):
     ParamType = GINParams
     def __init__(self, dataSource: List[IRow], fields: List[IFieldMeta], params: Optional[ParamType] = ParamType()):
-        print("GIN", dataSource, fields, params)
         super(GIN, self).__init__(dataSource=dataSource, fields=fields, params=params)
         
     def constructBgKnowledge(self, bgKnowledges: Optional[List[common.BgKnowledge]] = [], f_ind: Dict[str, int] = {}):
@@ -6,7 +6,11 @@ from algorithms.common import getOpts, IDepTestItems, ICatEncodeType, IQuantEnco
 from algorithms.common import transDataSource, OptionalParams, ScoreFunctions
 import algorithms.common as common
 from causallearn.utils.PCUtils.BackgroundKnowledge import BackgroundKnowledge
-from causallearn.search.PermutationBased.GRaSP import grasp
+from causallearn.graph.GeneralGraph import GeneralGraph
+from causallearn.graph.GraphNode import GraphNode
+from causallearn.utils.DAG2CPDAG import dag2cpdag
+import numpy as np
+from algorithms.score import localScore, graspRestarts
 
 class GRaSPParams(OptionalParams, title="GRaSP Algorithm(暂不支持背景知识)"):
     """Greedy relaxation of the sparsest permutation (GRaSP) algorithm.
@@ -24,6 +28,16 @@ class GRaSPParams(OptionalParams, title="GRaSP Algorithm(暂不支持背景知
         default=0, title='Max Number of Parents', description="Allowed maximum number of parents when searching the graph. Default: 0, which means not given",
         ge=0, le=32, multiple_of=1,
     )
+    restarts: Optional[int] = Field(
+        default=1, title="随机重启次数", # 'Random Restarts',
+        description="Searches from different random orders, run in parallel; the best scoring graph is returned, with the fraction of the searches in which each pair is adjacent (extra.edgeFrequency).",
+        ge=1, le=32, multiple_of=1,
+    )
+    seed: Optional[int] = Field(
+        default=0, title="随机种子", # 'Random Seed',
+        description="Seed of the first search, the i-th restart uses seed + i: the same seed gives the same graph.",
+        ge=0, multiple_of=1,
+    )
     """
     parameters: Needed when using CV likelihood. Default: None.
         parameters[‘kfold’]: k-fold cross validation.
@@ -50,10 +64,29 @@ class GRaSP(AlgoInterface):
         # common.checkLinearCorr(array)
         params.__dict__['cache_path'] = None # '/tmp/causal/pc.json'
         
-        G = grasp(array, params.score_func, params.depth, params.maxP, None)
-    
+        score = localScore(array, params.score_func, key=self.fingerprint)
+        p = array.shape[1]
+        runs = graspRestarts(score, p, params.depth, [params.seed + k for k in range(params.restarts or 1)])
+        best, parents = max(runs, key=lambda run: run[0])
+        nodes = [GraphNode(f"x{i}") for i in range(p)]
+        G = GeneralGraph(nodes)
+        for y in range(p):
+            for x in parents[y]:
+                G.add_directed_edge(nodes[x], nodes[y])
+        G = dag2cpdag(G)
+        frequency = np.zeros((p, p))
+        for _, ps in runs:
+            for y in range(p):
+                frequency[ps[y], y] += 1
+        frequency = (frequency + frequency.T) / len(runs)
+
         return {
             'data': G.graph.tolist(),
             'matrix': G.graph.tolist(),
             'fields': self.safeFieldMeta(self.focusedFields),
+            'extra': {
+                'scoresComputed': score.computed,
+                'scores': [run[0] for run in runs],
+                'edgeFrequency': frequency,
+            },
         }
\ No newline at end of file
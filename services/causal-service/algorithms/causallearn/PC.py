@@ -3,7 +3,8 @@ import traceback
 from pydantic import Field
 
 from algorithms.common import getOpts, IDepTestItems, ICatEncodeType, IQuantEncodeType, UCPriorityItems, UCRuleItems, AlgoInterface, IRow, IDataSource, IFieldMeta, IFields
-from algorithms.common import transDataSource, OptionalParams
+from algorithms.common import transDataSource, OptionalParams, citOptions
+from algorithms.constraint import pcAlg, alphaSweep, progress
 import algorithms.common as common
 
 from causallearn.search.ConstraintBased.PC import get_adjacancy_matrix, pc
@@ -28,6 +29,16 @@ class PCParams(OptionalParams, title="PC Algorithm"):
         description="The independence test to use for causal discovery",
         options=getOpts(IDepTestItems),
     )
+    kciRank: Optional[int] = Field(
+        default=50, title="KCI近似秩", # 'KCI Rank',
+        description="kci only: rank of the low-rank kernel matrices. Higher is closer to the exact test and slower.",
+        ge=10, le=500, multiple_of=1
+    )
+    kciMaxRows: Optional[int] = Field(
+        default=2000, title="KCI最大行数", # 'KCI Max Rows',
+        description="kci only: the tests run on at most this many rows, a fixed random subset of the table.",
+        ge=200, le=200000, multiple_of=1
+    )
     alpha: Optional[float] = Field(
         default=0.05, title="显著性阈值", # "Alpha",
         description="desired significance level (float) in (0, 1). Default: 0.05.",
@@ -68,25 +79,35 @@ class PC(AlgoInterface):
                 self.bk.add_forbidden_by_node(node[f_ind[k.src]], node[f_ind[k.tar]])
         return self.bk
         
-    def calc(self, params: Optional[ParamType] = ParamType(), focusedFields: List[str] = [], bgKnowledgesPag: Optional[List[common.BgKnowledgePag]] = [], **kwargs):
+    def calc(self, params: Optional[ParamType] = ParamType(), focusedFields: List[str] = [], bgKnowledgesPag: Optional[List[common.BgKnowledgePag]] = [], sessionId: Optional[str] = None, alphas: Optional[List[float]] = None, deadline: Optional[float] = None, **kwargs):
         array = self.selectArray(focusedFields=focusedFields, params=params)
         # common.checkLinearCorr(array)
-        print("fields=", self.fields)
-        print("array=", array)
         
         params.__dict__['cache_path'] = None # '/tmp/causal/pc.json'
         
-        # self.cg = pc(array, params.alpha, params.indep_test, params.stable, params.uc_rule, params.uc_priority, params.mvpc, cache_path=self.__class__.cache_path)
-        self.cg = pc(array, **params.__dict__, background_knowledge=None, verbose=self.__class__.verbose)
-        
+        bk = None
         if bgKnowledgesPag and len(bgKnowledgesPag) > 0:
             f_ind = {fid: i for i, fid in enumerate(focusedFields)}
             bk = self.constructBgKnowledgePag(bgKnowledgesPag=bgKnowledgesPag, f_ind=f_ind)
+        if params.mvpc:
             self.cg = pc(array, **params.__dict__, background_knowledge=bk, verbose=self.__class__.verbose)
+            extra = alphaSweep(lambda alpha: (pc(array, **{**params.__dict__, 'alpha': alpha}, background_knowledge=bk).G.graph.tolist(), {}), alphas, None)
+        else:
+            # CI tests are cached per encoded dataset, reruns with new background knowledge only redo the orientation.
+            cit = self.getCIT(array, params.indep_test, alpha=[params.alpha, *(alphas or [])], **citOptions(params.indep_test, params))
+            run = lambda alpha: pcAlg(array, cit, alpha, params.stable, params.uc_rule, params.uc_priority,
+                                      background_knowledge=bk, verbose=self.__class__.verbose,
+                                      sessionId=sessionId, sessionKey=('PC', self.fingerprint, params.indep_test), deadline=deadline)
+            self.cg = run(params.alpha)
+            extra = {
+                **progress(self.cg),
+                **alphaSweep(lambda alpha: (lambda cg: (cg.G.graph.tolist(), progress(cg)))(run(alpha)), alphas, getattr(self.cg, 'max_pvalues', None)),
+            }
     
         l = self.cg.G.graph.tolist()
         return {
             'data': l,
             'matrix': l,
-            'fields': self.safeFieldMeta(self.focusedFields)
+            'fields': self.safeFieldMeta(self.focusedFields),
+            'extra': extra,
         }
\ No newline at end of file
@@ -3,14 +3,14 @@ import traceback
 from pydantic import Field
 
 from algorithms.common import getOpts, IDepTestItems, ICatEncodeType, IQuantEncodeType, UCPriorityItems, UCRuleItems, AlgoInterface, IRow, IDataSource, IFieldMeta, IFields
-from algorithms.common import transDataSource, OptionalParams, ScoreFunctions, BandwidthMethods
+from algorithms.common import transDataSource, OptionalParams, ScoreFunctions, BandwidthMethods, HsicMethods
 import algorithms.common as common
 from causallearn.utils.PCUtils.BackgroundKnowledge import BackgroundKnowledge
 
 from causallearn.graph.GeneralGraph import GeneralGraph
 from causallearn.graph.Node import Node
 
-from causallearn.search.FCMBased import lingam
+from algorithms.hsic import RCD as RCDModel, HSIC
 
 class RCDParams(OptionalParams, title="RCD Algorithm(暂不支持背景知识)"):
     max_explanatory_num: Optional[int] = Field(
@@ -39,6 +39,16 @@ class RCDParams(OptionalParams, title="RCD Algorithm(暂不支持背景知识)")
         description="The method used to calculate the bandwidth of the HSIC.",
         options=getOpts(BandwidthMethods)
     )
+    hsicMethod: Optional[str] = Field(
+        default='auto', title="HSIC计算方式", # 'HSIC Method',
+        description="Exact HSIC tests are quadratic in the number of rows; the approximations are linear, see algorithms.hsic.",
+        options=getOpts(HsicMethods)
+    )
+    hsicRank: Optional[int] = Field(
+        default=100, title="HSIC近似秩", # 'HSIC Rank',
+        description="Rank of the approximate Gram matrices (icl, rff).",
+        ge=10, le=1000, multiple_of=1
+    )
     
 
 class RCD(AlgoInterface):
@@ -61,10 +71,8 @@ class RCD(AlgoInterface):
         # common.checkLinearCorr(array)
         params.__dict__['cache_path'] = None # '/tmp/causal/pc.json'
         
-        if params.num_explanatory_vals == 0:
-            params.num_explanatory_vals = array.shape[1]
-        
-        model = lingam.RCD(params.max_explanatory_num, params.cor_alpha, params.ind_alpha, params.shapiro_alpha, params.MLHSICR, params.bw_method)
+        test = HSIC(params.hsicMethod, params.hsicRank, params.bw_method, n=array.shape[0])
+        model = RCDModel(params.max_explanatory_num, params.cor_alpha, params.ind_alpha, params.shapiro_alpha, params.MLHSICR, params.bw_method, test=test)
         model.fit(array)
         dag = model.adjacency_matrix_
         import numpy as np
@@ -75,10 +83,13 @@ class RCD(AlgoInterface):
                 pag[p, i] = -1
                 pag[i, p] = 1
         
+        # the pairs sharing a latent confounder are NaN in the coefficients
+        confounded = np.isnan(dag)
         return {
-            'data': dag,
+            'data': np.where(confounded, 0, dag),
             'matrix': pag,
             'ancestors': model.ancestors_list_,
             'fields': self.safeFieldMeta(self.focusedFields),
+            'extra': {'hsicMethod': test.method, 'confounded': [[int(i), int(j)] for i, j in zip(*np.nonzero(np.triu(confounded | confounded.T)))]},
         }
         
\ No newline at end of file
@@ -8,24 +8,25 @@ from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, Field
 
 from algorithms.common import getOpts, IDepTestItems, ICatEncodeType, IQuantEncodeType, UCPriorityItems, UCRuleItems, AlgoInterface, IRow, IDataSource, IFieldMeta, IFields
-from algorithms.common import transDataSource, OptionalParams
+from algorithms.common import transDataSource, OptionalParams, citOptions
 import algorithms.common as common
 
 import causallearn.search.ConstraintBased.FCI as FCI
-from causallearn.search.ConstraintBased.FCI import fci
 from causallearn.utils.PCUtils import SkeletonDiscovery
 from causallearn.utils.PCUtils.BackgroundKnowledge import BackgroundKnowledge
 from causallearn.utils.PCUtils.BackgroundKnowledgeOrientUtils import orient_by_background_knowledge
+from algorithms.skeleton import fas, ColumnsCIT
+from algorithms.constraint import alphaSweep, progress, possibleDsep, orientPag
 
 def xlearn(dataset: np.ndarray, independence_test_method: str=FCI.fisherz, alpha: float = 0.05, depth: int = -1,
         max_path_length: int = -1, verbose: bool = False, background_knowledge: BackgroundKnowledge | None = None,
-        functional_dependencies: List[common.IFunctionalDep]=[], f_ind={}, fields=[], **kwargs) -> Tuple[FCI.Graph, List[FCI.Edge]]:
+        functional_dependencies: List[common.IFunctionalDep]=[], f_ind={}, fields=[], pvalues: Optional[np.ndarray] = None, deadline: Optional[float] = None, **kwargs) -> Tuple[FCI.Graph, List[FCI.Edge]]:
     """
     Parameters
     ----------
     dataset: data set (numpy ndarray), shape (n_samples, n_features). The input data, where n_samples is the number of
             samples and n_features is the number of features.
-    independence_test_method: str, name of the function of the independence test being used
+    independence_test_method: str, name of the function of the independence test being used, or a CIT built on dataset
             [fisherz, chisq, gsq, kci]
            - fisherz: Fisher's Z conditional independence test
            - chisq: Chi-squared conditional independence test
@@ -37,6 +38,9 @@ def xlearn(dataset: np.ndarray, independence_test_method: str=FCI.fisherz, alpha
     verbose: True is verbose output should be printed or logged
     background_knowledge: background knowledge
     functional_dependencies: functional dependencies
+    pvalues: (n_features, n_features) matrix filled with the max p-value of each pair in the adjacency searches
+    deadline: time.time() after which the adjacency searches stop at their last completed depth, and the
+            possible-dsep removals are skipped; the graph is then marked partial
 
     Returns
     -------
@@ -55,7 +59,8 @@ def xlearn(dataset: np.ndarray, independence_test_method: str=FCI.fisherz, alpha
     if dataset.shape[0] < dataset.shape[1]:
         FCI.warnings.warn("The number of features is much larger than the sample size!")
 
-    independence_test_method = FCI.CIT(dataset, method=independence_test_method, **kwargs)
+    if isinstance(independence_test_method, str):
+        independence_test_method = FCI.CIT(dataset, method=independence_test_method, **kwargs)
 
     ## ------- check parameters ------------
     if (depth is None) or type(depth) != int:
@@ -80,7 +85,7 @@ def xlearn(dataset: np.ndarray, independence_test_method: str=FCI.fisherz, alpha
             res.append(u)
             for j in adj[u]: 
                 cnt[j] -= 1
-                if cnt[j] == 0: res.append(j)
+                if cnt[j] == 0: Q.append(j)
         return res
     FDNodes: List[FCI.Node] = []
     NodeId: Dict[str, int] = {}
@@ -142,14 +147,15 @@ def xlearn(dataset: np.ndarray, independence_test_method: str=FCI.fisherz, alpha
             # TODO: depends on more than one params: should be treated the same as bgKnowledge
             pass
     topo = toposort(adj)
+    # number of distinct values of each column of Gfd, the determinant kept for a node is its ancestor of most values
+    cardinality = [np.unique(dataset[:, u]).size for u in attr_id]
     
     fake_knowledge = BackgroundKnowledge()
     skeleton_knowledge = set()
     for t in topo[::-1]:
         mxvcnt, y = 0, -1
         for a in anc[t]:
-            print("a = ", a, attr_id[a])
-            vcnt = np.unique(dataset[:, attr_id[a]]).size
+            vcnt = cardinality[a]
             if vcnt > mxvcnt:
                 y = a
                 mxvcnt = vcnt
@@ -162,14 +168,23 @@ def xlearn(dataset: np.ndarray, independence_test_method: str=FCI.fisherz, alpha
         G_fd.remove(attr_id[t])
         for a in anc[t]:
             adj[a].remove(t)
+    # the adjacency search on Gfd tests its columns through the CIT of the whole dataset: the tests are cached for the
+    # global search, which starts from its separations instead of testing those pairs again
+    columns = sorted(G_fd)
     GfdNodes = []
-    for i, v in enumerate(G_fd):
+    for v in columns:
         node = FCI.GraphNode(f"X{v + 1}")
         node.add_attribute("id", v)
         GfdNodes.append(node)
-    FDgraph, FD_sep_sets = FCI.fas(dataset, GfdNodes, independence_test_method=independence_test_method, alpha=alpha,
-                          knowledge=None, depth=depth, verbose=verbose)
-    print("FDGraph:", FDgraph, FD_sep_sets)
+    fd_pvalues = None if pvalues is None else np.zeros((len(columns), len(columns)))
+    FDgraph, FD_sep_sets = fas(dataset, GfdNodes, independence_test_method=ColumnsCIT(independence_test_method, columns),
+                               alpha=alpha, knowledge=None, depth=depth, verbose=verbose, pvalues=fd_pvalues, deadline=deadline)
+    if pvalues is not None:
+        pvalues[np.ix_(columns, columns)] = np.maximum(pvalues[np.ix_(columns, columns)], fd_pvalues)
+    separated = {}
+    for (i, j), sepset in FD_sep_sets.items():
+        x, y = columns[i], columns[j]
+        separated[(min(x, y), max(x, y))] = {columns[k] for k in sepset}
     
     # S = S join fas(dataset, GV)
     nodes = []
@@ -181,15 +196,13 @@ def xlearn(dataset: np.ndarray, independence_test_method: str=FCI.fisherz, alpha
     for i in range(FDgraph.graph.shape[0]):
         for j in range(i):
             if FDgraph.graph[i, j] == -1:
-                x, y = attr_id[i], attr_id[j]
+                x, y = columns[i], columns[j]
                 skeleton_knowledge.add((x, y))
             # if FDgraph.graph[i, j] == -1:
             #     fake_knowledge.add_required_by_node(node[x], node[y])
             # if FDgraph.graph[j, i] == -1:
             #     fake_knowledge.add_required_by_node(node[y], node[x])
     
-    print("fake_knowledge =", fake_knowledge)
-    print(skeleton_knowledge)
     # for k in fake_knowledge.required_rules_specs:
     #     print(k[0].get_all_attributes(), k[1].get_all_attributes())
     
@@ -198,15 +211,13 @@ def xlearn(dataset: np.ndarray, independence_test_method: str=FCI.fisherz, alpha
             background_knowledge.add_required_by_node(nodes[f_ind[p.fid]], nodes[f_ind[funcDep.fid]])
 
     # FAS (“Fast Adjacency Search”) is the adjacency search of the PC algorithm, used as a first step for the FCI algorithm.
-    graph, sep_sets = FCI.fas(dataset, nodes, independence_test_method=independence_test_method, alpha=alpha,
-                          knowledge=background_knowledge, depth=depth, verbose=verbose)
+    graph, sep_sets = fas(dataset, nodes, independence_test_method=independence_test_method, alpha=alpha,
+                          knowledge=background_knowledge, depth=depth, verbose=verbose, pvalues=pvalues, deadline=deadline,
+                          separated=separated)
     for u, v in skeleton_knowledge:
-        print(u, v)
         graph.add_edge(FCI.Edge(nodes[u], nodes[v], FCI.Endpoint.TAIL, FCI.Endpoint.TAIL))
         # graph[u, v] = graph[v, u] = -1
     
-    print("global fas graph =", graph)
-    print({u: s for u, s in sep_sets.items() if len(s)})
     # return graph, sep_sets
     # forbid_knowledge = BackgroundKnowledge()
     # for (u, v) in background_knowledge.forbidden_rules_specs:
@@ -223,62 +234,16 @@ def xlearn(dataset: np.ndarray, independence_test_method: str=FCI.fisherz, alpha
         ori_edge.set_endpoint2(FCI.Endpoint.CIRCLE)
         graph.add_edge(ori_edge)
 
-    sp = FCI.SepsetsPossibleDsep(dataset, graph, independence_test_method, alpha, background_knowledge, depth,
-                             max_path_length, verbose)
-
-    FCI.rule0(graph, nodes, sep_sets, background_knowledge, verbose)
-
-    waiting_to_deleted_edges = []
-
-    for edge in graph.get_graph_edges():
-        node_x = edge.get_node1()
-        node_y = edge.get_node2()
-
-        sep_set = sp.get_sep_set(node_x, node_y)
-
-        if sep_set is not None:
-            waiting_to_deleted_edges.append((node_x, node_y, sep_set))
-
-    for waiting_to_deleted_edge in waiting_to_deleted_edges:
-        dedge_node_x, dedge_node_y, dedge_sep_set = waiting_to_deleted_edge
-        graph.remove_edge(graph.get_edge(dedge_node_x, dedge_node_y))
-        sep_sets[(graph.node_map[dedge_node_x], graph.node_map[dedge_node_y])] = dedge_sep_set
-
-        if verbose:
-            message = "Possible DSEP Removed " + dedge_node_x.get_name() + " --- " + dedge_node_y.get_name() + " sepset = ["
-            for ss in dedge_sep_set:
-                message += graph.nodes[ss].get_name() + " "
-            message += "]"
-            print(message)
-
-    FCI.reorientAllWith(graph, FCI.Endpoint.CIRCLE)
     FCI.rule0(graph, nodes, sep_sets, background_knowledge, verbose)
 
-    change_flag = True
-    first_time = True
+    partial = FDgraph.partial or graph.partial
+    if not partial:
+        partial = not possibleDsep(dataset, graph, sep_sets, independence_test_method, alpha, background_knowledge,
+                                   depth, max_path_length, verbose, deadline)
 
-    while change_flag:
-        change_flag = False
-        change_flag = FCI.rulesR1R2cycle(graph, background_knowledge, change_flag, verbose)
-        change_flag = FCI.ruleR3(graph, sep_sets, background_knowledge, change_flag, verbose)
-
-        if change_flag or (first_time and background_knowledge is not None and
-                           len(background_knowledge.forbidden_rules_specs) > 0 and
-                           len(background_knowledge.required_rules_specs) > 0 and
-                           len(background_knowledge.tier_map.keys()) > 0):
-            change_flag = FCI.ruleR4B(graph, max_path_length, dataset, independence_test_method, alpha, sep_sets,
-                                  change_flag,
-                                  background_knowledge, verbose)
-
-            first_time = False
-
-            if verbose:
-                print("Epoch")
-
-    graph.set_pag(True)
-
-    edges = FCI.get_color_edges(graph)
-    
+    graph, edges = orientPag(graph, nodes, sep_sets, dataset, independence_test_method, alpha, max_path_length,
+                             background_knowledge, verbose)
+    graph.partial = partial
     return graph, edges
 
 
@@ -304,6 +269,16 @@ class XLearnerParams(OptionalParams, title="XLearn"):
         description="Independence test method function.  Default: ‘fisherz’",
         options=getOpts(IDepTestItems),
     )
+    kciRank: Optional[int] = Field(
+        default=50, title="KCI近似秩", # 'KCI Rank',
+        description="kci only: rank of the low-rank kernel matrices. Higher is closer to the exact test and slower.",
+        ge=10, le=500, multiple_of=1
+    )
+    kciMaxRows: Optional[int] = Field(
+        default=2000, title="KCI最大行数", # 'KCI Max Rows',
+        description="kci only: the tests run on at most this many rows, a fixed random subset of the table.",
+        ge=200, le=200000, multiple_of=1
+    )
     alpha: Optional[float] = Field(
         default=0.05, title="显著性阈值", # "Alpha",
         description="Significance level of individual partial correlation tests. Default: 0.05.",
@@ -336,21 +311,28 @@ class XLearner(AlgoInterface):
                 self.bk.add_forbidden_by_node(node[f_ind[k.src]], node[f_ind[k.tar]])
         return self.bk
     
-    def calc(self, params: Optional[ParamType] = ParamType(), focusedFields: List[str] = [], bgKnowledgesPag: Optional[List[common.BgKnowledgePag]] = [], funcDeps: common.IFunctionalDep = [],  **kwargs):
+    def calc(self, params: Optional[ParamType] = ParamType(), focusedFields: List[str] = [], bgKnowledgesPag: Optional[List[common.BgKnowledgePag]] = [], funcDeps: common.IFunctionalDep = [], alphas: Optional[List[float]] = None, deadline: Optional[float] = None, **kwargs):
         array = self.selectArray(focusedFields=focusedFields, params=params)
         # common.checkLinearCorr(array)
-        print(array, array.min(), array.max())
-        self.G, self.edges = fci(array, **params.__dict__, background_knowledge=None, cache_path=self.__class__.cache_path, verbose=self.__class__.verbose)
         
         # if bgKnowledges and len(bgKnowledges) > 0:
         f_ind = {fid: i for i, fid in enumerate(focusedFields)}
         bk = self.constructBgKnowledgePag(bgKnowledgesPag=bgKnowledgesPag if bgKnowledgesPag else [], f_ind=f_ind)
-            
-        self.G, self.edges = xlearn(array, **params.__dict__, background_knowledge=bk, functional_dependencies=funcDeps, f_ind=f_ind, fields=focusedFields, cache_path=self.__class__.cache_path, verbose=self.__class__.verbose)
+        # the CI tests of both adjacency searches in xlearn are cached per encoded dataset
+        cit = self.getCIT(array, params.independence_test_method, alpha=[params.alpha, *(alphas or [])], **citOptions(params.independence_test_method, params))
+        
+        pvalues = np.zeros((array.shape[1], array.shape[1]))
+        run = lambda alpha, pvalues=None: xlearn(array, **{**params.__dict__, 'independence_test_method': cit, 'alpha': alpha}, background_knowledge=bk, functional_dependencies=funcDeps, f_ind=f_ind, fields=focusedFields, pvalues=pvalues, deadline=deadline, cache_path=self.__class__.cache_path, verbose=self.__class__.verbose)
+        self.G, self.edges = run(params.alpha, pvalues)
+        extra = {
+            **progress(self.G),
+            **alphaSweep(lambda alpha: (lambda G: (G.graph.tolist(), progress(G)))(run(alpha)[0]), alphas, pvalues),
+        }
         l = self.G.graph.tolist()
         return {
             'data': l,
             'matrix': l,
             'fields': self.safeFieldMeta(self.focusedFields),
-            'edges': self.edges
+            'edges': self.edges,
+            'extra': extra,
         }
\ No newline at end of file
@@ -0,0 +1,35 @@
+"""
+Base of the CI test engines which evaluate many tests at once (see fisherz, countcube).
+A batch engine is a causallearn CIT, so single tests and the p-value cache work as usual;
+`batch(tests)` fills the cache for a list of (x, y, S) tests, e.g. a whole depth level of a skeleton search.
+"""
+import numpy as np
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+Test = Tuple[int, int, Tuple[int, ...]]
+
+class BatchCIT:
+    BATCH_SIZE = 1 << 16
+
+    def pending(self, tests: List[Test]) -> Dict[str, List[int]]:
+        """cache key -> [x, y, *S] of the tests which are not cached yet"""
+        res = {}
+        for x, y, S in tests:
+            Xs, Ys, S, key = self.get_formatted_XYZ_and_cachekey(x, y, S)
+            if key not in self.pvalue_cache and key not in res:
+                res[key] = Xs + Ys + S
+        return res
+
+    def groups(self, tests: List[Test]):
+        """Pending tests grouped by size of the conditioning set: (keys, int array of shape (m, |S|+2))."""
+        groups = defaultdict(list)
+        for key, var in self.pending(tests).items():
+            groups[len(var)].append((key, var))
+        for _, items in sorted(groups.items()):
+            for i in range(0, len(items), self.BATCH_SIZE):
+                chunk = items[i:i+self.BATCH_SIZE]
+                yield [key for key, _ in chunk], np.array([var for _, var in chunk], dtype=np.int64)
+
+    def batch(self, tests: List[Test]):
+        raise NotImplementedError
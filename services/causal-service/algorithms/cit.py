@@ -0,0 +1,85 @@
+import os, json, hashlib, threading
+from functools import partial, lru_cache
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Tuple, Optional, Any
+from algorithms.metrics import countTests
+
+@lru_cache(maxsize=None)
+def engines() -> Dict[str, Any]:
+    """
+    CI test engines used instead of causallearn's, they must support the same kwargs.
+    Imported on first use: causallearn.utils.cit takes seconds to import, which the service does not pay at startup.
+    """
+    from algorithms.fisherz import FisherZ, MVFisherZ
+    from algorithms.countcube import ChisqGsq
+    from algorithms.kci import KCI
+    return {
+        'fisherz': FisherZ,
+        'mv_fisherz': MVFisherZ,
+        'chisq': partial(ChisqGsq, method_name='chisq'),
+        'gsq': partial(ChisqGsq, method_name='gsq'),
+        'kci': KCI,
+    }
+
+class CITCache:
+    """
+    p-value tables of conditional independence tests, shared by every CIT built on the same data.
+    A table is keyed by (dataset fingerprint, test method, test parameters); inside a table,
+    tests are keyed by causallearn's (x, y | S) cache key. Whole tables are evicted in LRU order
+    once the total number of cached tests exceeds max_tests.
+    """
+    def __init__(self, max_tests: int):
+        self.max_tests = max_tests
+        self.tables: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def table(self, key: Tuple, init: Dict) -> Dict:
+        with self.lock:
+            table = self.tables.get(key, None)
+            if table is None:
+                table = self.tables[key] = dict(init)
+            self.tables.move_to_end(key)
+            total = sum(len(t) for t in self.tables.values())
+            while total > self.max_tests and len(self.tables) > 1:
+                _, t = self.tables.popitem(last=False)
+                total -= len(t)
+            return table
+
+    def clear(self):
+        with self.lock:
+            self.tables.clear()
+
+citCache = CITCache(max_tests=int(os.environ.get('CAUSAL_CIT_CACHE_SIZE', 2000000)))
+
+def fingerprint(*key: Any) -> str:
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+def getCIT(data: np.ndarray, method: str, key: Optional[str] = None, **kwargs):
+    """
+    Build a causallearn CIT whose p-value cache is shared with previous CITs of the same key.
+    key: fingerprint of `data`, None to use a private cache.
+    """
+    from causallearn.utils.cit import CIT
+    kwargs.pop('cache_path', None)
+    ENGINES = engines()
+    cit = ENGINES[method](data, **kwargs) if method in ENGINES else CIT(data, method, **kwargs)
+    if key is not None and citCache.max_tests > 0:
+        params = json.dumps({k: v for k, v in kwargs.items() if isinstance(v, (int, float, str, bool))}, sort_keys=True)
+        cit.pvalue_cache = citCache.table((key, method, params), cit.pvalue_cache)
+    return cit
+
+def prefetch(cit, tests):
+    """Fill the cache of a batch engine with the given (x, y, S) tests, no-op for other CITs."""
+    if hasattr(cit, 'batch'):
+        cit.batch(tests)
+
+def pairwisePValues(cit, d: int) -> np.ndarray:
+    """Symmetric (d, d) matrix of the marginal tests of every pair, computed in one batch on batch engines."""
+    pairs = [(i, j, ()) for i in range(d) for j in range(i)]
+    prefetch(cit, pairs)
+    res = np.zeros((d, d))
+    for i, j, S in pairs:
+        res[i, j] = res[j, i] = cit(i, j, S)
+    countTests(0, len(pairs))
+    return res
@@ -3,12 +3,18 @@ import os, sys, json, time, argparse
 import numpy as np, pandas as pd
 from typing import Dict, List, Tuple, Optional, Union, Literal, Any
 import traceback
-from fastapi import FastAPI, Response, status
+from fastapi import FastAPI, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, Field, Extra
 import traceback
 from causallearn.utils.PCUtils.BackgroundKnowledge import BackgroundKnowledge
+from algorithms.dataset import store as datasetStore, readArrow
+from algorithms.encoding import encodeFields
+from algorithms.cit import getCIT, fingerprint
+from algorithms.sampling import sampleSizes, stratifiedOrder, sampleRows, EscalatingCIT
+from algorithms.metrics import Profile, stage
 
 IRow = Dict[str, object]
 IDataSource = List[IRow]
@@ -38,7 +44,7 @@ IDepTestItems = {
     'gsq': 'G检验', # ('g-square', 'G-squared conditional independence test.'),
     'chisq': '卡方条件独立性检验', # ('chi-square', 'Chi-squared conditional independence test.'),
     'fisherz': 'Fisher-Z变换', # ('fisher-z', 'Fisher’s Z conditional independence test.'),
-    # 'kci': ('kernel-based conditional independence test', '(As a kernel method, its complexity is cubic in the sample size, so it might be slow if the same size is not small.)'),
+    'kci': '核条件独立性检验', # ('kernel-based conditional independence test', 'Low-rank approximation on at most kciMaxRows rows, see algorithms.kci'),
     'mv_fisherz': '允许空值的Fisher-Z变换' # ('missing-value fisher-z', 'Missing-value Fisher’s Z'),
     # 'mc_fisherz': ('missing correction fisher-z', "Fisher-Z's test with test-wise deletion and missingness correction")
 }
@@ -72,6 +78,12 @@ BandwidthMethods = {
     'scott': "cott’s Rule of Thumb.",
     'silverman': "Silverman’s Rule of Thumb.",
 }
+HsicMethods = {
+    'auto': ('Auto', "Exact up to CAUSAL_HSIC_EXACT_ROWS rows (default 2000), incomplete Cholesky beyond"),
+    'exact': ('Exact', "Full Gram matrices, quadratic in the number of rows"),
+    'icl': ('Incomplete Cholesky', "Low-rank factor of the Gram matrices, of at most the given rank"),
+    'rff': ('Random Fourier features', "Random features of the RBF kernel, as many as the given rank"),
+}
 
 def getOpts(Items: Dict):
     return [
@@ -88,7 +100,6 @@ def getOpts(Items: Dict):
 
 
 def checkLinearCorr(array: np.ndarray):
-    print(array)
     for i in range(8):
         if np.linalg.matrix_rank(array) < array.shape[1]:
             U, s, VT = np.linalg.svd(array)
@@ -119,175 +130,52 @@ class OptionalParams(BaseModel, extra=Extra.allow):
         description="The encoding to use for quantitative variables",
         options=getOpts(IQuantEncodeType)
     )
+    sampleSize: Optional[int] = Field(
+        default=200000, title="采样行数", #"Sample Size",
+        description="Tables with more rows are sampled (stratified); CI tests near the significance level are rerun on larger samples. 0: use every row",
+        ge=0
+    )
     # keepOriginQuant: Optional[bool] = Field(
     #     default=False, title="Keep Original Quantitative Variables", description="Whether to keep the original quantitative variables", allow_mutation=False
     # )
     # verbose: bool = False, show_progress: bool = True, **kwargs: Any
 
 
+def citOptions(method: str, params: BaseModel) -> Dict[str, Any]:
+    """kwargs of the CI test engine from the params of an algorithm (kciRank, kciMaxRows)"""
+    if method != 'kci':
+        return {}
+    return {'rank': getattr(params, 'kciRank', None) or 50, 'max_rows': getattr(params, 'kciMaxRows', None) or 2000}
+
 class IFieldMeta(BaseModel):
     fid: str
     name: Optional[str]
     semanticType: str
     ''' 'quantitative' | 'nominal' | 'ordinal' | 'temporal' '''
 
-def encodeCat(origin: pd.Series, fact: pd.Series, encodeType: str) -> pd.DataFrame:
-    # if encodeType == 'binary': # encodeType.binary: 
-    #     '''invalid'''
-    #     df = None
-    #     mxv = fact.max()
-    #     for i in range(31):
-    #         if (mxv >> i) == 0:
-    #             break
-    #         v = pd.Series((fact & (1 << i)) != 0, dtype=float, name=str(fact.name)+f"&(1<<{i})")
-    #         v += np.random.randn(v.size)
-    #         df = pd.concat([df, v], axis=1)
-    #     return df
-    if encodeType == 'lex': # encodeType.lex:
-        # print('lex', origin.rank(method="min"), sep='\n')
-        # return pd.DataFrame(data=pd.Series(origin.rank(method="min"), name=str(origin.name))+0.0)
-        return pd.DataFrame(data=pd.Series(origin.rank(method="max"), name=str(origin.name))) # +1e-3*np.random.randn(origin.size))
-    elif encodeType == 'one-hot': # encodeType.oneHot:
-        if fact.max() >= 64:
-            raise Exception("too many values for one-hot encoding")
-        code = pd.get_dummies(origin)
-        for v in code.columns:
-            code[v].rename(origin.name + '.' + v)
-        return code
-    elif encodeType == 'one-hot-with-noise':
-        cnt = origin.value_counts()
-        k, threshold = 16, 5
-        noise_type = 0  # 0: kth, 1: by threshold
-        v_cnt = len(cnt)
-        values = None
-        if v_cnt <= k:
-            code = pd.Series(range(v_cnt))
-            values = pd.Series(cnt.index.values, index=code)
-        else:
-            code = pd.Series([*range(k-1), *([k-1] * (v_cnt + 1 - k))])
-            values = pd.Series(cnt.index.values[:k], index=code[:k], copy=True)
-            values[k-1] = '~'
-        code_map = pd.DataFrame({'value': cnt.index, 'cnt': cnt.to_numpy(), 'code': code}).set_index('value')
-        x = pd.Series(values.loc[code_map.loc[origin.values]['code'].values].values, name=origin.name)
-        code = pd.get_dummies(x)
-        for v in code.columns:
-            code = code.assign(**{f"{x.name}.[{str(v)}]": code[v].values}).drop(columns=[v])
-        return code
-    elif encodeType == 'topk-with-noise':
-        """
-        topk-with-noise: merge categories with frequency less than 5 or frequency of the k-th most frequent value together.
-        """
-        cnt = origin.value_counts()
-        k, threshold = 16, 5
-        noise_type = 0  # 0: kth, 1: by threshold
-        v_cnt = len(cnt)
-        if noise_type == 0:
-            if v_cnt <= k:
-                code = pd.Series(range(v_cnt))
-            else:
-                code = pd.Series([*range(k-1), *([k-1] * (v_cnt + 1 - k))])
-            # print("code", code)
-            code_map = pd.DataFrame({'value': cnt.index, 'cnt': cnt.to_numpy(), 'code': code}).set_index('value')
-            return pd.DataFrame({origin.name: code_map.loc[origin.values]['code'].values})
-        else:
-            raise Exception("not implemented")
-    elif encodeType == 'random':
-        raise Exception("not implemented")
-    return pd.DataFrame(fact)
-
-def encodeQuant(x: pd.Series, encodeType: str) -> pd.DataFrame:
-    n, eps = 16, 1e-5
-    if encodeType == 'bin': # encodeType.bin:
-        width = x.max() - x.min()
-        if width == 0: return pd.DataFrame(x)
-        res = pd.Series( (x - x.min()) * (n - eps) * (1 / width), dtype=np.int32, name=x.name) * (width / (n - eps))
-        return pd.DataFrame(res)
-    elif encodeType == 'order': # encodeType.order:
-        x = pd.Series(x.factorize(sort=True)[0], name=x.name)
-        return x
-    elif encodeType == 'binned-order':
-        order = pd.Series(x.factorize(sort=True)[0])
-        len = x.size
-        raise Exception("not implemented")
-    elif encodeType == 'cnt-bin':
-        group, cut_bin = pd.qcut(x, q=n, retbins=True)
-        return pd.Series(((cut_bin[:-1] + cut_bin[1:]) * .5)[group], name=x.name)
-        
-    return pd.DataFrame(x)
-
 def trans(df: pd.DataFrame, fields: List[IFieldMeta], params: OptionalParams):
-    params.keepOriginCat, params.keepOriginQuant = False, False
-    fids = [f.fid for f in fields]
-    res = pd.DataFrame(df.loc[:, fids])
-    res_fields: List[IFieldMeta] = []
-    for f in fields:
-        # print(f, f.semanticType)
-        if f.semanticType == 'nominal' or df[f.fid].dtype.kind in 'bcOSUV':
-            if params.catEncodeType is not None:
-                code, _ = df[f.fid].factorize()
-                # res[f.fid] = code + np.random.randn(code.size) * 1e-3
-                try:
-                    newcode = encodeCat(df[f.fid], pd.Series(code, name=f.fid), params.catEncodeType)
-                except Exception as e:
-                    with sys.stderr:
-                        print(f"encodeCat by {params.catEncodeType} failed:")
-                        traceback.print_exception(e)
-                # print("newcode-nominal", newcode)
-                if params.keepOriginCat or newcode.size == 0:
-                    res_fields.append(f)
-                else:
-                    res.drop(columns=[f.fid])
-                # res = pd.concat([res, newcode], axis=1)
-                res.loc[:, newcode.columns] = newcode
-                for col in list(newcode.columns):
-                    res_fields.append(IFieldMeta(fid=col, name=f.name+(col.replace(f.fid, '', 1)), semanticType='ordinal'))
-                # print(df.shape, res.shape)
-        elif f.semanticType == 'temporal':
-            if df[f.fid].dtype in [np.dtype('O'), object, str, pd.CategoricalDtype]:
-                code = (pd.to_datetime(df[f.fid]) - pd.Timestamp("1970-01-01")) // pd.Timedelta('1s')
-                # res[f.fid] = code
-                # res[f.fid] = code + np.random.randn(code.size) * 1e-3
-                newcode = encodeCat(df[f.fid], pd.Series(code, name=f.fid), params.catEncodeType)
-                # print("newcode-temporal", newcode)
-                if params.keepOriginCat or newcode.size == 0:
-                    res_fields.append(f)
-                else:
-                    res.drop(columns=[f.fid])
-                for col in list(newcode.columns):
-                    res_fields.append(IFieldMeta(fid=col, name=f.name+(col.replace(f.fid, '', 1)), semanticType='ordinal'))
-                # res = pd.concat([res, newcode], axis=1)
-                res.loc[:, newcode.columns] = newcode
-            else:
-                newcode = encodeQuant(df[f.fid], params.quantEncodeType)
-                # print("newcode-other", newcode, df[f.fid], sep='\n')
-                if params.keepOriginQuant or newcode.size == 0:
-                    res_fields.append(f)
-                else:
-                    res.drop(columns=[f.fid])
-                # res = pd.concat([res, newcode], axis=1)
-                for col in list(newcode.columns):
-                    res_fields.append(IFieldMeta(fid=col, name=f.name+(col.replace(f.fid, '', 1)), semanticType='ordinal'))
-                res.loc[:, newcode.columns] = newcode
-        elif f.semanticType in ['quantitative', 'ordinal']:
-            newcode = encodeQuant(df[f.fid], params.quantEncodeType)
-            # print("newcode-other", newcode, df[f.fid], sep='\n')
-            if params.keepOriginQuant or newcode.size == 0:
-                res_fields.append(f)
-            else:
-                res.drop(columns=f.fid)
-            # print("newcode======", res, newcode, res_fields, f.fid, res[f.fid], sep='\n')
-            # res = pd.concat([res, newcode], axis=1)
-            res.loc[:, newcode.columns] = newcode
-            for col in list(newcode.columns):
-                res_fields.append(IFieldMeta(fid=col, name=f.name+(col.replace(f.fid, '', 1)), semanticType='ordinal'))
-        else:
-            res_fields.append(f)
-    # print("res, ", res, res_fields)
-    return res.loc[:, [f.fid for f in res_fields]], res_fields
+    """Encode the given fields, see algorithms.encoding for the available encodings."""
+    array, columns = encodeFields(df, fields, params.catEncodeType, params.quantEncodeType)
+    res_fields: List[IFieldMeta] = [
+        f if suffix is None else IFieldMeta(fid=f.fid+suffix, name=(f.name if f.name is not None else f.fid)+suffix, semanticType='ordinal')
+        for f, suffix in columns
+    ]
+    return pd.DataFrame(array, index=df.index, columns=[f.fid for f in res_fields]), res_fields
     
-def transDataSource(dataSource: List[IRow], fields: List[IFieldMeta], params: OptionalParams):
-    df = pd.DataFrame(dataSource)
+def encodingKey(datasetId: str, fields: List[IFieldMeta], params: OptionalParams):
+    return (datasetId, tuple((f.fid, f.name, f.semanticType) for f in fields), params.catEncodeType, params.quantEncodeType)
+
+def transDataSource(dataSource: Union[List[IRow], pd.DataFrame], fields: List[IFieldMeta], params: OptionalParams, datasetId: Optional[str] = None):
+    """encoded frames of stored datasets are cached, see algorithms.dataset"""
+    key = encodingKey(datasetId, fields, params) if datasetId is not None else None
+    if key is not None:
+        cached = datasetStore.getEncoded(key)
+        if cached is not None:
+            return cached
+    df = dataSource if isinstance(dataSource, pd.DataFrame) else pd.DataFrame(dataSource)
     df, fields = trans(df, fields, params)
+    if key is not None:
+        df, fields = datasetStore.putEncoded(key, (df, fields))
     return df, fields
 
 import algorithms
@@ -322,23 +210,38 @@ class IFunctionalDep(BaseModel):
     extInfo: Optional[Any] = Field(default=None)
 
 class CausalRequest(BaseModel, extra=Extra.allow):
-    dataSource: List[IRow]
+    dataSource: Optional[List[IRow]] = Field(default=None, description="Rows of the dataset, can be omitted if datasetId is given.")
+    datasetId: Optional[str] = Field(default=None, description="Content hash returned by /dataset, used instead of dataSource.")
     fields: List[IFieldMeta]
     focusedFields: List[str] = Field(default=[], description="A subset of fields which we concerned about.")
     # bgKnowledges: Optional[List[BgKnowledge]] = Field(default=[], description="Known edges")
     bgKnowledgesPag: Optional[List[BgKnowledgePag]] = Field(default=[], description="Known edges (PAG)")
     funcDeps: Optional[List[IFunctionalDep]] = Field(default=[], description="")
     params: OptionalParams = Field(default={}, description="optional params", extra=Extra.allow)
+    sessionId: Optional[str] = Field(default=None, description="Keeps the skeleton of PC / CD_NOD between the requests of a session, so that changing bgKnowledgesPag only redoes the orientation.")
+    alphas: Optional[List[float]] = Field(default=None, description="PC / CD_NOD / XLearner: also return the graph of each of these alpha values (extra.alphas), and the max p-value of each pair in the adjacency search (extra.pvalues), so that moving the alpha slider does not rerun the discovery.")
+    timeBudget: Optional[float] = Field(default=None, description="Seconds. PC / CD_NOD / FCI / XLearner stop the adjacency search at the last depth level completed within it and orient that skeleton; the response is then marked with extra.partial and extra.completedDepth.")
+    profile: Optional[bool] = Field(default=False, description="Adds the seconds spent in each stage of the request and the number of CI tests by depth to extra.profile, see algorithms.metrics.")
+    matrixFormat: Literal['dense', 'edges', 'binary'] = Field(default='dense', description="Encoding of the graph matrices and p-values of the response: nested lists, edge lists or base64 int8 / float32 arrays, see algorithms.response.")
 
 class AlgoInterface:
     ParamType = OptionalParams
     dev_only = True
     cache_path = None # '/tmp/causal.json'
     verbose = False
-    def __init__(self, dataSource: List[IRow], fields: List[IFieldMeta], 
+    def __init__(self, dataSource: Union[List[IRow], str], fields: List[IFieldMeta], 
                 params: Optional[ParamType] = ParamType()):
-        self.dataSource, self.origin_fields = pd.DataFrame(dataSource), fields
+        """dataSource: rows of the dataset, or the id of a dataset uploaded to /dataset"""
+        if isinstance(dataSource, str):
+            self.datasetId, self.dataSource = dataSource, datasetStore.get(dataSource)
+            if self.dataSource is None:
+                raise Exception(f"Dataset {dataSource} not found, please upload it again.")
+        else:
+            self.datasetId, self.dataSource = datasetStore.putRows(dataSource)
+        self.origin_fields = fields
         self.fields = [*fields]
+        self.sampleSizes, self.sampleOrder, self.fullArray = None, None, None
+        self.escalations: List[EscalatingCIT] = []
         # self.data, self.fields = transDataSource(dataSource, fields, params)
     
     def constructBgKnowledgePag(self, bgKnowledgesPag: Optional[List[BgKnowledgePag]] = [], f_ind: Dict[str, int] = {}):
@@ -369,14 +272,59 @@ class AlgoInterface:
                     res.append(f.fid)
         return res
     
+    @stage('encode')
     def selectArray(self, focusedFields: List[str] = [], params: OptionalParams = OptionalParams()) -> np.ndarray:
         # print('\n\nselectArray', [{f.fid: f for f in self.fields}[ff] for ff in focusedFields])
-        print("Fields: ", {f.fid: f for f in self.fields}.keys(), focusedFields)
         focusedFields = self.transFocusedFields(focusedFields)
-        self.data, self.focusedFields = transDataSource(self.dataSource, [{f.fid: f for f in self.fields}[ff] for ff in focusedFields], params)
+        fields = [{f.fid: f for f in self.fields}[ff] for ff in focusedFields]
+        self.fingerprint = fingerprint(*encodingKey(self.datasetId, fields, params))
+        self.data, self.focusedFields = transDataSource(self.dataSource, fields, params, datasetId=self.datasetId)
+        self.sampleSizes = sampleSizes(len(self.data), params.sampleSize)
+        self.sampleOrder, self.fullArray = None, None
+        if len(self.sampleSizes) > 1:
+            # the order is cached with the encoded frame, so that repeated requests get the same sample
+            key = (*encodingKey(self.datasetId, fields, params), 'sample', self.sampleSizes[0])
+            self.fullArray = self.data.to_numpy()
+            self.sampleOrder = datasetStore.getEncoded(key)
+            if self.sampleOrder is None:
+                self.sampleOrder = datasetStore.putEncoded(key, stratifiedOrder(self.fullArray, self.sampleSizes[0]))
+            self.data = self.data.iloc[sampleRows(self.sampleOrder, self.sampleSizes[0])]
+            self.fingerprint = fingerprint(self.fingerprint, 'sample', self.sampleSizes[0])
         # print('\n\n', data.dtypes)
         return self.data.to_numpy()
 
+    def getCIT(self, data: np.ndarray, method: str, tag: str = '', alpha: Union[float, List[float], None] = None,
+               full: Optional[np.ndarray] = None, **kwargs):
+        """
+        CI test on data derived from the last selectArray() output, sharing p-values with earlier runs
+        on the same encoded data. tag: distinguishes other derivations of the same array (e.g. augmented columns)
+        alpha: significance level(s) of the algorithm. On a sampled table the tests with p-values near it are
+        escalated to larger samples of `full`, the same derivation of the whole table (default: the whole selectArray() output)
+        kci is not escalated: it runs on at most max_rows rows of any sample.
+        """
+        cit = getCIT(data, method, key=fingerprint(self.fingerprint, tag, data.shape), **kwargs)
+        if alpha is None or self.sampleOrder is None or method == 'kci':
+            return cit
+        full = self.fullArray if full is None else full
+        keys = [fingerprint(self.fingerprint, tag, (size, full.shape[1])) for size in self.sampleSizes]
+        cit = EscalatingCIT(cit, full, self.sampleOrder, self.sampleSizes, method, keys,
+                            alpha if isinstance(alpha, list) else [alpha], **kwargs)
+        self.escalations.append(cit)
+        return cit
+
+    def samplingInfo(self) -> Optional[Dict[str, Any]]:
+        """Rows used by the last calc() on a sampled table, None if every row was used."""
+        if self.sampleOrder is None:
+            return None
+        decided = [sum(cit.decided[i] for cit in self.escalations) for i in range(len(self.sampleSizes))]
+        return {
+            'rows': self.sampleSizes[-1],
+            'sampleSize': self.sampleSizes[0],
+            'sampleSizes': self.sampleSizes,
+            'testsBySampleSize': decided,
+            'maxRowsUsed': max([size for size, k in zip(self.sampleSizes, decided) if k > 0], default=self.sampleSizes[0]),
+        }
+
     def safeFieldMeta(self, fields: List[IFieldMeta]):
         def transMeta(fieldMeta: IFieldMeta):
             meta = IFieldMeta(**fieldMeta.__dict__)
@@ -404,14 +352,15 @@ def getCausalRequest(Type):
 
 
 class CausalAlgorithmData(BaseModel, extra=Extra.allow):
-    orig_matrix: Optional[List[List[float]]] = Field(description="G")
-    matrix: Optional[List[List[float]]] = Field(
+    orig_matrix: Optional[Union[List[List[float]], Dict[str, Any]]] = Field(description="G")
+    matrix: Optional[Union[List[List[float]], Dict[str, Any]]] = Field(
         description='''
         matrix[i, j] = matrix[j, i] = 0: i and j are independent
         matrix[i, j] = 1: the edge mark of (i,j) on i is ARROW, i <--? j
         matrix[i, j] = -1: the edge mark of (i,j) on i is BLANK, i --? j
         matrix[i, j] = 2: the edge mark of (i,j) on i is CIRCLE, i o--? j
         https://kevinbinz.com/tag/cpdag/
+        Nested lists, or the edges / binary encoding of the request's matrixFormat, see algorithms.response.
         ''')
     fields: List[IFieldMeta]
     extra: Optional[Dict[str, object]]
@@ -421,10 +370,65 @@ class CausalAlgorithmResponse(BaseModel):
     message: Optional[str] = Field(default=None)
     
 
-def registerCausalRequest(app, algoName, algo, resolve, Response):
+class DatasetInfo(BaseModel):
+    datasetId: str
+    rows: int
+    columns: List[str]
+class DatasetResponse(BaseModel):
+    success: bool
+    data: Optional[DatasetInfo] = Field(default=None)
+    message: Optional[str] = Field(default=None)
+
+class JobInfo(BaseModel):
+    jobId: str
+    algoName: str
+    datasetId: Optional[str] = Field(default=None)
+    status: str = Field(description="queued | running | done | failed | cancelled")
+    submittedAt: float
+    startedAt: Optional[float] = Field(default=None)
+    finishedAt: Optional[float] = Field(default=None)
+    message: Optional[str] = Field(default=None)
+class JobResponse(BaseModel):
+    success: bool
+    data: Optional[JobInfo] = Field(default=None)
+    message: Optional[str] = Field(default=None)
+
+def requestProfile(request: Request) -> Profile:
+    """Profile of a request, whose parse stage is the time since the server received it (request.state.receivedAt)."""
+    profile = Profile()
+    received = getattr(request.state, 'receivedAt', None)
+    if received is not None:
+        profile.add('parse', time.perf_counter() - received)
+    return profile
+
+def registerCausalRequest(app, algoName, resolve, Response, submit=None):
+    """
+    Registers the routes of an algorithm without importing it; its params are checked against its ParamType
+    when it runs, see algorithms.jobs.runCausal.
+    resolve(algoName, item, response, profile): runs the request, called from the thread pool of the server;
+    profile: see algorithms.metrics, with the parse stage already done
+    submit(algoName, item, response): queues the request as a job, see algorithms.jobs
+    """
     @app.post(f'/causal/{algoName}', response_model=CausalAlgorithmResponse)
-    async def causal(item: getCausalRequest(algo), response: Response):
-        return resolve(algoName, item, response)
+    def causal(item: CausalRequest, request: Request, response: Response):
+        return resolve(algoName, item, response, requestProfile(request))
+
+    @app.post(f'/causal/{algoName}/arrow', response_model=CausalAlgorithmResponse)
+    async def causalArrow(request: Request, response: Response):
+        """Arrow IPC body, with the other fields of CausalRequest as JSON in the schema metadata 'request'."""
+        try:
+            df, meta = readArrow(await request.body())
+            meta.pop('dataSource', None)
+            item = CausalRequest.parse_obj({**meta, 'datasetId': datasetStore.put(df)})
+        except Exception as e:
+            response.status_code = status.HTTP_400_BAD_REQUEST
+            return CausalAlgorithmResponse(success=False, message=str(e))
+        return await run_in_threadpool(resolve, algoName, item, response, requestProfile(request))
+
+    if submit is not None:
+        @app.post(f'/job/causal/{algoName}', response_model=JobResponse)
+        def causalJob(item: CausalRequest, response: Response):
+            return submit(algoName, item, response)
 
 class FuncDep(BaseModel):
     fid: str
@@ -0,0 +1,199 @@
+"""
+Constraint-based discovery on a prebuilt CIT, so that the p-value cache of the CIT
+(see algorithms.cit) is reused between the runs of a request and across requests.
+Mirrors causallearn's pc_alg / cdnod_alg / fci.
+
+With a deadline the adjacency search stops at the last depth level completed in time (see
+algorithms.skeleton) and the partial skeleton is oriented as usual.
+
+The orientation is timed as the 'orient' stage of the request profile (see algorithms.metrics).
+"""
+import time
+import numpy as np
+from typing import List, Optional, Tuple
+
+from causallearn.graph.GraphClass import CausalGraph
+from causallearn.graph.GraphNode import GraphNode
+from causallearn.graph.Endpoint import Endpoint
+from causallearn.search.ConstraintBased import FCI
+from causallearn.utils.PCUtils import UCSepset, Meek
+from causallearn.utils.PCUtils.BackgroundKnowledge import BackgroundKnowledge
+from causallearn.utils.PCUtils.BackgroundKnowledgeOrientUtils import orient_by_background_knowledge
+from algorithms.skeleton import skeletonDiscovery, fas, TrackingCIT, DeadlineExceeded
+from algorithms.session import sessions, removeForbidden
+from algorithms.metrics import stage
+
+@stage('orient')
+def orient(cg: CausalGraph, alpha: float, uc_rule: int = 0, uc_priority: int = -1,
+           background_knowledge: Optional[BackgroundKnowledge] = None) -> CausalGraph:
+    """Orientation phase of PC: background knowledge, unshielded colliders, then Meek rules."""
+    if background_knowledge is not None:
+        orient_by_background_knowledge(cg, background_knowledge)
+    if uc_rule == 0:
+        if uc_priority != -1:
+            cg_2 = UCSepset.uc_sepset(cg, uc_priority, background_knowledge=background_knowledge)
+        else:
+            cg_2 = UCSepset.uc_sepset(cg, background_knowledge=background_knowledge)
+        return Meek.meek(cg_2, background_knowledge=background_knowledge)
+    elif uc_rule == 1:
+        if uc_priority != -1:
+            cg_2 = UCSepset.maxp(cg, uc_priority, background_knowledge=background_knowledge)
+        else:
+            cg_2 = UCSepset.maxp(cg, background_knowledge=background_knowledge)
+        return Meek.meek(cg_2, background_knowledge=background_knowledge)
+    elif uc_rule == 2:
+        if uc_priority != -1:
+            cg_2 = UCSepset.definite_maxp(cg, alpha, uc_priority, background_knowledge=background_knowledge)
+        else:
+            cg_2 = UCSepset.definite_maxp(cg, alpha, background_knowledge=background_knowledge)
+        cg_before = Meek.definite_meek(cg_2, background_knowledge=background_knowledge)
+        return Meek.meek(cg_before, background_knowledge=background_knowledge)
+    raise ValueError("uc_rule should be in [0, 1, 2]")
+
+def partialRule(cg: CausalGraph, uc_rule: int, uc_priority: int) -> Tuple[int, int]:
+    """
+    On a partial skeleton, colliders are oriented without further CI tests (uc_sepset, prioritizing existing
+    colliders): maxp and the stronger-collider priorities test every subset of the neighbours of a triple,
+    which does not end on a dense skeleton.
+    """
+    if getattr(cg, 'partial', False):
+        return 0, 2
+    return uc_rule, uc_priority
+
+def sessionSkeleton(data: np.ndarray, cit, alpha: float, stable: bool, background_knowledge: Optional[BackgroundKnowledge],
+                    verbose: bool, sessionId: Optional[str], sessionKey: Tuple, deadline: Optional[float] = None) -> CausalGraph:
+    """
+    Skeleton search, or the skeleton kept by an earlier request of the session when sessionId is given.
+    Kept skeletons are searched without background knowledge; edges forbidden in both directions are
+    removed from them afterwards. Partial skeletons are not kept.
+    The max p-value of the tests of each pair is kept in cg.max_pvalues.
+    """
+    def search(background_knowledge):
+        pvalues = np.zeros((data.shape[1], data.shape[1]))
+        cg = skeletonDiscovery(data, alpha, cit, stable, background_knowledge=background_knowledge, verbose=verbose,
+                               pvalues=pvalues, deadline=deadline)
+        cg.max_pvalues = pvalues
+        return cg
+    if sessionId is None:
+        return search(background_knowledge)
+    key = sessions.key(sessionId, *sessionKey, alpha, stable)
+    cg = sessions.get(key)
+    if cg is None:
+        cg = search(None)
+        if not cg.partial:
+            sessions.put(key, cg)
+    cg.set_ind_test(cit)
+    return removeForbidden(cg, background_knowledge)
+
+def pcAlg(data: np.ndarray, cit, alpha: float = 0.05, stable: bool = True, uc_rule: int = 0, uc_priority: int = -1,
+          background_knowledge: Optional[BackgroundKnowledge] = None, verbose: bool = False,
+          sessionId: Optional[str] = None, sessionKey: Tuple = (), deadline: Optional[float] = None) -> CausalGraph:
+    start = time.time()
+    cg = sessionSkeleton(data, cit, alpha, stable, background_knowledge, verbose, sessionId, sessionKey, deadline)
+    cg = orient(cg, alpha, *partialRule(cg, uc_rule, uc_priority), background_knowledge)
+    cg.PC_elapsed = time.time() - start
+    return cg
+
+def cdnodAlg(data: np.ndarray, cit, alpha: float = 0.05, stable: bool = True, uc_rule: int = 0,
+             uc_priority: int = -1, background_knowledge: Optional[BackgroundKnowledge] = None, verbose: bool = False,
+             sessionId: Optional[str] = None, sessionKey: Tuple = (), deadline: Optional[float] = None) -> CausalGraph:
+    """data: the augmented data, whose last column is c_indx"""
+    start = time.time()
+    cg = sessionSkeleton(data, cit, alpha, stable, None, verbose, sessionId, sessionKey, deadline)
+    c_indx_id = data.shape[1] - 1
+    for i in cg.G.get_adjacent_nodes(cg.G.nodes[c_indx_id]):
+        cg.G.add_directed_edge(cg.G.nodes[c_indx_id], i)
+    cg = orient(cg, alpha, *partialRule(cg, uc_rule, uc_priority), background_knowledge)
+    cg.PC_elapsed = time.time() - start
+    return cg
+
+def fciNodes(n: int) -> List[GraphNode]:
+    """Nodes named as causallearn's fci does, so that background knowledge can be built before the search."""
+    nodes = []
+    for i in range(n):
+        node = GraphNode(f"X{i + 1}")
+        node.add_attribute("id", i)
+        nodes.append(node)
+    return nodes
+
+def fciAlg(data: np.ndarray, cit, alpha: float = 0.05, depth: int = -1, max_path_length: int = -1,
+           background_knowledge: Optional[BackgroundKnowledge] = None, verbose: bool = False,
+           deadline: Optional[float] = None, **kwargs):
+    """The possible-dsep removals are dropped as well when interrupted by the deadline."""
+    nodes = fciNodes(data.shape[1])
+    graph, sep_sets = fas(data, nodes, independence_test_method=cit, alpha=alpha,
+                          knowledge=background_knowledge, depth=depth, verbose=verbose, deadline=deadline)
+    for edge in graph.get_graph_edges():
+        graph.remove_edge(edge)
+        edge.set_endpoint1(Endpoint.CIRCLE)
+        edge.set_endpoint2(Endpoint.CIRCLE)
+        graph.add_edge(edge)
+
+    FCI.rule0(graph, nodes, sep_sets, background_knowledge, verbose)
+    if not graph.partial:
+        graph.partial = not possibleDsep(data, graph, sep_sets, cit, alpha, background_knowledge, depth, max_path_length,
+                                         verbose, deadline)
+    return orientPag(graph, nodes, sep_sets, data, cit, alpha, max_path_length, background_knowledge, verbose)
+
+@stage('skeleton')
+def possibleDsep(data: np.ndarray, graph, sep_sets, cit, alpha: float, background_knowledge: Optional[BackgroundKnowledge],
+                 depth: int, max_path_length: int, verbose: bool, deadline: Optional[float]) -> bool:
+    """Removes the edges separated by a possible-dsep set, False (and nothing removed) when interrupted by the deadline."""
+    sp = FCI.SepsetsPossibleDsep(data, graph, TrackingCIT(cit, deadline=deadline), alpha, background_knowledge,
+                                 depth, max_path_length, verbose)
+    removed = []
+    try:
+        for edge in graph.get_graph_edges():
+            sep_set = sp.get_sep_set(edge.get_node1(), edge.get_node2())
+            if sep_set is not None:
+                removed.append((edge.get_node1(), edge.get_node2(), sep_set))
+    except DeadlineExceeded:
+        return False
+    for x, y, sep_set in removed:
+        graph.remove_edge(graph.get_edge(x, y))
+        sep_sets[(graph.node_map[x], graph.node_map[y])] = sep_set
+        if verbose:
+            print(f"Possible DSEP Removed {x.get_name()} --- {y.get_name()} sepset = {[graph.nodes[s].get_name() for s in sep_set]}")
+    return True
+
+@stage('orient')
+def orientPag(graph, nodes: List[GraphNode], sep_sets, data: np.ndarray, cit, alpha: float, max_path_length: int,
+              background_knowledge: Optional[BackgroundKnowledge], verbose: bool):
+    """Orientation phase of FCI on the final skeleton: rule 0 then R1-R4 until nothing changes."""
+    FCI.reorientAllWith(graph, Endpoint.CIRCLE)
+    FCI.rule0(graph, nodes, sep_sets, background_knowledge, verbose)
+    change_flag, first_time = True, True
+    while change_flag:
+        change_flag = False
+        change_flag = FCI.rulesR1R2cycle(graph, background_knowledge, change_flag, verbose)
+        change_flag = FCI.ruleR3(graph, sep_sets, background_knowledge, change_flag, verbose)
+        if change_flag or (first_time and background_knowledge is not None and
+                           len(background_knowledge.forbidden_rules_specs) > 0 and
+                           len(background_knowledge.required_rules_specs) > 0 and
+                           len(background_knowledge.tier_map.keys()) > 0):
+            change_flag = FCI.ruleR4B(graph, max_path_length, data, cit, alpha, sep_sets,
+                                      change_flag, background_knowledge, verbose)
+            first_time = False
+    graph.set_pag(True)
+    return graph, FCI.get_color_edges(graph)
+
+def progress(graph) -> dict:
+    """How far the adjacency search of a CausalGraph / GeneralGraph got before its deadline."""
+    return {'partial': getattr(graph, 'partial', False), 'completedDepth': getattr(graph, 'completed_depth', None)}
+
+def alphaSweep(run, alphas: Optional[List[float]], pvalues: Optional[np.ndarray]) -> dict:
+    """
+    Extra response data of a sweep over alpha: the graph of each requested alpha, run(alpha) -> (graph matrix,
+    progress), which reuses the CI tests cached by the first run, and the max p-value of each pair in the first
+    run's adjacency search, for client-side re-thresholding.
+    """
+    if alphas is None:
+        return {}
+    res = []
+    for alpha in alphas:
+        matrix, info = run(alpha)
+        res.append({'alpha': alpha, 'matrix': matrix, **info})
+    return {
+        'pvalues': pvalues,
+        'alphas': res,
+    }
@@ -0,0 +1,116 @@
+"""
+Chi-square / G-square tests on a count cube.
+
+The columns are kept as compact integer codes. The observed configurations of a conditioning set S
+are indexed once (mixed-radix code of the S columns, then densified) and cached, so a test (x, y | S)
+is a single bincount of the mixed-radix index s * |x| * |y| + x * |y| + y over the rows.
+"""
+import os, threading
+import numpy as np
+from collections import OrderedDict
+from scipy.stats import chi2
+from typing import List, Tuple
+from causallearn.utils import cit as CL
+
+from algorithms.cibatch import BatchCIT, Test
+
+MARGINAL_CACHE_BYTES = int(os.environ.get('CAUSAL_COUNTCUBE_CACHE_MB', 256)) << 20
+
+def compactCodes(column: np.ndarray) -> np.ndarray:
+    card = int(column.max()) + 1 if column.size else 1
+    dtype = np.uint8 if card <= 1 << 8 else np.uint16 if card <= 1 << 16 else np.int64
+    return np.ascontiguousarray(column, dtype=dtype)
+
+def pValue(counts: np.ndarray, G_sq: bool) -> float:
+    """counts: (k, |x|, |y|) joint counts of the observed configurations of S, as causallearn's chisq_or_gsq_test"""
+    Sx, Sy = counts.sum(axis=2), counts.sum(axis=1)
+    expected = Sx[:, :, None] * Sy[:, None, :] / Sx.sum(axis=1)[:, None, None]
+    zero = expected == 0
+    expected_nonzero = np.where(zero, 1, expected)
+    if not G_sq:
+        stat = np.sum((counts - expected) ** 2 / expected_nonzero)
+    else:
+        div = counts / expected_nonzero
+        div[div == 0] = 1
+        stat = 2 * np.sum(counts * np.log(div))
+    zero_rows = zero.all(axis=2).sum(axis=1)
+    zero_cols = zero.all(axis=1).sum(axis=1)
+    df = np.sum((counts.shape[1] - 1 - zero_rows) * (counts.shape[2] - 1 - zero_cols))
+    return 1 if df == 0 else chi2.sf(stat, df)
+
+class ChisqGsq(BatchCIT, CL.Chisq_or_Gsq):
+    def __init__(self, data, method_name, **kwargs):
+        super().__init__(data, method_name, **kwargs)
+        self.codes = [compactCodes(self.data[:, j]) for j in range(self.num_features)]
+        self.marginals: OrderedDict = OrderedDict()
+        self.marginal_bytes = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.update(marginals=OrderedDict(), marginal_bytes=0, lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def configurations(self, S: Tuple[int, ...]) -> Tuple[np.ndarray, int]:
+        """Dense index of the configuration of S on each row, and the number of observed configurations."""
+        if len(S) == 0:
+            return None, 1
+        with self.lock:
+            if S in self.marginals:
+                self.marginals.move_to_end(S)
+                return self.marginals[S]
+            prefix = self.marginals.get(S[:-1], None)
+        if prefix is not None:
+            # extend the cached configurations of the prefix of S
+            index, radix = prefix[0].astype(np.int64), prefix[1]
+        else:
+            index, radix = self.codes[S[0]].astype(np.int64), int(self.cardinalities[S[0]])
+        for s in S[1:] if prefix is None else S[-1:]:
+            index *= int(self.cardinalities[s])
+            index += self.codes[s]
+            radix *= int(self.cardinalities[s])
+        if radix <= 4 * index.size:
+            seen = np.zeros(radix, dtype=np.int64)
+            seen[index] = 1
+            dense = np.cumsum(seen) - 1
+            k = int(seen.sum())
+            index = dense[index]
+        else:
+            uniques, index = np.unique(index, return_inverse=True)
+            k = len(uniques)
+        index = index.astype(np.int32 if k < 1 << 31 else np.int64)
+        with self.lock:
+            self.marginals[S] = (index, k)
+            self.marginal_bytes += index.nbytes
+            while self.marginal_bytes > MARGINAL_CACHE_BYTES and len(self.marginals) > 1:
+                _, (old, _) = self.marginals.popitem(last=False)
+                self.marginal_bytes -= old.nbytes
+        return index, k
+
+    def counts(self, x: int, y: int, S: Tuple[int, ...]) -> np.ndarray:
+        cx, cy = int(self.cardinalities[x]), int(self.cardinalities[y])
+        index, k = self.configurations(S)
+        xy = self.codes[x].astype(np.int64) * cy + self.codes[y]
+        if index is not None:
+            xy += index.astype(np.int64) * (cx * cy)
+        return np.bincount(xy, minlength=k * cx * cy).reshape((k, cx, cy))
+
+    def test(self, var: List[int]) -> float:
+        return pValue(self.counts(var[0], var[1], tuple(var[2:])), self.method == 'gsq')
+
+    def __call__(self, X, Y, condition_set=None):
+        Xs, Ys, condition_set, cache_key = self.get_formatted_XYZ_and_cachekey(X, Y, condition_set)
+        if cache_key in self.pvalue_cache: return self.pvalue_cache[cache_key]
+        p = self.test(Xs + Ys + condition_set)
+        self.pvalue_cache[cache_key] = p
+        return p
+
+    def batch(self, tests: List[Test]):
+        pending = self.pending(tests)
+        # tests sharing a conditioning set reuse its configurations
+        for key, var in sorted(pending.items(), key=lambda kv: (len(kv[1]), kv[1][2:])):
+            self.pvalue_cache[key] = self.test(var)
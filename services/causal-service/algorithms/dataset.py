@@ -0,0 +1,272 @@
+"""
+Datasets uploaded to the service and their encoded frames.
+
+Every process keeps an LRU of the values it uses. With a shared directory, the values with an array form (encoded
+frames, sample orders, and the uploaded tables when pyarrow is installed) are also written there once and
+memory-mapped by every process that reads them: the workers of a server, and the job processes, share one copy in
+the page cache, and a dataset uploaded to one worker can be used by the others.
+
+Entries of the shared directory are evicted in LRU order (by modification time, touched on each read) once their
+total size exceeds the budget. An evicted entry is unlinked: the processes which mapped it keep reading it, and the
+kernel frees it with the last mapping, so eviction never invalidates a value in use.
+
+Environment:
+    CAUSAL_DATASET_CACHE_MB: per-process LRU budget, default 1024
+    CAUSAL_SHARED_STORE_DIR: shared directory, default /dev/shm/causal-store if /dev/shm exists; empty to disable.
+        Keys are content hashes of the data; clear it after changing the encodings of algorithms.encoding.
+        It is created with mode 0700; the store is disabled if it is not owned by the service's user, or is
+        writable by group or others.
+    CAUSAL_SHARED_STORE_MB: shared directory budget, default 4096 (docker limits /dev/shm to 64MB unless --shm-size is set)
+"""
+import os, sys, json, stat, pickle, shutil, hashlib, threading
+import numpy as np, pandas as pd
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Optional, Any
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+IRow = Dict[str, object]
+
+def hashDataFrame(df: pd.DataFrame) -> str:
+    """Content hash of a table: column names + per-row hashes, independent of how it was uploaded."""
+    h = hashlib.sha1()
+    h.update('\x1f'.join(map(str, df.columns)).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+def sizeOf(value: Any) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(sizeOf(v) for v in value)
+    return sys.getsizeof(value)
+
+def privateDir(path: str):
+    """
+    Create the directory with mode 0700, raise OSError unless it is a directory of the current uid not writable
+    by group or others: the service unpickles files of its directories, whoever can write there can run code in it.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise OSError(f"{path} must be a directory of uid {os.getuid()}, not writable by group or others")
+
+class Unshareable(Exception):
+    pass
+
+class SharedStore:
+    """
+    Values kept as memory-mapped files, an entry per key: a directory with the pickled structure of the value
+    (`meta`) and its arrays, as .npy files (numeric arrays, frames of a single numeric dtype) or Arrow IPC files
+    (other frames). Arrays are mapped copy-on-write: writing to them does not change the entry.
+    """
+    def __init__(self, path: str, max_bytes: int):
+        self.path, self.max_bytes = path, max_bytes
+        # the metas are unpickled
+        privateDir(path)
+
+    def entryPath(self, key: Tuple) -> str:
+        return os.path.join(self.path, hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+
+    def split(self, value: Any, parts: List[Any]):
+        """Structure of the value, with its arrays replaced by their index in parts."""
+        if isinstance(value, np.ndarray):
+            if value.dtype.kind not in 'biuf':
+                raise Unshareable()
+            parts.append(value)
+            return ('array', len(parts) - 1)
+        if isinstance(value, pd.DataFrame):
+            dtypes = set(value.dtypes)
+            if len(dtypes) == 1 and next(iter(dtypes)).kind in 'biuf':
+                parts.append(value.to_numpy())
+                return ('frame', len(parts) - 1, value.columns, value.index)
+            if pa is None:
+                raise Unshareable()
+            try:
+                parts.append(pa.Table.from_pandas(value))
+            except (pa.ArrowException, TypeError, ValueError):
+                # e.g. object columns mixing numbers and strings
+                raise Unshareable()
+            return ('table', len(parts) - 1)
+        if isinstance(value, tuple):
+            return ('tuple', [self.split(v, parts) for v in value])
+        return ('object', value)
+
+    def join(self, meta, path: str):
+        kind = meta[0]
+        if kind == 'array':
+            return np.load(os.path.join(path, f'{meta[1]}.npy'), mmap_mode='c')
+        if kind == 'frame':
+            _, i, columns, index = meta
+            return pd.DataFrame(np.load(os.path.join(path, f'{i}.npy'), mmap_mode='c'), columns=columns, index=index, copy=False)
+        if kind == 'table':
+            with pa.memory_map(os.path.join(path, f'{meta[1]}.arrow')) as source:
+                return pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+        if kind == 'tuple':
+            return tuple(self.join(m, path) for m in meta[1])
+        return meta[1]
+
+    def put(self, key: Tuple, value: Any) -> Optional[Any]:
+        """The mapped value, None if it has no array form or could not be written (e.g. the directory is full)."""
+        path = self.entryPath(key)
+        if not os.path.isdir(path):
+            parts: List[Any] = []
+            try:
+                meta = self.split(value, parts)
+            except Unshareable:
+                return None
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                os.makedirs(tmp)
+                for i, part in enumerate(parts):
+                    if isinstance(part, np.ndarray):
+                        np.save(os.path.join(tmp, f'{i}.npy'), part)
+                    else:
+                        with pa.OSFile(os.path.join(tmp, f'{i}.arrow'), 'wb') as sink, pa.ipc.new_file(sink, part.schema) as writer:
+                            writer.write_table(part)
+                with open(os.path.join(tmp, 'meta'), 'wb') as f:
+                    pickle.dump(meta, f)
+                # another process may have written the same entry meanwhile
+                os.rename(tmp, path)
+            except OSError as e:
+                shutil.rmtree(tmp, ignore_errors=True)
+                if not os.path.isdir(path):
+                    print(f"SharedStore: {key[0]} not shared, {e}", file=sys.stderr)
+                    return None
+            self.evict()
+        return self.get(key)
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        path = self.entryPath(key)
+        try:
+            with open(os.path.join(path, 'meta'), 'rb') as f:
+                meta = pickle.load(f)
+            value = self.join(meta, path)
+            os.utime(path)
+            return value
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # missing, or evicted while reading
+            return None
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                if name.endswith('.tmp'):
+                    continue
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                pass
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+class DatasetStore:
+    """
+    Bounded LRU of parsed datasets (keyed by content hash) and of their encoded frames
+    (keyed by dataset hash, fields and encoding params), in front of an optional SharedStore.
+    """
+    def __init__(self, max_bytes: int, shared: Optional[SharedStore] = None):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.shared = shared
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry[0]
+        value = None if self.shared is None else self.shared.get(key)
+        if value is not None:
+            self._keep(key, value)
+        return value
+
+    def _put(self, key, value):
+        """Returns the value as kept: mapped from the shared store when it could be shared."""
+        shared = None if self.shared is None else self.shared.put(key, value)
+        value = value if shared is None else shared
+        self._keep(key, value)
+        return value
+
+    def _keep(self, key, value):
+        size = sizeOf(value)
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, s) = self.entries.popitem(last=False)
+                self.nbytes -= s
+
+    def put(self, df: pd.DataFrame) -> str:
+        datasetId = hashDataFrame(df)
+        if self._get(('data', datasetId)) is None:
+            self._put(('data', datasetId), df)
+        return datasetId
+
+    def putRows(self, dataSource: List[IRow]) -> Tuple[str, pd.DataFrame]:
+        df = pd.DataFrame(dataSource)
+        datasetId = self.put(df)
+        cached = self.get(datasetId)
+        return datasetId, df if cached is None else cached
+
+    def get(self, datasetId: str) -> Optional[pd.DataFrame]:
+        return self._get(('data', datasetId))
+
+    def has(self, datasetId: str) -> bool:
+        with self.lock:
+            if ('data', datasetId) in self.entries:
+                return True
+        return self.shared is not None and os.path.isdir(self.shared.entryPath(('data', datasetId)))
+
+    def getEncoded(self, key: Tuple):
+        return self._get(('encoded', *key))
+
+    def putEncoded(self, key: Tuple, value):
+        """Returns the value as kept, use it instead of the given one to drop the private copy."""
+        return self._put(('encoded', *key), value)
+
+ARROW_META_KEY = b'request'
+
+def readArrow(body: bytes) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Read an Arrow IPC stream (or file) body into a DataFrame.
+    The JSON request metadata (fields, params, ...) is taken from the schema metadata under the key 'request'.
+    Numeric columns without nulls are exposed to pandas without copying the body buffers.
+    """
+    if pa is None:
+        raise Exception("pyarrow is required for Arrow IPC requests.")
+    buf = pa.py_buffer(body)
+    if body[:6] == b'ARROW1':
+        table = pa.ipc.open_file(buf).read_all()
+    else:
+        table = pa.ipc.open_stream(buf).read_all()
+    meta = table.schema.metadata or {}
+    request = json.loads(meta[ARROW_META_KEY]) if ARROW_META_KEY in meta else {}
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    return df, request
+
+def sharedStore() -> Optional[SharedStore]:
+    path = os.environ.get('CAUSAL_SHARED_STORE_DIR', os.path.join('/dev/shm', 'causal-store') if os.path.isdir('/dev/shm') else '')
+    if not path:
+        return None
+    try:
+        return SharedStore(path, int(os.environ.get('CAUSAL_SHARED_STORE_MB', 4096)) << 20)
+    except OSError as e:
+        print(f"SharedStore disabled: {e}", file=sys.stderr)
+        return None
+
+store = DatasetStore(max_bytes=int(os.environ.get('CAUSAL_DATASET_CACHE_MB', 1024)) << 20, shared=sharedStore())
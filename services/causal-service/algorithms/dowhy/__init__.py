@@ -1,2 +1,10 @@
-from .ExplainData import *
+import importlib
 from .interface import *
+
+def __getattr__(name: str):
+    # the names of ExplainData, as `from .ExplainData import *` gave them, imported with dowhy on first use
+    module = importlib.import_module('.ExplainData', __name__)
+    globals().update({k: v for k, v in vars(module).items() if not k.startswith('_')})
+    if name in globals():
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
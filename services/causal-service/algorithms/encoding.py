@@ -0,0 +1,146 @@
+"""
+Vectorized field encoding.
+
+All selected fields are encoded into one preallocated float64 matrix (column-major, so that
+pandas wraps it and `.to_numpy()` returns it without copying). Every categorical encoding is
+derived from a single `pd.factorize` of the column: frequencies come from `np.bincount` over
+the codes, and each output column is filled by one `np.take` from a per-category table.
+"""
+import sys, traceback
+import numpy as np, pandas as pd
+from typing import Callable, List, Tuple, Optional, Any
+
+TOPK = 16
+ONE_HOT_MAX = 64
+NOISE_LABEL = '~'
+N_BINS, BIN_EPS = 16, 1e-5
+
+# (writes the encoded columns into the given slice of the matrix, column suffixes or None to keep the origin field)
+Kernel = Tuple[Callable[[np.ndarray], None], Optional[List[str]]]
+
+def isCategorical(col: pd.Series, semanticType: str) -> bool:
+    return semanticType == 'nominal' or col.dtype.kind in 'bcOSUV'
+
+def factorizeByFreq(col: pd.Series):
+    """
+    codes: category of each row (-1 for missing values)
+    uniques: distinct values in order of first appearance
+    rank: rank[c] is the position of category c when sorted by descending frequency (ties keep appearance order)
+    order: inverse permutation of rank
+    """
+    codes, uniques = pd.factorize(col)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    order = np.argsort(-counts, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+    return codes, uniques, rank, order
+
+def sortedCodes(col: pd.Series):
+    try:
+        return pd.factorize(col, sort=True)
+    except TypeError:
+        return pd.factorize(col.astype(str), sort=True)
+
+def lookup(table: np.ndarray, codes: np.ndarray) -> Kernel:
+    """out[:, 0] = table[codes], NaN for missing values (code -1 wraps to the appended NaN)"""
+    table = np.append(np.asarray(table, dtype=np.float64), np.nan)
+    def write(out: np.ndarray):
+        np.take(table, codes, out=out[:, 0], mode='wrap')
+    return write, ['']
+
+def values(x: np.ndarray, suffixes: Optional[List[str]] = ['']) -> Kernel:
+    def write(out: np.ndarray):
+        out[:, 0] = x
+    return write, suffixes
+
+def oneHot(codes: np.ndarray, suffixes: List[str]) -> Kernel:
+    def write(out: np.ndarray):
+        out[:] = 0.
+        valid = np.flatnonzero(codes >= 0)
+        out[valid, codes[valid]] = 1.
+    return write, suffixes
+
+def catKernel(col: pd.Series, encodeType: str) -> Kernel:
+    if encodeType == 'lex':
+        codes, uniques = sortedCodes(col)
+        # rank(method="max") of a value is the number of rows with a value not greater than it
+        return lookup(np.cumsum(np.bincount(codes[codes >= 0], minlength=len(uniques))), codes)
+    elif encodeType == 'one-hot':
+        codes, uniques = sortedCodes(col)
+        if len(uniques) > ONE_HOT_MAX:
+            raise Exception("too many values for one-hot encoding")
+        return oneHot(codes, [f".[{str(v)}]" for v in uniques])
+    elif encodeType == 'one-hot-with-noise':
+        codes, uniques, rank, order = factorizeByFreq(col)
+        labels = list(uniques[order]) if len(uniques) <= TOPK else [*uniques[order[:TOPK-1]], NOISE_LABEL]
+        try:
+            columns = sorted(range(len(labels)), key=lambda i: labels[i])
+        except TypeError:
+            columns = sorted(range(len(labels)), key=lambda i: str(labels[i]))
+        position = np.empty(len(labels), dtype=np.int64)
+        position[columns] = np.arange(len(labels))
+        table = np.append(position[np.minimum(rank, len(labels) - 1)], -1)
+        return oneHot(table[codes], [f".[{str(labels[i])}]" for i in columns])
+    elif encodeType == 'topk-with-noise':
+        """
+        topk-with-noise: merge categories with frequency less than 5 or frequency of the k-th most frequent value together.
+        """
+        codes, uniques, rank, order = factorizeByFreq(col)
+        return lookup(np.minimum(rank, TOPK - 1), codes)
+    elif encodeType == 'random':
+        raise Exception("not implemented")
+    return values(pd.factorize(col)[0])
+
+def quantKernel(x: np.ndarray, encodeType: str) -> Kernel:
+    if encodeType == 'bin':
+        finite = x[np.isfinite(x)]
+        lo, width = (finite.min(), finite.max() - finite.min()) if finite.size else (0, 0)
+        if width == 0:
+            return values(x)
+        def write(out: np.ndarray):
+            col = out[:, 0]
+            np.subtract(x, lo, out=col)
+            col *= (N_BINS - BIN_EPS) * (1 / width)
+            np.floor(col, out=col)
+            col *= width / (N_BINS - BIN_EPS)
+        return write, ['']
+    elif encodeType == 'order':
+        codes, uniques = pd.factorize(x, sort=True)
+        return lookup(np.arange(len(uniques)), codes)
+    elif encodeType == 'cnt-bin':
+        codes, bins = pd.qcut(x, q=N_BINS, labels=False, retbins=True, duplicates='drop')
+        return lookup((bins[:-1] + bins[1:]) * .5, np.where(np.isnan(codes), -1, codes).astype(np.int64))
+    return values(x)
+
+def numericValues(col: pd.Series) -> np.ndarray:
+    if col.dtype.kind == 'M':
+        col = (col - pd.Timestamp("1970-01-01")) // pd.Timedelta('1s')
+    return col.to_numpy(dtype=np.float64, na_value=np.nan)
+
+def fieldKernel(col: pd.Series, semanticType: str, catEncodeType: Optional[str], quantEncodeType: Optional[str]) -> Kernel:
+    if isCategorical(col, semanticType):
+        try:
+            return catKernel(col, catEncodeType)
+        except Exception as e:
+            print(f"encodeCat by {catEncodeType} failed:", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+            return values(pd.factorize(col)[0])
+    elif semanticType in ['quantitative', 'ordinal', 'temporal']:
+        return quantKernel(numericValues(col), quantEncodeType)
+    return values(numericValues(col), None)
+
+def encodeFields(df: pd.DataFrame, fields: List[Any], catEncodeType: Optional[str], quantEncodeType: Optional[str]):
+    """
+    fields: objects with `fid` and `semanticType`
+    Returns (matrix, columns), where columns[j] = (field, column suffix), the suffix being None
+    when the field is kept as it is.
+    """
+    kernels = [fieldKernel(df[f.fid], f.semanticType, catEncodeType, quantEncodeType) for f in fields]
+    widths = [1 if suffixes is None else len(suffixes) for _, suffixes in kernels]
+    out = np.empty((df.shape[0], sum(widths)), dtype=np.float64, order='F')
+    columns, j = [], 0
+    for f, (write, suffixes), width in zip(fields, kernels, widths):
+        write(out[:, j:j+width])
+        columns.extend([(f, None)] if suffixes is None else [(f, s) for s in suffixes])
+        j += width
+    return out, columns
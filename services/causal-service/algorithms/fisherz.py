@@ -0,0 +1,53 @@
+"""
+Fisher-Z tests on sufficient statistics: the correlation matrix is computed once per dataset,
+and the partial correlations of a batch of tests come from one batched inversion of their
+correlation submatrices, so that the cost of a test does not depend on the number of rows.
+"""
+import numpy as np
+from scipy.stats import norm
+from typing import List
+from causallearn.utils import cit as CL
+
+from algorithms.cibatch import BatchCIT, Test
+
+def partialPValues(corr: np.ndarray, var: np.ndarray, n) -> np.ndarray:
+    """var: (m, k) tests as [x, y, *S]; n: sample size, scalar or (m,)"""
+    sub = corr[var[:, :, None], var[:, None, :]]
+    try:
+        inv = np.linalg.inv(sub)
+    except np.linalg.LinAlgError:
+        raise ValueError('Data correlation matrix is singular. Cannot run fisherz test. Please check your data.')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = -inv[:, 0, 1] / np.sqrt(inv[:, 0, 0] * inv[:, 1, 1])
+        Z = 0.5 * np.log((1 + r) / (1 - r))
+        X = np.sqrt(n - (var.shape[1] - 2) - 3) * np.abs(Z)
+    return 2 * (1 - norm.cdf(X))
+
+class FisherZ(BatchCIT, CL.FisherZ):
+    def batch(self, tests: List[Test]):
+        for keys, var in self.groups(tests):
+            self.pvalue_cache.update(zip(keys, partialPValues(self.correlation_matrix, var, self.sample_size).tolist()))
+
+class MVFisherZ(BatchCIT, CL.MV_FisherZ):
+    """
+    Test-wise deletion only drops rows of the columns with missing values, so the tests on complete
+    columns are batched over their correlation matrix, and the others run one by one.
+    """
+    def __init__(self, data, **kwargs):
+        super().__init__(data, **kwargs)
+        self.complete = ~np.isnan(data).any(axis=0)
+        self.correlation_matrix = np.full((data.shape[1], data.shape[1]), np.nan)
+        cols = np.flatnonzero(self.complete)
+        if cols.size > 0:
+            self.correlation_matrix[np.ix_(cols, cols)] = np.corrcoef(data[:, cols].T).reshape(cols.size, cols.size)
+
+    def batch(self, tests: List[Test]):
+        for keys, var in self.groups(tests):
+            complete = self.complete[var].all(axis=1)
+            if complete.any():
+                self.pvalue_cache.update(zip(
+                    [k for k, c in zip(keys, complete) if c],
+                    partialPValues(self.correlation_matrix, var[complete], self.sample_size).tolist()
+                ))
+            for var_i in var[~complete]:
+                self(int(var_i[0]), int(var_i[1]), var_i[2:].tolist())
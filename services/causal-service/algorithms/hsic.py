@@ -0,0 +1,431 @@
+"""
+HSIC independence tests of the nonlinear searches (RCD, CAM-UV), with low-rank approximations of the Gram matrices.
+
+The gamma test of causallearn (lingam.hsic.hsic_test_gamma, hsic2.hsic_gam for CAM-UV) builds the n x n Gram
+matrices of both variables, which takes minutes and gigabytes past a few thousand rows. The approximate methods map
+each variable to n x rank features F with K ~ F F^T: random Fourier features ('rff') or the pivoted incomplete
+Cholesky factor of K ('icl', which stops before the rank once the residual is negligible, for a single variable
+after a few dozen columns). The statistic tr(Kc Lc) / n = |Fc^T Gc|^2 / n and the mean under H0 are computed from
+the features in O(n rank^2); the variance under H0, from the Gram matrices of HSIC_VAR_ROWS evenly spaced rows.
+'auto' keeps the exact test up to HSIC_EXACT_ROWS rows.
+
+`RCD` and `camuv` are the drivers of causallearn (lingam.RCD, CAMUV.execute) on these tests. The tests which do not
+depend on each other run on a process pool (see TestPool): the pairs of the CAM-UV neighborhoods and confounders, and,
+for the tests of a level which depend on what the level finds (the sink candidates of the variable sets of an RCD
+level, the child candidates of a CAM-UV level, the CAM-UV parent pruning), the results for the state at the start
+of the level are computed on the pool, then the level runs as before on them: a test whose inputs changed meanwhile
+runs again, so the results are the ones of the serial search.
+
+Environment:
+    CAUSAL_HSIC_EXACT_ROWS: rows up to which method 'auto' runs the exact test, default 2000
+    CAUSAL_HSIC_VAR_ROWS: rows of the subsample estimating the variance of the approximate tests, default 1000
+    CAUSAL_HSIC_WORKERS: processes running the tests of a search, default CAUSAL_SKELETON_WORKERS; <= 1 disables it
+    CAUSAL_HSIC_PARALLEL_ROWS: rows from which the tests run on the pool, default 2000
+"""
+import os, copy, itertools
+import multiprocessing as mp
+import numpy as np
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Optional, Any, Callable
+from scipy.stats import gamma
+from scipy.optimize import fmin_l_bfgs_b
+from statsmodels.nonparametric import bandwidths
+
+from causallearn.search.FCMBased import lingam
+from causallearn.search.FCMBased.lingam import hsic2
+from causallearn.search.FCMBased.lingam.hsic import get_kernel_width, hsic_test_gamma
+from algorithms.skeleton import SKELETON_WORKERS
+
+HSIC_EXACT_ROWS = int(os.environ.get('CAUSAL_HSIC_EXACT_ROWS', 2000))
+HSIC_VAR_ROWS = int(os.environ.get('CAUSAL_HSIC_VAR_ROWS', 1000))
+HSIC_WORKERS = int(os.environ.get('CAUSAL_HSIC_WORKERS', SKELETON_WORKERS))
+HSIC_PARALLEL_ROWS = int(os.environ.get('CAUSAL_HSIC_PARALLEL_ROWS', 2000))
+
+def evenRows(n: int, m: int) -> np.ndarray:
+    return np.arange(n) if n <= m else np.linspace(0, n - 1, m).astype(int)
+
+def medianWidth(X: np.ndarray) -> float:
+    """hsic2.get_width (CAM-UV), on at most HSIC_VAR_ROWS rows"""
+    X = X[evenRows(X.shape[0], HSIC_VAR_ROWS)]
+    G = np.sum(X * X, 1)
+    dists = G[:, None] + G[None, :] - 2 * np.dot(X, X.T)
+    dists = dists[np.triu_indices(X.shape[0], k=1)]
+    return float(np.sqrt(0.5 * np.median(dists[dists > 0])))
+
+def fourierFeatures(X: np.ndarray, width: float, rank: int, seed: int = 0) -> np.ndarray:
+    """Random Fourier features of the RBF kernel of the given width"""
+    rng = np.random.default_rng(seed)
+    W = rng.normal(size=(X.shape[1], rank)) / width
+    b = rng.uniform(0, 2 * np.pi, size=rank)
+    return np.sqrt(2 / rank) * np.cos(X @ W + b)
+
+def choleskyFeatures(X: np.ndarray, width: float, rank: int, tol: float = 1e-6) -> np.ndarray:
+    """Pivoted incomplete Cholesky factor G of the RBF Gram matrix, K ~ G G^T, with at most rank columns"""
+    n = X.shape[0]
+    G = np.zeros((n, min(rank, n)))
+    sq = np.sum(X * X, 1)
+    diag = np.ones(n)
+    for j in range(G.shape[1]):
+        i = int(np.argmax(diag))
+        if diag[i] <= tol:
+            return G[:, :j]
+        col = np.exp(-np.maximum(sq + sq[i] - 2 * X @ X[i], 0) / (2 * width ** 2))
+        G[:, j] = (col - G[:, :j] @ G[i, :j]) / np.sqrt(diag[i])
+        diag -= G[:, j] ** 2
+    return G
+
+def gammaTest(Fx: np.ndarray, Fy: np.ndarray) -> Tuple[float, float]:
+    """(statistic, p-value) of the HSIC gamma test on the Gram matrices Fx Fx^T, Fy Fy^T, as hsic_test_gamma"""
+    n = Fx.shape[0]
+    # mean of the off-diagonal entries of the (uncentered) Gram matrices
+    mu_X = (np.sum(Fx.sum(0) ** 2) - np.sum(Fx * Fx)) / n / (n - 1)
+    mu_Y = (np.sum(Fy.sum(0) ** 2) - np.sum(Fy * Fy)) / n / (n - 1)
+    Fx, Fy = Fx - Fx.mean(0), Fy - Fy.mean(0)
+    test_stat = np.sum((Fx.T @ Fy) ** 2) / n
+
+    rows = evenRows(n, HSIC_VAR_ROWS)
+    m = len(rows)
+    var = ((Fx[rows] @ Fx[rows].T) * (Fy[rows] @ Fy[rows].T) / 6) ** 2
+    var = (np.sum(var) - np.trace(var)) / m / (m - 1)
+    var = 72 * (n - 4) * (n - 5) / n / (n - 1) / (n - 2) / (n - 3) * var
+
+    mean = (1 + mu_X * mu_Y - mu_X - mu_Y) / n
+    alpha = mean ** 2 / var
+    beta = var * n / mean
+    return float(test_stat), float(gamma.sf(test_stat, alpha, scale=beta))
+
+class HSIC:
+    """
+    p-value of the HSIC gamma test of X and Y (arrays of n rows).
+    method: 'exact', 'rff', 'icl' or 'auto' (see the module), resolved for n rows.
+    bw_method: kernel width of each variable, 'mdbs', 'scott' or 'silverman' as lingam.hsic; 'median', the median
+    distance over all the pairs of rows, as CAM-UV's hsic2.
+    """
+    def __init__(self, method: str = 'auto', rank: int = 100, bw_method: str = 'mdbs', n: int = 0, seed: int = 0):
+        self.method = ('exact' if n <= HSIC_EXACT_ROWS else 'icl') if method == 'auto' else method
+        self.rank, self.bw_method, self.seed = rank, bw_method, seed
+        # features of the columns of a table, see columnFeatures
+        self.columns: Dict[int, np.ndarray] = {}
+
+    @property
+    def exact(self) -> bool:
+        return self.method == 'exact'
+
+    def width(self, X: np.ndarray) -> float:
+        if self.bw_method == 'scott':
+            return float(np.ravel(bandwidths.bw_scott(X))[0])
+        if self.bw_method == 'silverman':
+            return float(np.ravel(bandwidths.bw_silverman(X))[0])
+        if self.bw_method == 'median':
+            return medianWidth(X)
+        return float(get_kernel_width(X))
+
+    def features(self, X: np.ndarray, width: Optional[float] = None) -> np.ndarray:
+        X = X.reshape(-1, 1) if X.ndim == 1 else X
+        width = self.width(X) if width is None else width
+        if self.method == 'rff':
+            return fourierFeatures(X, width, self.rank, self.seed)
+        return choleskyFeatures(X, width, self.rank)
+
+    def columnFeatures(self, X: np.ndarray, i: int) -> np.ndarray:
+        """features of X[:, i], kept for the tests of every pair of columns of X"""
+        if i not in self.columns:
+            self.columns[i] = self.features(X[:, [i]])
+        return self.columns[i]
+
+    def __call__(self, X: np.ndarray, Y: np.ndarray) -> float:
+        X = X.reshape(-1, 1) if X.ndim == 1 else X
+        Y = Y.reshape(-1, 1) if Y.ndim == 1 else Y
+        if self.exact:
+            if self.bw_method == 'median':
+                return float(np.ravel(hsic2.hsic_gam(X=X, Y=Y, mode="pvalue"))[0])
+            return float(hsic_test_gamma(X, Y, bw_method=self.bw_method)[1])
+        return gammaTest(self.features(X), self.features(Y))[1]
+
+workerState = None
+
+def initTestWorker(state):
+    global workerState
+    workerState = state
+
+def runTestTasks(fn: Callable, tasks: List[Tuple]) -> List:
+    return [fn(workerState, *task) for task in tasks]
+
+class TestPool:
+    """
+    Runs fn(state, *task) for independent tasks of a search, on a process pool (started on first use) once the data
+    has HSIC_PARALLEL_ROWS rows, in the caller otherwise. fn must be a module function; the workers get the state once.
+    """
+    def __init__(self, state: Any, n: int, workers: Optional[int] = None):
+        self.state = state
+        self.workers = HSIC_WORKERS if workers is None else workers
+        self.enabled = self.workers > 1 and n >= HSIC_PARALLEL_ROWS
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def map(self, fn: Callable, tasks: List[Tuple]) -> List:
+        if not self.enabled or len(tasks) <= 1:
+            return [fn(self.state, *task) for task in tasks]
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context('spawn'),
+                                            initializer=initTestWorker, initargs=(self.state,))
+        size = max(1, -(-len(tasks) // (self.workers * 4)))
+        chunks = [tasks[i:i+size] for i in range(0, len(tasks), size)]
+        return [res for values in self.pool.map(partial(runTestTasks, fn), chunks) for res in values]
+
+# RCD
+
+def rcdSinks(state, U: Tuple[int, ...], H_U: frozenset, skip: Tuple[int, ...]) -> Dict[Tuple, bool]:
+    """Results of _is_independent_of_resid for the sink candidates of U, by sinkKey"""
+    model, X = state
+    Y = model._get_residual_matrix(X, list(U), H_U)
+    if not model._is_non_gaussianity(Y, U):
+        return {}
+    for xi, xj in itertools.combinations(U, 2):
+        if not model._is_correlated(Y[:, xi], Y[:, xj]):
+            return {}
+    return {
+        (U, H_U, xi): model._is_independent_of_resid(Y, xi, [xj for xj in U if xj != xi])
+        for xi in U if xi not in skip
+    }
+
+class RCD(lingam.RCD):
+    """
+    lingam.RCD on the tests of `test`. The sink candidates of the variable sets of a level are tested on the pool
+    (rcdSinks) for the ancestors known at the start of the level; the level then runs on these results.
+    """
+    def __init__(self, max_explanatory_num=2, cor_alpha=0.01, ind_alpha=0.01, shapiro_alpha=0.01, MLHSICR=False,
+                 bw_method='mdbs', test: Optional[HSIC] = None, workers: Optional[int] = None):
+        super().__init__(max_explanatory_num, cor_alpha, ind_alpha, shapiro_alpha, MLHSICR, bw_method)
+        self.test = HSIC('exact', bw_method=bw_method) if test is None else test
+        self.workers = workers
+        self.sinks: Dict[Tuple, bool] = {}
+
+    def _is_independent(self, X, Y):
+        return self.test(X, Y) > self._ind_alpha
+
+    def _get_resid_and_coef_by_MLHSICR(self, Y, xi, xj_list):
+        if self.test.exact:
+            return super()._get_resid_and_coef_by_MLHSICR(Y, xi, xj_list)
+        # the sum of the HSICs on random Fourier features, which unlike the Cholesky factor are smooth in the coefficients
+        n_samples = Y.shape[0]
+        width_list = [self.test.width(Y[:, [xj]]) for xj in xj_list]
+        F_list = [fourierFeatures(Y[:, [xj]], width, self.test.rank, self.test.seed) for xj, width in zip(xj_list, width_list)]
+        F_list = [F - F.mean(0) for F in F_list]
+        _, initial_coef = self._get_resid_and_coef(Y, xi, xj_list)
+        width_xi = self.test.width(Y[:, [xi]])
+
+        def sum_empirical_hsic(coef):
+            resid = Y[:, xi]
+            width = width_xi
+            for j, xj in enumerate(xj_list):
+                resid = resid - coef[j] * Y[:, xj]
+                width = width - coef[j] * width_list[j]
+            F = fourierFeatures(resid.reshape(n_samples, 1), width, self.test.rank, self.test.seed)
+            F = F - F.mean(0)
+            return sum(np.sum((F.T @ Fj) ** 2) / n_samples for Fj in F_list)
+
+        coefs, _, _ = fmin_l_bfgs_b(func=sum_empirical_hsic, x0=initial_coef, approx_grad=True)
+        resid = Y[:, xi]
+        for j, xj in enumerate(xj_list):
+            resid = resid - coefs[j] * Y[:, xj]
+        return resid, coefs
+
+    def _extract_ancestors(self, X):
+        """lingam.RCD._extract_ancestors, on the sink tests of the level computed on the pool"""
+        n_features = X.shape[1]
+        M = [set() for i in range(n_features)]
+        l = 1
+        hu_history = {}
+
+        with TestPool((copy.copy(self), X), X.shape[0], self.workers) as pool:
+            while (True):
+                changed = False
+                U_list = [tuple(U) for U in itertools.combinations(range(n_features), l + 1)]
+                if pool.enabled:
+                    tasks = []
+                    for U in U_list:
+                        H_U = frozenset(self._get_common_ancestors(M, U))
+                        if U in hu_history and H_U == hu_history[U]:
+                            continue
+                        # the ancestors only grow within a level, a candidate skipped now stays skipped
+                        skip = tuple(xi for xi in U if self._exists_ancestor_in_U(M, U, xi, [xj for xj in U if xj != xi]))
+                        tasks.append((U, H_U, skip))
+                    self.sinks = {k: v for res in pool.map(rcdSinks, tasks) for k, v in res.items()}
+                for U in U_list:
+                    H_U = frozenset(self._get_common_ancestors(M, U))
+
+                    if U in hu_history and H_U == hu_history[U]:
+                        continue
+
+                    Y = self._get_residual_matrix(X, list(U), H_U)
+
+                    if not self._is_non_gaussianity(Y, U):
+                        continue
+
+                    is_cor = True
+                    for xi, xj in itertools.combinations(U, 2):
+                        if not self._is_correlated(Y[:, xi], Y[:, xj]):
+                            is_cor = False
+                            break
+                    if not is_cor:
+                        continue
+
+                    sink_set = []
+                    for xi in U:
+                        xj_list = [xj for xj in U if xj != xi]
+                        if self._exists_ancestor_in_U(M, U, xi, xj_list):
+                            continue
+
+                        independent = self.sinks.get((U, H_U, xi), None)
+                        if independent is None:
+                            independent = self._is_independent_of_resid(Y, xi, xj_list)
+                        if independent:
+                            sink_set.append(xi)
+
+                    if len(sink_set) == 1:
+                        xi = sink_set[0]
+                        xj_list = list(set(U) - set(sink_set))
+
+                        if not M[xi] == M[xi] | set(xj_list):
+                            M[xi] = M[xi] | set(xj_list)
+                            changed = True
+
+                    hu_history[U] = H_U
+
+                if changed:
+                    l = 1
+                elif l < self._max_explanatory_num:
+                    l += 1
+                else:
+                    break
+
+        self.sinks = {}
+        return M
+
+# CAM-UV, causallearn.search.FCMBased.lingam.CAMUV
+
+def camuvResidual(X: np.ndarray, explained_i: int, explanatory_ids) -> np.ndarray:
+    from pygam import LinearGAM
+    explanatory_ids = sorted(explanatory_ids)
+    if len(explanatory_ids) == 0:
+        return X[:, explained_i]
+    gam = LinearGAM().fit(X[:, explanatory_ids], X[:, explained_i])
+    return X[:, explained_i] - gam.predict(X[:, explanatory_ids])
+
+def camuvPair(state, i: int, j: int) -> float:
+    X, test = state
+    if test.exact:
+        return test(X[:, [i]], X[:, [j]])
+    return gammaTest(test.columnFeatures(X, i), test.columnFeatures(X, j))[1]
+
+def camuvResidualPair(state, i: int, Pi: frozenset, j: int, Pj: frozenset) -> float:
+    X, test = state
+    return test(camuvResidual(X, i, Pi), camuvResidual(X, j, Pj))
+
+def camuvChild(state, variables: Tuple[int, ...], P: Tuple[frozenset, ...], N: List[set], alpha: float) -> Tuple:
+    """
+    (child, its independence from the other variables, whether they are its parents) of a variable set (get_child
+    and check_independence_withou_K) for the parents P of the variables, of which the residuals Y are taken.
+    """
+    X, test = state
+    n = X.shape[0]
+    Y = {v: camuvResidual(X, v, Pv) for v, Pv in zip(variables, P)}
+    known = dict(zip(variables, P))
+    max_independence, child = 0.0, None
+    for c in variables:
+        parents = [v for v in variables if v != c]
+        if not all(p in N[c] for p in parents):
+            continue
+        residual = camuvResidual(X, c, set(parents) | known[c])
+        independence = test(residual, np.stack([Y[p] for p in parents], axis=1))
+        if max_independence < independence:
+            max_independence, child = independence, c
+    if not max_independence > alpha:
+        return child, max_independence, False
+    return child, max_independence, all(test(Y[child], Y[p]) <= alpha for p in variables if p != child)
+
+def camuvNeighborhoods(X: np.ndarray, alpha: float, pool: TestPool) -> List[set]:
+    d = X.shape[1]
+    pairs = [(i, j) for i in range(d) for j in range(i + 1, d)]
+    N = [set() for i in range(d)]
+    for (i, j), independence in zip(pairs, pool.map(camuvPair, pairs)):
+        if independence < alpha:
+            N[i].add(j)
+            N[j].add(i)
+    return N
+
+def camuvParents(X: np.ndarray, alpha: float, maxnum_vals: int, N: List[set], pool: TestPool) -> List[set]:
+    d = X.shape[1]
+    P = [set() for i in range(d)]
+    t = 2
+
+    def identified(variables):
+        return any(j in P[i] or i in P[j] for i, j in itertools.combinations(variables, 2))
+
+    while (True):
+        changed = False
+        sets = [variables for variables in itertools.combinations(range(d), t) if not identified(variables)]
+        cache = {}
+        if pool.enabled:
+            tasks = [(variables, tuple(frozenset(P[v]) for v in variables), N, alpha) for variables in sets]
+            cache = {task[:2]: res for task, res in zip(tasks, pool.map(camuvChild, tasks))}
+        for variables in sets:
+            if identified(variables):
+                continue
+            key = (variables, tuple(frozenset(P[v]) for v in variables))
+            res = cache.get(key, None)
+            child, _, accepted = camuvChild(pool.state, *key, N, alpha) if res is None else res
+            if not accepted:
+                continue
+            for parent in variables:
+                if parent != child:
+                    P[child].add(parent)
+                    changed = True
+
+        if changed:
+            t = 2
+        else:
+            t += 1
+            if t > maxnum_vals:
+                break
+
+    # parents whose residuals are independent, on the parents pruned so far
+    tasks = [(i, frozenset(P[i] - {j}), j, frozenset(P[j])) for i in range(d) for j in sorted(P[i])]
+    cache = dict(zip(tasks, pool.map(camuvResidualPair, tasks))) if pool.enabled else {}
+    for i in range(d):
+        non_parents = set()
+        for j in sorted(P[i]):
+            key = (i, frozenset(P[i] - {j}), j, frozenset(P[j]))
+            independence = cache[key] if key in cache else camuvResidualPair(pool.state, *key)
+            if independence > alpha:
+                non_parents.add(j)
+        P[i] = P[i] - non_parents
+
+    return P
+
+def camuv(X: np.ndarray, alpha: float, num_explanatory_vals: int, test: Optional[HSIC] = None,
+          workers: Optional[int] = None) -> Tuple[List[set], List[set]]:
+    """CAMUV.execute on the tests of `test`: (P, U), P[i] the parents of i, U the pairs with unobserved causes"""
+    n, d = X.shape
+    test = HSIC('exact', bw_method='median') if test is None else test
+    with TestPool((X, test), n, workers) as pool:
+        N = camuvNeighborhoods(X, alpha, pool)
+        test.columns.clear()
+        P = camuvParents(X, alpha, num_explanatory_vals, N, pool)
+
+        pairs = [(i, frozenset(P[i]), j, frozenset(P[j])) for i in range(d) for j in range(i + 1, d)
+                 if i not in P[j] and j not in P[i] and i in N[j] and j in N[i]]
+        U = []
+        for (i, _, j, _), independence in zip(pairs, pool.map(camuvResidualPair, pairs)):
+            if independence < alpha and {i, j} not in U:
+                U.append({i, j})
+    return P, U
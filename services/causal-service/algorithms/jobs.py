@@ -0,0 +1,194 @@
+"""
+Asynchronous causal discovery jobs.
+
+A job runs `runCausal` in a process pool owned by the serving process. Job states and results
+are written as JSON files under CAUSAL_JOB_DIR, so that every worker of a multi-worker server can
+answer status and result requests, whichever worker accepted the job.
+
+Environment:
+    CAUSAL_JOB_WORKERS: processes of the pool, default 2
+    CAUSAL_JOB_QUEUE: max unfinished jobs accepted by one server worker, default 32
+    CAUSAL_JOB_TTL: seconds a finished job is kept, default 3600
+    CAUSAL_JOB_DIR: default {tempdir}/causal-jobs
+    CAUSAL_TIME_BUDGET: timeBudget of the synchronous /causal requests which do not set one, default none
+"""
+import os, sys, json, time, uuid, tempfile, threading, traceback
+import multiprocessing as mp
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Dict, Optional, Any, Tuple
+from fastapi.encoders import jsonable_encoder
+
+import algorithms
+from algorithms.common import CausalRequest, CausalAlgorithmData, CausalAlgorithmResponse, JobInfo
+from algorithms.dataset import store as datasetStore
+from algorithms.metrics import Profile, profiling, stage, metrics
+from algorithms.response import encodeCausalResponse
+
+JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+JOB_FINISHED = [JOB_DONE, JOB_FAILED, JOB_CANCELLED]
+TIME_BUDGET = float(os.environ['CAUSAL_TIME_BUDGET']) if os.environ.get('CAUSAL_TIME_BUDGET') else None
+
+def runCausal(algoName: str, item: CausalRequest, debug: bool = False, timeBudget: Optional[float] = None,
+              profile: Optional[Profile] = None) -> CausalAlgorithmData:
+    """
+    timeBudget: default of item.timeBudget
+    profile: collects the time of the stages of the request, see algorithms.metrics
+    """
+    if item.dataSource is None and item.datasetId is None:
+        raise Exception("Either dataSource or datasetId is required.")
+    algo = algorithms.DICT.get(algoName, None)
+    if algo is None:
+        raise Exception(f"No such algorithm named {algoName}.")
+    timeBudget = item.timeBudget if item.timeBudget is not None else timeBudget
+    deadline = None if timeBudget is None else time.time() + timeBudget
+    dataSource = item.dataSource if item.dataSource is not None else item.datasetId
+    with profiling(Profile() if profile is None else profile) as profile:
+        with stage('parse'):
+            # the routes take any OptionalParams: the params of the algorithm are checked, and defaulted, here
+            params = algo.ParamType.parse_obj(item.params.dict())
+            method: algorithms.AlgoInterface = algo(dataSource, item.fields, params)
+        with stage('search'):
+            data = method.calc(params, item.focusedFields, bgKnowledgesPag=item.bgKnowledgesPag, funcDeps=item.funcDeps, sessionId=item.sessionId, alphas=item.alphas, deadline=deadline)
+    # not validated, the response is encoded by algorithms.response
+    return CausalAlgorithmData.construct(
+        orig_matrix=data.get('data'),
+        matrix=data.get('matrix', data.get('data')),
+        fields=data.get('fields'),
+        extra={ **data.get('extra', {}), 'debug': data if debug else "", 'datasetId': method.datasetId, 'sessionId': item.sessionId,
+               'sampling': method.samplingInfo(), **({'profile': profile.dict()} if item.profile else {}) }
+    )
+
+def runJob(jobDir: str, jobId: str, algoName: str, request: Dict, df: pd.DataFrame, debug: bool) -> Tuple[Dict, Dict]:
+    """
+    Entry of a pool process. The dataset is sent along and cached in the pool process by its content hash.
+    Returns the response and the profile of the job, for the metrics of the serving process.
+    """
+    writeJSON(os.path.join(jobDir, f'{jobId}.json'), {**readJSON(os.path.join(jobDir, f'{jobId}.json')), 'status': JOB_RUNNING, 'startedAt': time.time()})
+    profile = Profile()
+    try:
+        with profiling(profile), stage('parse'):
+            item = CausalRequest.parse_obj({**request, 'datasetId': datasetStore.put(df)})
+        data = runCausal(algoName, item, debug, profile=profile)
+        with profiling(profile), stage('serialize'):
+            result = encodeCausalResponse(data, item.matrixFormat)
+        return result, profile.dict()
+    except Exception as e:
+        print(traceback.format_exc(), file=sys.stderr)
+        return jsonable_encoder(CausalAlgorithmResponse(success=False, message=str(e))), profile.dict()
+
+def writeJSON(path: str, obj: Any):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, default=str)
+    os.replace(tmp, path)
+
+def readJSON(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+class QueueFullError(Exception):
+    pass
+
+class JobManager:
+    def __init__(self, jobDir: str, workers: int, maxQueue: int, ttl: float, debug: bool = False):
+        self.jobDir, self.workers, self.maxQueue, self.ttl, self.debug = jobDir, workers, maxQueue, ttl, debug
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.futures: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    def infoPath(self, jobId: str) -> str:
+        return os.path.join(self.jobDir, f'{jobId}.json')
+
+    def resultPath(self, jobId: str) -> str:
+        return os.path.join(self.jobDir, f'{jobId}.result.json')
+
+    def getPool(self) -> ProcessPoolExecutor:
+        # started on first use, so that importing the app does not fork
+        if self.pool is None:
+            os.makedirs(self.jobDir, exist_ok=True)
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context('spawn'))
+        return self.pool
+
+    def submit(self, algoName: str, item: CausalRequest) -> JobInfo:
+        if item.dataSource is None and item.datasetId is None:
+            raise Exception("Either dataSource or datasetId is required.")
+        if algoName not in algorithms.DICT:
+            raise Exception(f"No such algorithm named {algoName}.")
+        if item.dataSource is not None:
+            datasetId, df = datasetStore.putRows(item.dataSource)
+        else:
+            datasetId, df = item.datasetId, datasetStore.get(item.datasetId)
+            if df is None:
+                raise Exception(f"Dataset {datasetId} not found, please upload it again.")
+        request = item.dict(exclude={'dataSource', 'datasetId'})
+        with self.lock:
+            self.cleanup()
+            if len(self.futures) >= self.maxQueue:
+                raise QueueFullError(f"Too many pending jobs ({len(self.futures)}), please retry later.")
+            pool = self.getPool()
+            info = JobInfo(jobId=uuid.uuid4().hex, algoName=algoName, datasetId=datasetId, status=JOB_QUEUED, submittedAt=time.time())
+            writeJSON(self.infoPath(info.jobId), info.dict())
+            future = pool.submit(runJob, self.jobDir, info.jobId, algoName, request, df, self.debug)
+            self.futures[info.jobId] = future
+        future.add_done_callback(lambda f, jobId=info.jobId: self.finish(jobId, f))
+        return info
+
+    def finish(self, jobId: str, future: Future):
+        info = readJSON(self.infoPath(jobId)) or {}
+        if future.cancelled():
+            info.update(status=JOB_CANCELLED, message="Cancelled.")
+        else:
+            try:
+                result, profile = future.result()
+                metrics.record(info.get('algoName'), result['success'], profile)
+                writeJSON(self.resultPath(jobId), result)
+                info.update(status=JOB_DONE if result['success'] else JOB_FAILED, message=result.get('message'))
+            except Exception as e:
+                # the pool process died, e.g. killed for memory
+                info.update(status=JOB_FAILED, message=str(e))
+        info['finishedAt'] = time.time()
+        writeJSON(self.infoPath(jobId), info)
+        with self.lock:
+            self.futures.pop(jobId, None)
+
+    def info(self, jobId: str) -> Optional[JobInfo]:
+        info = readJSON(self.infoPath(jobId))
+        return None if info is None else JobInfo(**info)
+
+    def result(self, jobId: str) -> Optional[Dict]:
+        return readJSON(self.resultPath(jobId))
+
+    def cancel(self, jobId: str) -> bool:
+        """Only queued jobs of this server worker can be cancelled."""
+        with self.lock:
+            future = self.futures.get(jobId, None)
+        return future is not None and future.cancel()
+
+    def cleanup(self):
+        if not os.path.isdir(self.jobDir):
+            return
+        expire = time.time() - self.ttl
+        for name in os.listdir(self.jobDir):
+            path = os.path.join(self.jobDir, name)
+            try:
+                if os.path.getmtime(path) < expire and name.split('.')[0] not in self.futures:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+manager = JobManager(
+    jobDir=os.environ.get('CAUSAL_JOB_DIR', os.path.join(tempfile.gettempdir(), 'causal-jobs')),
+    workers=int(os.environ.get('CAUSAL_JOB_WORKERS', 2)),
+    maxQueue=int(os.environ.get('CAUSAL_JOB_QUEUE', 32)),
+    ttl=float(os.environ.get('CAUSAL_JOB_TTL', 3600)),
+    debug=os.environ.get('mode', 'prod') == 'dev',
+)
@@ -0,0 +1,135 @@
+"""
+Kernel-based conditional independence test (KCI) on low-rank kernel matrices.
+
+causallearn's KCI builds, centers and inverts n x n kernel matrices, cubic in the number of rows. This engine runs
+the same test (Gaussian kernels of the empirical widths, gamma approximation of the null) on the pivoted incomplete
+Cholesky factors G of the kernel matrices, K ~ G G^T (see algorithms.hsic), of at most `rank` columns, on at most
+`max_rows` rows of the data (a fixed random subset). The regression on the conditioning set is Woodbury's:
+    Rz = eps (Kz + eps I)^-1 = I - Gz (eps I + Gz^T Gz)^-1 Gz^T, so that Rz Kx Rz = (Rz Gx) (Rz Gx)^T
+and the statistic and the mean of the null come from products of the factors, O(rows rank^2) per test. The variance
+of the conditional null, the sum of the squared entries of KxR * KyR, is exact on the diagonal and estimated off the
+diagonal from CAUSAL_HSIC_VAR_ROWS evenly spaced rows. With the full rank and rows, the p-values are causallearn's.
+
+The factors of the single columns and of the conditioning sets are cached per CIT (and per worker of a ParallelCIT).
+
+Environment:
+    CAUSAL_KCI_CACHE_MB: budget of the cached factors of a CIT, default 256
+"""
+import os, json, hashlib, threading
+import numpy as np
+from collections import OrderedDict
+from scipy.stats import gamma
+from typing import Tuple
+from causallearn.utils import cit as CL
+
+from algorithms.hsic import choleskyFeatures, evenRows, HSIC_VAR_ROWS
+
+FACTOR_CACHE_BYTES = int(os.environ.get('CAUSAL_KCI_CACHE_MB', 256)) << 20
+EPSILON = 1e-3
+
+def empiricalWidth(n: int, conditional: bool) -> float:
+    """Base kernel width of KCI's 'empirical' rule (GaussianKernel.set_width_empirical_hsic / _kci)"""
+    if conditional:
+        return 1.2 if n < 200 else 0.7 if n < 1200 else 0.4
+    return 0.8 if n < 200 else 0.5 if n < 1200 else 0.3
+
+def gammaPValue(stat: float, mean: float, var: float) -> float:
+    if not mean > 0 or not var > 0:
+        return 1.0
+    return float(gamma.sf(stat, mean ** 2 / var, scale=var / mean))
+
+class KCI(CL.CIT_Base):
+    def __init__(self, data, rank: int = 50, max_rows: int = 10000, **kwargs):
+        super().__init__(data, **kwargs)
+        self.check_cache_method_consistent('kci', hashlib.md5(json.dumps({'rank': rank, 'max_rows': max_rows}, sort_keys=True).encode('utf-8')).hexdigest())
+        self.assert_input_data_is_valid()
+        self.rank, self.max_rows = rank, max_rows
+        n = data.shape[0]
+        rows = np.sort(np.random.default_rng(0).choice(n, max_rows, replace=False)) if n > max_rows else slice(None)
+        # z-scores, as KCI_UInd / KCI_CInd, on the rows tested
+        Z = np.asarray(data[rows], dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Z = (Z - Z.mean(axis=0)) / Z.std(axis=0, ddof=1)
+        Z[~np.isfinite(Z)] = 0.
+        self.Z = Z
+        self.factors: OrderedDict = OrderedDict()
+        self.factor_bytes = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.update(factors=OrderedDict(), factor_bytes=0, lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def factor(self, cols: Tuple[int, ...], theta: float) -> np.ndarray:
+        """Centered Cholesky factor of the kernel exp(-0.5 theta |x - x'|^2) of the columns"""
+        key = (cols, theta)
+        with self.lock:
+            if key in self.factors:
+                self.factors.move_to_end(key)
+                return self.factors[key]
+        G = choleskyFeatures(self.Z[:, list(cols)], 1 / np.sqrt(theta), self.rank)
+        G -= G.mean(axis=0)
+        with self.lock:
+            self.factors[key] = G
+            self.factor_bytes += G.nbytes
+            while self.factor_bytes > FACTOR_CACHE_BYTES and len(self.factors) > 1:
+                _, g = self.factors.popitem(last=False)
+                self.factor_bytes -= g.nbytes
+        return G
+
+    def unconditional(self, Xs, Ys) -> float:
+        n = self.Z.shape[0]
+        width = empiricalWidth(n, False)
+        Gx = self.factor(tuple(Xs), len(Xs) / width ** 2)
+        Gy = self.factor(tuple(Ys), len(Ys) / width ** 2)
+        stat = np.sum((Gx.T @ Gy) ** 2)
+        mean = np.sum(Gx * Gx) * np.sum(Gy * Gy) / n
+        var = 2 * np.sum((Gx.T @ Gx) ** 2) * np.sum((Gy.T @ Gy) ** 2) / n / n
+        return gammaPValue(stat, mean, var)
+
+    def conditional(self, Xs, Ys, S) -> float:
+        n = self.Z.shape[0]
+        theta = 1 / empiricalWidth(n, True) ** 2 / len(S)
+        # x is tested jointly with 0.5 z, as in KCI_CInd.kernel_matrix
+        Gx = self.jointFactor(Xs, S, theta)
+        Gy = self.factor(tuple(Ys), theta)
+        Gz = self.factor(tuple(S), theta)
+        A = EPSILON * np.eye(Gz.shape[1]) + Gz.T @ Gz
+        Ux = Gx - Gz @ np.linalg.solve(A, Gz.T @ Gx)
+        Uy = Gy - Gz @ np.linalg.solve(A, Gz.T @ Gy)
+        stat = np.sum((Ux.T @ Uy) ** 2)
+        # square roots of KxR, KyR restricted to their eigenvalues above KCI_CInd.thresh of the largest
+        Vx, Vy = self.principal(Ux), self.principal(Uy)
+        dx, dy = np.sum(Vx * Vx, axis=1), np.sum(Vy * Vy, axis=1)
+        mean = np.sum(dx * dy)
+        rows = evenRows(n, HSIC_VAR_ROWS)
+        m = len(rows)
+        off = ((Vx[rows] @ Vx[rows].T) * (Vy[rows] @ Vy[rows].T)) ** 2
+        off = (np.sum(off) - np.trace(off)) / m / (m - 1) * n * (n - 1) if m > 1 else 0.
+        var = 2 * (np.sum((dx * dy) ** 2) + off)
+        return gammaPValue(stat, mean, var)
+
+    def jointFactor(self, Xs, S, theta: float) -> np.ndarray:
+        """factor of x and 0.5 z, not cached: specific to the test"""
+        G = choleskyFeatures(np.concatenate((self.Z[:, list(Xs)], 0.5 * self.Z[:, list(S)]), axis=1), 1 / np.sqrt(theta), self.rank)
+        return G - G.mean(axis=0)
+
+    @staticmethod
+    def principal(U: np.ndarray, thresh: float = 1e-5) -> np.ndarray:
+        if U.shape[1] == 0:
+            return U
+        _, s, Qt = np.linalg.svd(U, full_matrices=False)
+        keep = s ** 2 > (s[0] ** 2) * thresh
+        return U @ Qt[keep].T
+
+    def __call__(self, X, Y, condition_set=None):
+        Xs, Ys, condition_set, cache_key = self.get_formatted_XYZ_and_cachekey(X, Y, condition_set)
+        if cache_key in self.pvalue_cache: return self.pvalue_cache[cache_key]
+        p = self.unconditional(Xs, Ys) if len(condition_set) == 0 else self.conditional(Xs, Ys, condition_set)
+        self.pvalue_cache[cache_key] = p
+        return p
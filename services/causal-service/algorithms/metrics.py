@@ -0,0 +1,105 @@
+"""
+Per-request profile of the causal requests, and their metrics aggregated per algorithm in the Prometheus text format.
+
+jobs.runCausal runs a request under a Profile (see `profiling`); the code of the request adds the wall time of its
+stages with `with stage(name):` and the adjacency searches count their CI tests by depth with `countTests`. The time
+of a stage excludes the stages run inside it:
+    parse: reading and validating the request body
+    encode: transDataSource and the row sampling of selectArray
+    skeleton: adjacency searches (depth levels, possible-dsep)
+    orient: orientation of the skeleton
+    search: the rest of the algorithm's calc
+    serialize: building and encoding the JSON response (in /metrics only, the response can not hold its own time)
+A CI test is a test evaluated by the search, whether computed or read from the p-value cache.
+
+Metrics are kept per server process, each worker of a multi-worker server exposes its own.
+"""
+import time, threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+class Profile:
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.tests: Dict[int, int] = {}
+        # time of the stages run inside each open stage
+        self.inner: List[float] = []
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def countTests(self, depth: int, n: int):
+        if n > 0:
+            self.tests[depth] = self.tests.get(depth, 0) + n
+
+    def dict(self) -> Dict:
+        return {
+            'stages': {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            'ciTests': sum(self.tests.values()),
+            'ciTestsByDepth': {str(depth): n for depth, n in sorted(self.tests.items())},
+        }
+
+current: ContextVar[Optional[Profile]] = ContextVar('profile', default=None)
+
+@contextmanager
+def profiling(profile: Profile):
+    token = current.set(profile)
+    try:
+        yield profile
+    finally:
+        current.reset(token)
+
+@contextmanager
+def stage(name: str):
+    """Adds the wall time of the block to the current profile, if any."""
+    profile = current.get()
+    if profile is None:
+        yield
+        return
+    profile.inner.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        profile.add(name, elapsed - profile.inner.pop())
+        if profile.inner:
+            profile.inner[-1] += elapsed
+
+def countTests(depth: int, n: int):
+    profile = current.get()
+    if profile is not None:
+        profile.countTests(depth, n)
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests: Dict[Tuple[str, str], int] = {}
+        self.seconds: Dict[Tuple[str, str], float] = {}
+        self.tests: Dict[Tuple[str, str], int] = {}
+
+    def record(self, algoName: str, success: bool, profile: Dict):
+        """profile: Profile.dict()"""
+        with self.lock:
+            key = (algoName, 'ok' if success else 'error')
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for name, seconds in profile['stages'].items():
+                self.seconds[algoName, name] = self.seconds.get((algoName, name), 0.0) + seconds
+            for depth, n in profile['ciTestsByDepth'].items():
+                self.tests[algoName, depth] = self.tests.get((algoName, depth), 0) + n
+
+    def render(self) -> str:
+        def family(name: str, help: str, samples: Dict[Tuple[str, str], float], label: str) -> List[str]:
+            lines = [f'# HELP {name} {help}', f'# TYPE {name} counter']
+            lines.extend(f'{name}{{algorithm="{algo}",{label}="{value}"}} {count}' for (algo, value), count in sorted(samples.items()))
+            return lines
+        with self.lock:
+            lines = [
+                *family('causal_requests_total', 'Causal discovery requests.', self.requests, 'status'),
+                *family('causal_stage_seconds_total', 'Wall time of the stages of the causal discovery requests.', self.seconds, 'stage'),
+                *family('causal_ci_tests_total', 'CI tests of the adjacency searches, by depth.', self.tests, 'depth'),
+            ]
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
@@ -0,0 +1,92 @@
+"""
+Encoding of the causal discovery responses.
+
+The response is built as plain lists and dicts and dumped by json: the validation of CausalAlgorithmData and the
+walk of jsonable_encoder over every cell took longer than the search on wide graphs. The graph matrices (orig_matrix,
+matrix, extra.alphas[].matrix) and the symmetric matrices of pair values (extra.pvalues, extra.edgeFrequency) are
+sent in the matrixFormat of the request:
+    dense: nested lists, as described in CausalAlgorithmData
+    edges: {'format': 'edges', 'shape': [n, n], 'edges': [[i, j, matrix[i][j], matrix[j][i]], ...]}, the pairs i < j
+        with a mark; for the pair values [[i, j, p], ...], the pairs i < j with p > 0. Non-square matrices are binary.
+    binary: {'format': 'binary', 'shape': [n, m], 'dtype': 'int8' | 'float32', 'data': base64 of the little-endian
+        row-major matrix}; int8 when every value is an integer in [-128, 127], as the edge marks are
+"""
+import base64
+import numpy as np
+from typing import Any, Dict, Optional
+from pydantic import BaseModel
+from fastapi.encoders import jsonable_encoder
+
+def isInt8(M: np.ndarray) -> bool:
+    return M.size == 0 or bool(np.isfinite(M).all() and (M == np.round(M)).all() and M.min() >= -128 and M.max() <= 127)
+
+def binaryMatrix(M: np.ndarray) -> Dict[str, Any]:
+    dtype = 'int8' if isInt8(M) else 'float32'
+    return {
+        'format': 'binary',
+        'shape': list(M.shape),
+        'dtype': dtype,
+        'data': base64.b64encode(np.ascontiguousarray(M, dtype=np.dtype(dtype).newbyteorder('<')).tobytes()).decode('ascii'),
+    }
+
+def edgeList(M: np.ndarray, mask: np.ndarray, values: list) -> Dict[str, Any]:
+    i, j = np.nonzero(np.triu(mask, k=1))
+    cells = [M[i, j] for M in values]
+    if all(isInt8(c) for c in cells):
+        cells = [c.astype(np.int64) for c in cells]
+    return {'format': 'edges', 'shape': list(M.shape), 'edges': list(map(list, zip(i.tolist(), j.tolist(), *(c.tolist() for c in cells))))}
+
+def encodeMatrix(matrix: Any, matrixFormat: str) -> Any:
+    """Graph matrix (see CausalAlgorithmData.matrix) in the given format."""
+    if matrix is None or matrixFormat == 'dense':
+        return matrix.tolist() if isinstance(matrix, np.ndarray) else matrix
+    M = np.asarray(matrix, dtype=np.float64)
+    if matrixFormat == 'binary' or M.ndim != 2 or M.shape[0] != M.shape[1]:
+        return binaryMatrix(M)
+    return edgeList(M, (M != 0) | (M.T != 0), [M, M.T])
+
+# extra keys of symmetric matrices of pair values
+PAIR_VALUES = ('pvalues', 'edgeFrequency')
+
+def encodePValues(pvalues: Any, matrixFormat: str) -> Any:
+    """Symmetric matrix of pair values (p-values, frequencies) in the given format."""
+    if pvalues is None or matrixFormat == 'dense':
+        return pvalues.tolist() if isinstance(pvalues, np.ndarray) else pvalues
+    P = np.asarray(pvalues, dtype=np.float64)
+    if matrixFormat == 'binary' or P.ndim != 2 or P.shape[0] != P.shape[1]:
+        return binaryMatrix(P)
+    return edgeList(P, P > 0, [P])
+
+def encodeExtra(extra: Optional[Dict], matrixFormat: str) -> Optional[Dict]:
+    if extra is None:
+        return None
+    extra = dict(extra)
+    # the matrices are encoded here, only the rest of extra goes through jsonable_encoder
+    matrices = {key: extra.pop(key) for key in (*PAIR_VALUES, 'alphas') if key in extra}
+    if isinstance(extra.get('debug'), dict):
+        # the graph of the debug data is the one of the response
+        extra['debug'] = {k: v for k, v in extra['debug'].items() if k not in ('data', 'matrix')}
+    res = jsonable_encoder(extra, custom_encoder={np.ndarray: lambda a: a.tolist(), np.generic: lambda a: a.item()})
+    for key in PAIR_VALUES:
+        if key in matrices:
+            res[key] = encodePValues(matrices[key], matrixFormat)
+    if 'alphas' in matrices:
+        res['alphas'] = None if matrices['alphas'] is None else [
+            {**jsonable_encoder({k: v for k, v in a.items() if k != 'matrix'}), 'matrix': encodeMatrix(a.get('matrix'), matrixFormat)}
+            for a in matrices['alphas']
+        ]
+    return res
+
+def encodeCausalData(data, matrixFormat: str = 'dense') -> Dict[str, Any]:
+    """JSON of a CausalAlgorithmData, which is built with construct() and not validated."""
+    matrix = encodeMatrix(data.matrix, matrixFormat)
+    return {
+        'orig_matrix': matrix if data.orig_matrix is data.matrix else encodeMatrix(data.orig_matrix, matrixFormat),
+        'matrix': matrix,
+        'fields': [f.dict() if isinstance(f, BaseModel) else f for f in data.fields],
+        'extra': encodeExtra(data.extra, matrixFormat),
+    }
+
+def encodeCausalResponse(data, matrixFormat: str = 'dense') -> Dict[str, Any]:
+    """JSON of a successful CausalAlgorithmResponse."""
+    return {'success': True, 'data': encodeCausalData(data, matrixFormat), 'message': None}
@@ -0,0 +1,135 @@
+"""
+Row sampling of large tables.
+
+A table with more rows than the sampleSize param is put in a stratified random order: the strata are the
+joint values of its low-cardinality columns, and every prefix of the order holds each stratum in proportion
+to its size. Algorithms run on the first sampleSize rows. The CI tests of the constraint-based algorithms
+escalate: a test whose p-value is near alpha on a sample is run again on a sample ESCALATION_FACTOR times
+larger, up to the whole table, so that only the decisions close to the threshold pay for the full data.
+
+Environment:
+    CAUSAL_ESCALATION_BAND: p-values in (alpha / band, alpha * band) are near alpha, default 4
+"""
+import os
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+
+from algorithms.cit import getCIT
+from algorithms.cibatch import Test
+
+ESCALATION_FACTOR = 4
+ESCALATION_BAND = float(os.environ.get('CAUSAL_ESCALATION_BAND', 4))
+# a column is a stratum variable if it has few values; strata are kept large enough to be sampled
+MAX_STRATUM_VALUES = 64
+MIN_STRATUM_ROWS = 20
+
+def sampleSizes(n: int, base: Optional[int]) -> List[int]:
+    """Nested sample sizes from base up to n, [n] when the table is not sampled."""
+    if not base or base <= 0 or n <= base:
+        return [n]
+    sizes = [base]
+    while sizes[-1] * ESCALATION_FACTOR < n:
+        sizes.append(sizes[-1] * ESCALATION_FACTOR)
+    return sizes + [n]
+
+def strata(array: np.ndarray, base: int, seed: int = 0) -> np.ndarray:
+    """Joint code of the low-cardinality columns, as many as keep MIN_STRATUM_ROWS rows per stratum in a sample of base rows."""
+    n = array.shape[0]
+    probe = array[np.random.default_rng(seed).choice(n, min(n, 10000), replace=False)]
+    candidates = []
+    for j in range(array.shape[1]):
+        k = len(np.unique(probe[:, j]))
+        if 1 < k <= MAX_STRATUM_VALUES:
+            candidates.append((k, j))
+    code, count = np.zeros(n, dtype=np.int64), 1
+    for _, j in sorted(candidates):
+        values, inverse = np.unique(array[:, j], return_inverse=True)
+        if count * len(values) > max(1, base // MIN_STRATUM_ROWS):
+            break
+        code = code * len(values) + inverse
+        count *= len(values)
+    return code
+
+def stratifiedOrder(array: np.ndarray, base: int, seed: int = 0) -> np.ndarray:
+    """Random order of the rows whose every prefix is a proportionally stratified sample."""
+    n = array.shape[0]
+    rng = np.random.default_rng(seed)
+    perm = rng.permutation(n)
+    code = strata(array, base, seed)[perm]
+    counts = np.bincount(code)
+    # rank of each row inside its stratum, spread over [0, 1) so that the strata interleave
+    grouped = np.argsort(code, kind='stable')
+    rank = np.empty(n)
+    rank[grouped] = np.arange(n) - np.repeat(np.cumsum(counts) - counts, counts)
+    return perm[np.argsort((rank + rng.random(n)) / counts[code], kind='stable')]
+
+def sampleRows(order: np.ndarray, size: int) -> np.ndarray:
+    """Row positions of the sample of the given size, in table order."""
+    return np.sort(order[:size])
+
+class EscalatingCIT:
+    """
+    CI test on nested row samples of a table: a test runs on the smallest sample, and on the next one while
+    its p-value is near one of the alphas. The larger samples are built on first use.
+    base: the CIT on the smallest sample; full: the whole table, with the same columns
+    """
+    def __init__(self, base, full: np.ndarray, order: np.ndarray, sizes: List[int], method: str,
+                 keys: List[str], alphas: Sequence[float], **kwargs):
+        self.full, self.order, self.sizes, self.method_name, self.keys, self.kwargs = full, order, sizes, method, keys, kwargs
+        self.alphas = list(alphas)
+        self.levels = [base] + [None] * (len(sizes) - 1)
+        self.method = base.method
+        self.BATCH_SIZE = getattr(base, 'BATCH_SIZE', 1 << 10)
+        # p-value of the largest sample each test was run on
+        self.pvalue_cache: Dict[str, float] = {}
+        # number of tests decided on each sample size
+        self.decided = [0] * len(sizes)
+
+    def level(self, i: int):
+        if self.levels[i] is None:
+            size = self.sizes[i]
+            data = self.full if size == self.full.shape[0] else self.full[sampleRows(self.order, size)]
+            self.levels[i] = getCIT(data, self.method_name, key=self.keys[i], **self.kwargs)
+        return self.levels[i]
+
+    def near(self, p: float) -> bool:
+        return any(alpha / ESCALATION_BAND < p < alpha * ESCALATION_BAND for alpha in self.alphas)
+
+    def get_formatted_XYZ_and_cachekey(self, X, Y, condition_set):
+        return self.levels[0].get_formatted_XYZ_and_cachekey(X, Y, condition_set)
+
+    def __call__(self, X, Y, condition_set=None):
+        key = self.get_formatted_XYZ_and_cachekey(X, Y, condition_set)[-1]
+        if key in self.pvalue_cache:
+            return self.pvalue_cache[key]
+        for i in range(len(self.sizes)):
+            p = self.level(i)(X, Y, condition_set)
+            if not self.near(p):
+                break
+        self.decided[i] += 1
+        self.pvalue_cache[key] = p
+        return p
+
+    def batch(self, tests: List[Test]):
+        """Runs the tests sample by sample, each sample on a ParallelCIT, so that the pool only gets the rows it needs."""
+        from algorithms.skeleton import ParallelCIT
+        pending: Dict[str, Test] = {}
+        for x, y, S in tests:
+            key = self.get_formatted_XYZ_and_cachekey(x, y, S)[-1]
+            if key not in self.pvalue_cache:
+                pending[key] = (x, y, S)
+        for i in range(len(self.sizes)):
+            if not pending:
+                break
+            level = self.level(i)
+            with ParallelCIT(level) as pcit:
+                pcit.prefetch(list(pending.values()))
+            escalated = {}
+            for key, (x, y, S) in pending.items():
+                p = level(x, y, S)
+                if i + 1 < len(self.sizes) and self.near(p):
+                    escalated[key] = (x, y, S)
+                else:
+                    self.decided[i] += 1
+                    self.pvalue_cache[key] = p
+            pending = escalated
@@ -0,0 +1,687 @@
+"""
+Local scores of the score-based searches (GES, ExactSearch, GRaSP), shared by the searches on the same data.
+
+The score-based searches spend their time scoring (node, parent set) pairs, and every change of the search
+params or of the background knowledge runs them again on the same pairs. Scores are kept in tables keyed by
+(dataset fingerprint, score function, score parameters), like the p-values of algorithms.cit; inside a table,
+by node then sorted parent set, the layout of causallearn's LocalScoreClass.score_cache. Whole tables are
+evicted in LRU order once the total number of cached scores exceeds the budget. With a spill directory, an
+evicted table is written there and read back by the next search on its data.
+
+`ges`, `exactSearch` and `graspOrder` are causallearn's drivers, on a given (cached) local score. GES looks its
+scores up in the table rather than in causallearn's per-node record lists, and scores the operators of a step on a
+process pool when the local score is slow (see ParallelScore). GRaSP runs seeded restarts, on a process pool (see
+graspRestarts). The exact search keeps its parent graphs and order graph as bitmasks (arrays indexed by subset for
+dp), and plans its memory before allocating it: maxP is lowered until the parent graphs fit the budget, and a dp
+order graph (2^d subsets) over the budget is refused, see planExactSearch; astar stops once the subsets it reached
+exceed what is left of the budget.
+
+Environment:
+    CAUSAL_SCORE_CACHE_SIZE: max cached local scores per process, default 2000000; 0 disables the cache
+    CAUSAL_SCORE_SPILL_DIR: directory of the evicted tables, default none (evicted tables are dropped); created with
+        mode 0700, the spill is disabled if it is not owned by the service's user or is writable by group or others
+    CAUSAL_SCORE_SPILL_MB: budget of the spill directory, default 1024, the least recently spilled are deleted
+    CAUSAL_EXACT_SEARCH_MB: max and default memory budget of an exact search, default 1024
+    CAUSAL_GES_WORKERS: processes scoring the operators of a GES step, default CAUSAL_SKELETON_WORKERS; <= 1 disables it
+    CAUSAL_GES_PARALLEL_MS: mean milliseconds of a local score from which GES steps use the pool, default 20 (the generalized scores)
+"""
+import os, sys, copy, json, math, time, heapq, random, bisect, pickle, hashlib, threading
+import multiprocessing as mp
+import itertools as it
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Optional, Any
+
+from causallearn.score.LocalScoreFunctionClass import LocalScoreClass
+from causallearn.score.LocalScoreFunction import (
+    local_score_BDeu,
+    local_score_BIC_from_cov,
+    local_score_cv_general,
+    local_score_cv_multi,
+    local_score_marginal_general,
+    local_score_marginal_multi,
+)
+from algorithms.skeleton import SKELETON_WORKERS
+from algorithms.dataset import privateDir
+
+INF = float('inf')
+# memory estimates of the exact search, in bytes: a parent set scored (cache entry in algorithms.score tables),
+# kept in a parent graph, a subset of the dp order graph (cost, last node, size), a subset reached by astar
+SCORE_BYTES, ENTRY_BYTES, DP_BYTES, ASTAR_BYTES = 160, 16, 10, 400
+EXACT_SEARCH_MB = int(os.environ.get('CAUSAL_EXACT_SEARCH_MB', 1024))
+GES_WORKERS = int(os.environ.get('CAUSAL_GES_WORKERS', SKELETON_WORKERS))
+GES_PARALLEL_MS = float(os.environ.get('CAUSAL_GES_PARALLEL_MS', 20))
+
+class ScoreCache:
+    def __init__(self, max_scores: int, spill_dir: Optional[str] = None, spill_bytes: int = 0):
+        self.max_scores, self.spill_dir, self.spill_bytes = max_scores, spill_dir, spill_bytes
+        self.tables: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        if spill_dir:
+            try:
+                privateDir(spill_dir)
+            except OSError as e:
+                print(f"score spill disabled: {e}", file=sys.stderr)
+                self.spill_dir = None
+
+    def spillPath(self, key: Tuple) -> str:
+        return os.path.join(self.spill_dir, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.pkl')
+
+    def spill(self, key: Tuple, table: Dict):
+        if not self.spill_dir:
+            return
+        try:
+            privateDir(self.spill_dir)
+            path = self.spillPath(key)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(table, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+            files = sorted((e for e in os.scandir(self.spill_dir) if e.name.endswith('.pkl')), key=lambda e: e.stat().st_mtime)
+            total = sum(e.stat().st_size for e in files)
+            for e in files[:-1]:
+                if total <= self.spill_bytes:
+                    break
+                total -= e.stat().st_size
+                os.remove(e.path)
+        except OSError as e:
+            print('score spill failed', e, file=sys.stderr)
+
+    def load(self, key: Tuple) -> Optional[Dict]:
+        if not self.spill_dir:
+            return None
+        try:
+            with open(self.spillPath(key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def table(self, key: Tuple) -> Dict[int, Dict[Tuple, float]]:
+        with self.lock:
+            table = self.tables.get(key, None)
+            if table is None:
+                table = self.tables[key] = self.load(key) or {}
+            self.tables.move_to_end(key)
+            total = sum(len(t) for tab in self.tables.values() for t in tab.values())
+            while total > self.max_scores and len(self.tables) > 1:
+                k, tab = self.tables.popitem(last=False)
+                total -= sum(len(t) for t in tab.values())
+                self.spill(k, tab)
+            return table
+
+    def clear(self):
+        with self.lock:
+            self.tables.clear()
+
+scoreCache = ScoreCache(
+    max_scores=int(os.environ.get('CAUSAL_SCORE_CACHE_SIZE', 2000000)),
+    spill_dir=os.environ.get('CAUSAL_SCORE_SPILL_DIR') or None,
+    spill_bytes=int(os.environ.get('CAUSAL_SCORE_SPILL_MB', 1024)) << 20,
+)
+
+def local_score_BIC_exact(Data: np.ndarray, i: int, PAi: List[int], parameters=None) -> float:
+    """BIC of causallearn's exact search (bic_score_node): least squares on the raw columns, lower is better."""
+    n = Data.shape[0]
+    if len(PAi) == 0:
+        residual = np.sum(Data[:, i] ** 2)
+    else:
+        _, residual, _, _ = np.linalg.lstsq(a=Data[:, list(PAi)], b=Data[:, i], rcond=None)
+    return (n * np.log(residual / n) + len(PAi) * np.log(n)).item()
+
+class CachedLocalScore(LocalScoreClass):
+    """LocalScoreClass on a shared score table, counts the scores it computed and their time."""
+    def __init__(self, data: Any, local_score_fun, parameters=None, table: Optional[Dict] = None):
+        super().__init__(data, local_score_fun, parameters)
+        if table is not None:
+            self.score_cache = table
+        self.computed, self.seconds = 0, 0.0
+        # (node, parents, score) of the scores computed, when set to a list
+        self.fresh: Optional[List] = None
+
+    def score(self, i: int, PAi: List[int]) -> float:
+        key = tuple(sorted(PAi))
+        if key in self.score_cache.get(i, ()):
+            return self.score_cache[i][key]
+        start = time.perf_counter()
+        # computed in the order of the key: the from_cov scores differ in the last bits with the order of the parents
+        res = super().score(i, list(key))
+        self.computed += 1
+        self.seconds += time.perf_counter() - start
+        if self.fresh is not None:
+            self.fresh.append((i, key, res))
+        return res
+
+    def merge(self, fresh: List):
+        """Adds the scores computed by a copy of this score (see fresh)"""
+        for i, key, res in fresh:
+            self.score_cache.setdefault(i, {})[key] = res
+        self.computed += len(fresh)
+
+    def snapshot(self) -> 'CachedLocalScore':
+        """Copy for a worker process, with a copy of the table"""
+        res = copy.copy(self)
+        res.score_cache = {i: dict(t) for i, t in self.score_cache.items()}
+        res.computed, res.seconds, res.fresh = 0, 0.0, []
+        return res
+
+def localScore(X: np.ndarray, score_func: str, key: Optional[str] = None, parameters: Optional[Dict] = None) -> CachedLocalScore:
+    """
+    Local score of the given name (see common.ScoreFunctions, and 'local_score_BIC_exact'), with the default parameters of ges.
+    key: fingerprint of X, None to use a private cache.
+    """
+    if score_func == 'local_score_CV_general':
+        fun, parameters = local_score_cv_general, parameters or {'kfold': 10, 'lambda': 0.01}
+    elif score_func == 'local_score_marginal_general':
+        fun, parameters = local_score_marginal_general, {}
+    elif score_func in ('local_score_CV_multi', 'local_score_marginal_multi'):
+        fun = local_score_cv_multi if score_func == 'local_score_CV_multi' else local_score_marginal_multi
+        if parameters is None:
+            parameters = {'kfold': 10, 'lambda': 0.01} if score_func == 'local_score_CV_multi' else {}
+            parameters['dlabel'] = {str(i): i for i in range(X.shape[1])}
+    elif score_func in ('local_score_BIC', 'local_score_BIC_from_cov'):
+        fun, parameters = local_score_BIC_from_cov, {'lambda_value': 2}
+    elif score_func == 'local_score_BDeu':
+        fun, parameters = local_score_BDeu, None
+    elif score_func == 'local_score_BIC_exact':
+        fun, parameters = local_score_BIC_exact, None
+    else:
+        raise Exception('Unknown function!')
+    table = None
+    if key is not None and scoreCache.max_scores > 0:
+        params = json.dumps(parameters, sort_keys=True, default=str)
+        table = scoreCache.table((key, score_func, params))
+    data = X if fun is local_score_BIC_exact else np.mat(X)
+    return CachedLocalScore(data, fun, parameters, table)
+
+class NoRecord:
+    """record_local_score of causallearn's GES operators, which scan it for the families they scored: the score
+    table already holds them, so every lookup gets an empty record."""
+    def __getitem__(self, j: int) -> List:
+        return []
+
+def forwardStep(X, G, N: int, maxP: float, score, parameters) -> Tuple[float, List]:
+    """(score change, (i, j, T)) of the best Insert operator of causallearn's forward search"""
+    from causallearn.graph.Endpoint import Endpoint
+    from causallearn.utils.GESUtils import Combinatorial, insert_validity_test1, insert_validity_test2, find_subset_include, insert_changed_score
+    min_chscore, min_desc = 1e7, []
+    for i in range(N):
+        for j in range(N):
+            if (G.graph[i, j] == Endpoint.NULL.value and G.graph[j, i] == Endpoint.NULL.value
+                    and i != j and len(np.where(G.graph[j, :] == Endpoint.ARROW.value)[0]) <= maxP):
+                Tj = np.intersect1d(np.where(G.graph[:, j] == Endpoint.TAIL.value)[0],
+                                    np.where(G.graph[j, :] == Endpoint.TAIL.value)[0])
+                Ti = np.union1d(np.where(G.graph[:, i] != Endpoint.NULL.value)[0],
+                                np.where(G.graph[i, 0] != Endpoint.NULL.value)[0])
+                T0 = np.intersect1d(Tj, np.setdiff1d(np.arange(N), Ti))
+                sub = Combinatorial(T0.tolist())
+                # 0: check both conditions, 1: only the first one, 2: not valid
+                S = np.zeros(len(sub))
+                for k in range(len(sub)):
+                    if S[k] < 2:
+                        if insert_validity_test1(G, i, j, sub[k]):
+                            if S[k] or insert_validity_test2(G, i, j, sub[k]):
+                                S[np.where(find_subset_include(sub[k], sub) == 1)] = 1
+                                chscore, desc, _ = insert_changed_score(X, G, i, j, sub[k], NoRecord(), score, parameters)
+                                if chscore < min_chscore:
+                                    min_chscore, min_desc = chscore, desc
+                        else:
+                            S[np.where(find_subset_include(sub[k], sub) == 1)] = 2
+    return min_chscore, min_desc
+
+def backwardStep(X, G, N: int, maxP: float, score, parameters) -> Tuple[float, List]:
+    """(score change, (i, j, H)) of the best Delete operator of causallearn's backward search"""
+    from causallearn.graph.Endpoint import Endpoint
+    from causallearn.utils.GESUtils import Combinatorial, find_subset_include, delete_validity_test, delete_changed_score
+    min_chscore, min_desc = 1e7, []
+    for i in range(N):
+        for j in range(N):
+            if ((G.graph[j, i] == Endpoint.TAIL.value and G.graph[i, j] == Endpoint.TAIL.value)
+                    or G.graph[j, i] == Endpoint.ARROW.value):
+                Hj = np.intersect1d(np.where(G.graph[:, j] == Endpoint.TAIL.value)[0],
+                                    np.where(G.graph[j, :] == Endpoint.TAIL.value)[0])
+                Hi = np.union1d(np.where(G.graph[i, :] != Endpoint.NULL.value)[0],
+                                np.where(G.graph[:, i] != Endpoint.NULL.value)[0])
+                sub = Combinatorial(np.intersect1d(Hj, Hi).tolist())
+                # 1: check the condition, 2: valid
+                S = np.ones(len(sub))
+                for k in range(len(sub)):
+                    if S[k] == 1:
+                        V = delete_validity_test(G, i, j, sub[k])
+                        if V:
+                            S[np.where(find_subset_include(sub[k], sub) == 1)] = 2
+                    else:
+                        V = 1
+                    if V:
+                        chscore, desc, _ = delete_changed_score(X, G, i, j, sub[k], NoRecord(), score, parameters)
+                        if chscore < min_chscore:
+                            min_chscore, min_desc = chscore, desc
+    return min_chscore, min_desc
+
+class RecordingScore:
+    """Local score of a dry run of a step: the families missing from the table are recorded and scored 0."""
+    def __init__(self, score: CachedLocalScore):
+        self.table = score.score_cache
+        self.pending: Dict[Tuple[int, Tuple[int, ...]], None] = {}
+
+    def score(self, i: int, PAi: List[int]) -> float:
+        key = tuple(sorted(int(p) for p in PAi))
+        value = self.table.get(i, {}).get(key, None)
+        if value is None:
+            self.pending[int(i), key] = None
+            return 0.0
+        return value
+
+workerScore = None
+
+def initScoreWorker(score):
+    global workerScore
+    workerScore = score
+
+def runScores(families: List[Tuple[int, Tuple[int, ...]]]) -> List[float]:
+    return [workerScore.score(i, list(PAi)) for i, PAi in families]
+
+class ParallelScore:
+    """
+    Computes the families of each GES step on a process pool into the score table, before the step runs on it.
+    Used once the local scores computed so far took GES_PARALLEL_MS on average; the pool is started on first use.
+    """
+    def __init__(self, score: CachedLocalScore, workers: Optional[int] = None):
+        self.score = score
+        self.workers = GES_WORKERS if workers is None else workers
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def worthIt(self) -> bool:
+        return self.workers > 1 and self.score.computed > 0 and self.score.seconds / self.score.computed * 1000 >= GES_PARALLEL_MS
+
+    def getPool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            # the workers get the score without the (possibly large) shared table
+            score = copy.copy(self.score)
+            score.score_cache = {}
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context('spawn'),
+                                            initializer=initScoreWorker, initargs=(score,))
+        return self.pool
+
+    def step(self, step, X, G, N: int, maxP: float, parameters) -> Tuple[float, List]:
+        """step(X, G, N, maxP, score, parameters), with the families it scores computed on the pool first"""
+        if self.worthIt():
+            recording = RecordingScore(self.score)
+            step(X, G, N, maxP, recording, parameters)
+            families = list(recording.pending)
+            if len(families) > 1:
+                size = max(1, -(-len(families) // (self.workers * 4)))
+                chunks = [families[i:i+size] for i in range(0, len(families), size)]
+                for chunk, values in zip(chunks, self.getPool().map(runScores, chunks)):
+                    self.score.merge([(i, PAi, value) for (i, PAi), value in zip(chunk, values)])
+        return step(X, G, N, maxP, self.score, parameters)
+
+def ges(X: np.ndarray, score: CachedLocalScore, maxP: Optional[float] = None, workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    causallearn.search.ScoreBased.GES.ges, on the given local score. The operators of a step are scored on a
+    process pool when the local score is slow, see ParallelScore; the result is the same as the sequential search.
+    """
+    from causallearn.graph.GeneralGraph import GeneralGraph
+    from causallearn.graph.GraphNode import GraphNode
+    from causallearn.utils.DAG2CPDAG import dag2cpdag
+    from causallearn.utils.PDAG2DAG import pdag2dag
+    from causallearn.utils.GESUtils import score_g, insert, delete
+    X = np.mat(X)
+    parameters = score.parameters
+    N = len(parameters['dlabel']) if parameters and 'dlabel' in parameters else X.shape[1]
+    if maxP is None:
+        maxP = N / 2
+    G = GeneralGraph([GraphNode(f"X{i + 1}") for i in range(N)])
+    score_new = score_g(X, G, score, parameters)
+    G = dag2cpdag(pdag2dag(G))
+    update1, G_step1, update2, G_step2 = [], [], [], []
+    with ParallelScore(score, workers) as parallel:
+        # forward greedy search
+        while True:
+            min_chscore, min_desc = parallel.step(forwardStep, X, G, N, maxP, parameters)
+            if len(min_desc) == 0 or min_chscore >= 0:
+                break
+            score_new += min_chscore
+            G = insert(G, min_desc[0], min_desc[1], min_desc[2])
+            update1.append([min_desc[0], min_desc[1], min_desc[2]])
+            G = dag2cpdag(pdag2dag(G))
+            G_step1.append(G)
+        # backward greedy search
+        while True:
+            min_chscore, min_desc = parallel.step(backwardStep, X, G, N, maxP, parameters)
+            if len(min_desc) == 0 or min_chscore >= 0:
+                break
+            score_new += min_chscore
+            G = delete(G, min_desc[0], min_desc[1], min_desc[2])
+            update2.append([min_desc[0], min_desc[1], min_desc[2]])
+            G = dag2cpdag(pdag2dag(G))
+            G_step2.append(G)
+    return {'update1': update1, 'update2': update2, 'G_step1': G_step1, 'G_step2': G_step2, 'G': G, 'score': score_new}
+
+def bits(mask: int) -> Tuple[int, ...]:
+    return tuple(i for i in range(mask.bit_length()) if mask >> i & 1)
+
+def maskOf(nodes) -> int:
+    return sum(1 << int(i) for i in set(nodes))
+
+class ParentGraph:
+    """
+    Parent graph of a node: its candidate parent sets as bitmasks, by increasing score (best first), only the
+    sets which score better than all their subsets. The best parents within a set U is the first mask in U.
+    """
+    def __init__(self, masks: List[int], scores: List[float]):
+        self.masks = np.array(masks, dtype=np.int64)
+        self.scores = np.array(scores, dtype=np.float64)
+        # single queries scan lists, faster than arrays on parent graphs of a few entries
+        self.maskList, self.scoreList = masks, scores
+
+    def __len__(self) -> int:
+        return len(self.masks)
+
+    def best(self, U: int) -> Tuple[int, float]:
+        """(mask, score) of the best parents within U, (-1, inf) if there is none (parents required by include_graph)"""
+        for mask, score in zip(self.maskList, self.scoreList):
+            if mask & ~U == 0:
+                return mask, score
+        return -1, INF
+
+    def bestScores(self, U: np.ndarray) -> np.ndarray:
+        """best(u)[1] for every u of U"""
+        res = np.full(len(U), INF)
+        rest = np.arange(len(U))
+        for mask, score in zip(self.masks, self.scores):
+            inside = (mask & ~U[rest]) == 0
+            res[rest[inside]] = score
+            rest = rest[~inside]
+            if len(rest) == 0:
+                break
+        return res
+
+    def structures(self) -> List[Tuple[Tuple[int, ...], float]]:
+        """causallearn's parent graph"""
+        return [(bits(int(m)), float(s)) for m, s in zip(self.masks, self.scores)]
+
+def parentGraph(score: CachedLocalScore, i: int, max_parents: int, parent_set: Tuple, include_parents: Tuple) -> ParentGraph:
+    """causallearn.search.ScoreBased.ExactSearch.generate_parent_graph, on the given local score."""
+    parent_set = tuple(sorted(set(int(j) for j in parent_set)))
+    include = maskOf(include_parents)
+    masks: List[int] = []
+    scores: List[float] = []
+    def bestWithin(U: int) -> float:
+        for m, s in zip(masks, scores):
+            if m & ~U == 0:
+                return s
+        return INF
+    for j in range(len(parent_set) + 1):
+        if j == 0:
+            if include == 0:
+                masks.append(0)
+                scores.append(score.score(i, []))
+        elif j <= max_parents:
+            for structure in it.combinations(parent_set, j):
+                mask = maskOf(structure)
+                if include & ~mask:
+                    continue
+                s = score.score(i, list(structure))
+                # kept only if no subset of the structure scores better
+                if all(bestWithin(mask & ~(1 << v)) >= s for v in structure):
+                    k = bisect.bisect_left(scores, s)
+                    masks.insert(k, mask)
+                    scores.insert(k, s)
+    return ParentGraph(masks, scores)
+
+def candidates(super_graph: np.ndarray, include_graph: np.ndarray, max_parents: int) -> int:
+    """Parent sets scored by the parent graphs"""
+    total = 0
+    for i in range(super_graph.shape[0]):
+        P, I = int(super_graph[:, i].astype(bool).sum()), int((include_graph[:, i].astype(bool) & super_graph[:, i].astype(bool)).sum())
+        total += sum(math.comb(P - I, j - I) for j in range(I, min(max_parents, P) + 1))
+    return total
+
+def orderGraphBytes(d: int, search_method: str) -> int:
+    """Memory of the dp order graph: cost, last node and size of every subset, and the work arrays of its largest layer"""
+    return (1 << d) * DP_BYTES + math.comb(d, d // 2) * 8 * 4 if search_method == 'dp' else 0
+
+def planExactSearch(super_graph: np.ndarray, include_graph: np.ndarray, search_method: str, max_parents: int, max_bytes: int) -> Tuple[int, int]:
+    """
+    (max_parents, estimated bytes) of an exact search within max_bytes: max_parents is lowered until the parent
+    graphs fit. Raises if the dp order graph, or the parent graphs of the parents required by include_graph, do not fit.
+    """
+    d = super_graph.shape[0]
+    fixed = orderGraphBytes(d, search_method)
+    if fixed > max_bytes:
+        raise Exception(f"Exact search (dp) on {d} fields needs about {fixed >> 20}MB, over the memory budget of {max_bytes >> 20}MB. Use astar, or fewer fields.")
+    required = int(include_graph.astype(bool).sum(axis=0).max()) if d else 0
+    for p in range(max_parents, required - 1, -1):
+        estimate = fixed + candidates(super_graph, include_graph, p) * (SCORE_BYTES + ENTRY_BYTES)
+        if estimate <= max_bytes:
+            return p, estimate
+    raise Exception(f"Exact search on {d} fields does not fit the memory budget of {max_bytes >> 20}MB with any maxP. Use fewer fields, or a super graph (background knowledge).")
+
+def dpShortestPath(graphs: List[ParentGraph]) -> Tuple[List[int], Dict]:
+    """
+    causallearn's dp_shortest_path on arrays indexed by the subsets of nodes: the subsets of k nodes are relaxed
+    from those of k - 1 nodes, a node at a time. Every subset is visited, so path extension is not needed.
+    """
+    d = len(graphs)
+    size = np.zeros(1 << d, dtype=np.uint8)
+    for v in range(d):
+        size[1 << v: 2 << v] = size[:1 << v] + 1
+    cost = np.full(1 << d, INF)
+    cost[0] = 0
+    last = np.full(1 << d, -1, dtype=np.int8)
+    for k in range(1, d + 1):
+        layer = np.flatnonzero(size == k)
+        for v in range(d):
+            U = layer[(layer >> v & 1) == 1]
+            prev = U ^ (1 << v)
+            c = cost[prev] + graphs[v].bestScores(prev)
+            better = c < cost[U]
+            cost[U[better]] = c[better]
+            last[U[better]] = v
+    U = (1 << d) - 1
+    if not np.isfinite(cost[U]):
+        raise Exception("No DAG has the parents required by the background knowledge within maxP.")
+    structures = [0] * d
+    while U:
+        v = int(last[U])
+        U ^= 1 << v
+        structures[v] = graphs[v].best(U)[0]
+    return structures, {'n_order_graph_nodes': 1 << d}
+
+def astarShortestPath(graphs: List[ParentGraph], use_path_extension=True, use_k_cycle_heuristic=False, k=3,
+                      max_states: Optional[int] = None) -> Tuple[List[int], Dict]:
+    """
+    causallearn's astar_shortest_path with subsets of nodes as bitmasks. The open list holds (f, g, subset); the
+    structures are rebuilt from the predecessor of each subset rather than copied along every path.
+    max_states: raises once the order graph has more subsets, the search would not fit its memory budget
+    """
+    from causallearn.search.ScoreBased.ExactSearch import create_dynamic_pd, compute_dynamic_h
+    d = len(graphs)
+    full = (1 << d) - 1
+    top = [float(g.scores[0]) for g in graphs]
+    if use_k_cycle_heuristic:
+        PD = create_dynamic_pd([g.structures() for g in graphs], k)
+        h = lambda U: compute_dynamic_h(bits(U), PD)
+    else:
+        h = lambda U: sum(top[j] for j in range(d) if not U >> j & 1)
+
+    def extend(U: int, g: float, structures: Optional[List[int]] = None) -> Tuple[int, float]:
+        """optimal path extension: adds the nodes whose best parents within U are their best parents"""
+        extended = True
+        while extended:
+            extended = False
+            for i in range(d):
+                if not U >> i & 1 and graphs[i].maskList[0] & ~U == 0:
+                    if structures is not None:
+                        structures[i] = graphs[i].maskList[0]
+                    U, g, extended = U | 1 << i, g + top[i], True
+                    break
+        return U, g
+
+    cost: Dict[int, float] = {0: 0.0}
+    # subset and node of the step to each subset
+    via: Dict[int, Tuple[int, int]] = {}
+    closed = set()
+    opened = [(h(0), 0.0, 0)]
+    max_n_opened = while_iter = for_iter = 0
+    while opened:
+        while_iter += 1
+        _, g, U = heapq.heappop(opened)
+        if U in closed or g > cost[U]:
+            continue
+        closed.add(U)
+        if U == full:
+            break
+        for i in range(d):
+            if U >> i & 1:
+                continue
+            for_iter += 1
+            _, s = graphs[i].best(U)
+            new_U, new_g = U | 1 << i, g + s
+            if use_path_extension:
+                new_U, new_g = extend(new_U, new_g)
+            if new_g < cost.get(new_U, INF):
+                cost[new_U] = new_g
+                via[new_U] = (U, i)
+                closed.discard(new_U)
+                heapq.heappush(opened, (new_g + h(new_U), new_g, new_U))
+        max_n_opened = max(max_n_opened, len(opened))
+        if max_states is not None and len(cost) > max_states:
+            raise Exception(f"Exact search (astar) exceeded its memory budget after {len(cost)} subsets of the order graph. Set maxP, use fewer fields, or a super graph (background knowledge).")
+    if full not in closed or not np.isfinite(cost[full]):
+        raise Exception("No DAG has the parents required by the background knowledge within maxP.")
+    steps, U = [], full
+    while U:
+        U, i = via[U]
+        steps.append((U, i))
+    structures = [0] * d
+    for U, i in reversed(steps):
+        structures[i] = graphs[i].best(U)[0]
+        if use_path_extension:
+            extend(U | 1 << i, 0.0, structures)
+    return structures, {'while_iter': while_iter, 'for_iter': for_iter, 'n_closed': len(closed), 'max_n_opened': max_n_opened}
+
+def exactSearch(X: np.ndarray, score: CachedLocalScore, super_graph=None, search_method='astar',
+                use_path_extension=True, use_k_cycle_heuristic=False, k=3, verbose=False, include_graph=None, max_parents=None,
+                max_bytes: Optional[int] = None):
+    """
+    causallearn.search.ScoreBased.ExactSearch.bic_exact_search, on the given local score and within max_bytes,
+    see planExactSearch. search_stats also holds the max_parents used and the estimated memory.
+    """
+    from causallearn.graph.Dag import Dag
+    n, d = X.shape
+    if super_graph is None:
+        super_graph = np.ones((d, d))
+        super_graph[np.diag_indices_from(super_graph)] = 0
+    if include_graph is None:
+        include_graph = np.zeros((d, d))
+    else:
+        assert Dag.is_dag(include_graph)
+    assert set(super_graph.diagonal()) == {0}
+    if search_method not in ('dp', 'astar'):
+        raise ValueError("Unknown search method.")
+    if max_parents is None:
+        max_parents = d
+    planned, estimate = planExactSearch(super_graph, include_graph, search_method, max_parents, max_bytes) if max_bytes else (max_parents, None)
+    graphs = [
+        parentGraph(score, i, planned, tuple(np.where(super_graph[:, i])[0]), tuple(np.where(include_graph[:, i])[0]))
+        for i in range(d)]
+    search_stats = {'n_parent_graphs_entries': sum(len(g) for g in graphs), 'max_parents': planned, 'estimated_bytes': estimate}
+    if search_method == 'dp':
+        structures, shortest_path_stats = dpShortestPath(graphs)
+    else:
+        max_states = None if max_bytes is None else max(0, max_bytes - estimate) // ASTAR_BYTES
+        structures, shortest_path_stats = astarShortestPath(graphs, use_path_extension, use_k_cycle_heuristic, k, max_states)
+    search_stats.update(shortest_path_stats)
+    dag_est = np.zeros((d, d))
+    for i, parents in enumerate(structures):
+        dag_est[list(bits(parents)), i] = 1
+    return dag_est, search_stats
+
+def graspDfs(depth: int, flipped: set, history: List[set], order, score, rng: random.Random) -> bool:
+    """causallearn's GRaSP dfs over the covered tucks, shuffling with rng"""
+    from causallearn.search.PermutationBased.GRaSP import tuck, update
+    cache = [{}, {}, {}, 0]
+    indices = list(range(order.len()))
+    rng.shuffle(indices)
+    for i in indices:
+        y = order.get(i)
+        y_parents = order.get_parents(y)
+        rng.shuffle(y_parents)
+        for x in y_parents:
+            covered = set([x] + order.get_parents(x)) == set(y_parents)
+            if len(history) > 0 and not covered:
+                continue
+            j = order.index(x)
+            for k in range(j, i + 1):
+                z = order.get(k)
+                cache[0][k] = z
+                cache[1][k] = order.get_parents(z)[:]
+                cache[2][k] = order.get_local_score(z)
+            cache[3] = order.get_edges()
+            tuck(i, j, order)
+            edge_bump, score_bump = update(i, j, order, score)
+            # because things that should be zero sometimes are not
+            if score_bump > 1e-6:
+                order.bump_edges(edge_bump)
+                return True
+            if score_bump > -1e-6:
+                flipped = flipped ^ set(tuple(sorted([x, z])) for z in order.get_parents(x) if order.index(z) < i)
+                if len(flipped) > 0 and flipped not in history:
+                    history.append(flipped)
+                    if depth > 0 and graspDfs(depth - 1, flipped, history, order, score, rng):
+                        return True
+                    del history[-1]
+            for k in range(j, i + 1):
+                z = cache[0][k]
+                order.set(k, z)
+                order.set_parents(z, cache[1][k])
+                order.set_local_score(z, cache[2][k])
+            order.set_edges(cache[3])
+    return False
+
+def graspOrder(score, p: int, depth: int, seed: int) -> Tuple[float, Dict[int, List[int]]]:
+    """causallearn's grasp from the random order of the seed: (score of the DAG, higher is better; parents of each node)"""
+    from causallearn.search.PermutationBased.GRaSP import Order, grow, shrink
+    rng = random.Random(seed)
+    order = Order(p, score)
+    order.order = list(range(p))
+    rng.shuffle(order.order)
+    for i in range(p):
+        y = order.get(i)
+        y_parents = order.get_parents(y)
+        grow(y, y_parents, [order.get(j) for j in range(i)], score)
+        order.set_local_score(y, shrink(y, y_parents, score))
+        order.bump_edges(len(y_parents))
+    while graspDfs(depth - 1, set(), [], order, score, rng):
+        pass
+    return float(sum(np.asarray(order.get_local_score(y)).item() for y in range(p))), {y: sorted(order.get_parents(y)) for y in range(p)}
+
+def runGrasp(p: int, depth: int, seed: int) -> Tuple[float, Dict[int, List[int]], List]:
+    workerScore.fresh = []
+    return (*graspOrder(workerScore, p, depth, seed), workerScore.fresh)
+
+def graspRestarts(score: CachedLocalScore, p: int, depth: int, seeds: List[int], workers: Optional[int] = None) -> List[Tuple[float, Dict[int, List[int]]]]:
+    """
+    graspOrder of each seed, on a process pool when there are several. A worker starts from a copy of the score table
+    and keeps the scores of its searches; they are added to the table as the searches end.
+    """
+    workers = min(SKELETON_WORKERS if workers is None else workers, len(seeds))
+    if workers <= 1:
+        return [graspOrder(score, p, depth, seed) for seed in seeds]
+    res = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'),
+                             initializer=initScoreWorker, initargs=(score.snapshot(),)) as pool:
+        for total, parents, fresh in pool.map(runGrasp, [p] * len(seeds), [depth] * len(seeds), seeds):
+            score.merge(fresh)
+            res.append((total, parents))
+    return res
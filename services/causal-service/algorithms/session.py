@@ -0,0 +1,107 @@
+"""
+Skeletons (graph + sepsets) kept between the requests of a session, so that a change of background
+knowledge only redoes the orientation phase. Entries are pickled to CAUSAL_SESSION_DIR, so that
+every worker of the server shares them, with a small in-process LRU in front.
+
+Environment:
+    CAUSAL_SESSION_DIR: default {tempdir}/causal-sessions, created with mode 0700; sessions are disabled if it is
+        not owned by the service's user, or is writable by group or others (see algorithms.dataset.privateDir)
+    CAUSAL_SESSION_TTL: seconds a skeleton is kept after its last use, default 1800
+"""
+import os, sys, time, copy, pickle, tempfile, threading
+from collections import OrderedDict
+from typing import Optional
+from causallearn.graph.GraphClass import CausalGraph
+from causallearn.utils.PCUtils.BackgroundKnowledge import BackgroundKnowledge
+
+from algorithms.cit import fingerprint
+from algorithms.dataset import privateDir
+
+class SkeletonSessions:
+    def __init__(self, sessionDir: str, ttl: float, max_entries: int = 32):
+        self.sessionDir, self.ttl, self.max_entries = sessionDir, ttl, max_entries
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        try:
+            privateDir(sessionDir)
+            self.enabled = True
+        except OSError as e:
+            print(f"Skeleton sessions disabled: {e}", file=sys.stderr)
+            self.enabled = False
+
+    def key(self, sessionId: str, *parts) -> str:
+        return fingerprint(sessionId, *parts)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.sessionDir, f'{key}.pkl')
+
+    def get(self, key: str) -> Optional[CausalGraph]:
+        """A fresh copy of the skeleton, without its CI test (set it again before orienting)."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            blob = self.entries.get(key, None)
+            if blob is not None:
+                self.entries.move_to_end(key)
+        if blob is None:
+            try:
+                with open(self.path(key), 'rb') as f:
+                    blob = f.read()
+            except FileNotFoundError:
+                return None
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass
+        return pickle.loads(blob)
+
+    def put(self, key: str, cg: CausalGraph):
+        if not self.enabled:
+            return
+        cg = copy.copy(cg)
+        cg.test = None
+        blob = pickle.dumps(cg, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = blob
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        try:
+            # again: a cleaner of the temp directory may have removed it
+            privateDir(self.sessionDir)
+        except OSError as e:
+            print(f"Skeleton session not written: {e}", file=sys.stderr)
+            return
+        tmp = f'{self.path(key)}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp, self.path(key))
+        self.cleanup()
+
+    def cleanup(self):
+        expire = time.time() - self.ttl
+        for name in os.listdir(self.sessionDir):
+            try:
+                if os.path.getmtime(os.path.join(self.sessionDir, name)) < expire:
+                    os.remove(os.path.join(self.sessionDir, name))
+            except OSError:
+                pass
+
+def removeForbidden(cg: CausalGraph, background_knowledge: Optional[BackgroundKnowledge]) -> CausalGraph:
+    """Remove the skeleton edges forbidden in both directions, as the skeleton search would."""
+    if background_knowledge is None:
+        return cg
+    nodes = cg.G.nodes
+    for edge in cg.G.get_graph_edges():
+        x, y = edge.get_node1(), edge.get_node2()
+        if background_knowledge.is_forbidden(x, y) and background_knowledge.is_forbidden(y, x):
+            cg.G.remove_edge(edge)
+            i, j = nodes.index(x), nodes.index(y)
+            if cg.sepset[i, j] is None:
+                cg.sepset[i, j] = cg.sepset[j, i] = [()]
+    return cg
+
+sessions = SkeletonSessions(
+    sessionDir=os.environ.get('CAUSAL_SESSION_DIR', os.path.join(tempfile.gettempdir(), 'causal-sessions')),
+    ttl=float(os.environ.get('CAUSAL_SESSION_TTL', 1800)),
+)
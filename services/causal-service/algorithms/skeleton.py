@@ -0,0 +1,337 @@
+"""
+Skeleton discovery with the CI tests of each depth level run on a process pool,
+or in one call for the batch engines of algorithms.cibatch.
+
+With stable=True the tests of a depth level only depend on the adjacencies at the start of the
+level, so they are computed in parallel into the p-value cache of the CIT first, and the level is
+then replayed sequentially on the cache. Removals and sepsets are therefore exactly those of the
+sequential search, whatever the number of workers.
+
+With a deadline (a time.time() value) the search stops at the last depth level completed in time:
+a level interrupted by the deadline is dropped, and the result is marked with `partial` and
+`completed_depth`. The marginal level (depth 0) always completes.
+
+A search on a subset of the nodes runs on a ColumnsCIT of the full CIT, so that its tests are cached for the search
+on all the nodes, which can start from its separations (fas(separated=...)).
+
+The searches are timed as the 'skeleton' stage of the request profile, and count their CI tests by depth
+(see algorithms.metrics).
+
+Environment:
+    CAUSAL_SKELETON_WORKERS: processes used for one search, default the number of CPUs; <= 1 disables it
+    CAUSAL_SKELETON_MIN_TESTS: uncached tests needed in a level before it is sent to the pool, default 200
+"""
+import os, copy, time
+import multiprocessing as mp
+import numpy as np
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import Dict, List, Tuple, Set, Optional
+
+from causallearn.graph.GraphClass import CausalGraph
+from causallearn.graph.GeneralGraph import GeneralGraph
+from causallearn.graph.Edges import Edges
+from causallearn.graph.Node import Node
+from causallearn.utils import Fas
+from causallearn.utils.PCUtils import SkeletonDiscovery
+from causallearn.utils.PCUtils.BackgroundKnowledge import BackgroundKnowledge
+from causallearn.utils.PCUtils.Helper import append_value
+from algorithms.metrics import stage, countTests
+
+SKELETON_WORKERS = int(os.environ.get('CAUSAL_SKELETON_WORKERS', len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1))
+SKELETON_MIN_TESTS = int(os.environ.get('CAUSAL_SKELETON_MIN_TESTS', 200))
+
+Test = Tuple[int, int, Tuple[int, ...]]
+
+class DeadlineExceeded(Exception):
+    pass
+
+def expired(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.time() > deadline
+
+workerCIT = None
+
+def initWorker(cit):
+    global workerCIT
+    workerCIT = cit
+
+def runTests(tests: List[Test]) -> List[float]:
+    return [workerCIT(x, y, S) for x, y, S in tests]
+
+class ParallelCIT:
+    """
+    Computes batches of tests of a CIT on a process pool and stores the p-values in the CIT's cache.
+    The pool is started on the first batch large enough to be worth it.
+    """
+    def __init__(self, cit, workers: Optional[int] = None, min_tests: Optional[int] = None):
+        self.cit = cit
+        self.workers = SKELETON_WORKERS if workers is None else workers
+        self.min_tests = SKELETON_MIN_TESTS if min_tests is None else min_tests
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self, wait: bool = True):
+        if self.pool is not None:
+            self.pool.shutdown(wait=wait, cancel_futures=not wait)
+            self.pool = None
+
+    def getPool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            # the workers get the CIT without the (possibly large) shared p-value cache
+            cit = copy.copy(self.cit)
+            cit.pvalue_cache = {k: v for k, v in self.cit.pvalue_cache.items() if k in ('data_hash', 'method_name', 'parameters_hash')}
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context('spawn'),
+                                            initializer=initWorker, initargs=(cit,))
+        return self.pool
+
+    def prefetch(self, tests: List[Test], deadline: Optional[float] = None):
+        """Stops early once the deadline passed, keeping the p-values computed so far."""
+        if hasattr(self.cit, 'batch'):
+            # batch engines (see algorithms.cibatch) are faster in process than shipped to the pool
+            step = len(tests) if deadline is None else self.cit.BATCH_SIZE
+            for i in range(0, len(tests), max(step, 1)):
+                if expired(deadline):
+                    return
+                self.cit.batch(tests[i:i+step])
+            return
+        if self.workers <= 1:
+            return
+        cache = self.cit.pvalue_cache
+        pending: Dict[str, Test] = {}
+        for x, y, S in tests:
+            key = self.cit.get_formatted_XYZ_and_cachekey(x, y, S)[-1]
+            if key not in cache and key not in pending:
+                pending[key] = (int(x), int(y), tuple(map(int, S)))
+        if len(pending) < self.min_tests:
+            return
+        keys, items = list(pending.keys()), list(pending.values())
+        size = max(1, -(-len(items) // (self.workers * 4)))
+        pool = self.getPool()
+        futures = [(i, pool.submit(runTests, items[i:i+size])) for i in range(0, len(items), size)]
+        done, _ = wait([f for _, f in futures], timeout=None if deadline is None else max(0, deadline - time.time()))
+        for i, future in futures:
+            if future in done:
+                for key, p in zip(keys[i:i+size], future.result()):
+                    cache[key] = p
+        if len(done) < len(futures):
+            # do not wait for the running chunks
+            self.close(wait=False)
+
+class TrackingCIT:
+    """
+    Forwards the tests to a CIT, keeps in pvalues[x, y] the max p-value of every pair tested, counts the tests
+    by the size of their condition set, and raises DeadlineExceeded on the first test after the deadline.
+    """
+    def __init__(self, cit, pvalues: Optional[np.ndarray] = None, deadline: Optional[float] = None):
+        self.cit, self.pvalues, self.deadline = cit, pvalues, deadline
+        self.method = cit.method
+
+    def __call__(self, X, Y, condition_set=None, *args):
+        if expired(self.deadline):
+            raise DeadlineExceeded()
+        p = self.cit(X, Y, condition_set, *args)
+        countTests(0 if condition_set is None else len(condition_set), 1)
+        if self.pvalues is not None and p > self.pvalues[X, Y]:
+            self.pvalues[X, Y] = self.pvalues[Y, X] = p
+        return p
+
+class ColumnsCIT:
+    """
+    The tests of a CIT on the columns `columns[x]`, `columns[y]` for the tests (x, y | S) of a search on a subset of the
+    nodes (causallearn's searches test node i of their list on column i), cached under the keys of the full CIT.
+    """
+    def __init__(self, cit, columns: List[int]):
+        self.cit, self.columns = cit, [int(c) for c in columns]
+        self.method = cit.method
+        self.pvalue_cache = cit.pvalue_cache
+        if hasattr(cit, 'batch'):
+            self.batch, self.BATCH_SIZE = self.columnsBatch, cit.BATCH_SIZE
+
+    def test(self, X, Y, condition_set) -> Test:
+        return self.columns[X], self.columns[Y], tuple(self.columns[s] for s in (condition_set or ()))
+
+    def get_formatted_XYZ_and_cachekey(self, X, Y, condition_set):
+        return self.cit.get_formatted_XYZ_and_cachekey(*self.test(X, Y, condition_set))
+
+    def __call__(self, X, Y, condition_set=None):
+        return self.cit(*self.test(X, Y, condition_set))
+
+    def columnsBatch(self, tests: List[Test]):
+        self.cit.batch([self.test(x, y, S) for x, y, S in tests])
+
+    def __getstate__(self):
+        # shipped to a pool by ParallelCIT.getPool, with the trimmed cache it set on its copy
+        cit = copy.copy(self.cit)
+        cit.pvalue_cache = self.pvalue_cache
+        return {'cit': cit, 'columns': self.columns, 'method': self.method, 'pvalue_cache': self.pvalue_cache}
+
+class SeparatedCIT:
+    """p-value 1 for the pairs already separated, the tests of the CIT for the others"""
+    def __init__(self, cit, separated: Dict[Tuple[int, int], Set[int]]):
+        self.cit, self.separated = cit, separated
+        self.method = cit.method
+
+    def __call__(self, X, Y, condition_set=None, *args):
+        if (min(X, Y), max(X, Y)) in self.separated:
+            return 1.0
+        return self.cit(X, Y, condition_set, *args)
+
+@stage('skeleton')
+def skeletonDiscovery(data: np.ndarray, alpha: float, cit, stable: bool = True,
+                      background_knowledge: Optional[BackgroundKnowledge] = None, verbose: bool = False,
+                      workers: Optional[int] = None, pvalues: Optional[np.ndarray] = None,
+                      deadline: Optional[float] = None) -> CausalGraph:
+    """
+    causallearn's skeleton_discovery, with every depth level prefetched on a ParallelCIT when stable.
+    pvalues: (d, d) matrix filled with the max p-value of the tests of each pair
+    deadline: only for stable searches, the unstable one cannot stop at a level boundary
+    """
+    if not stable:
+        cg = SkeletonDiscovery.skeleton_discovery(data, alpha, TrackingCIT(cit, pvalues), stable,
+                                                  background_knowledge=background_knowledge, verbose=verbose, show_progress=False)
+        cg.partial, cg.completed_depth = False, None
+        return cg
+    assert type(data) == np.ndarray
+    assert 0 < alpha < 1
+
+    no_of_var = data.shape[1]
+    cg = CausalGraph(no_of_var)
+    cg.set_ind_test(cit)
+    cg.partial, cg.completed_depth = False, -1
+    with ParallelCIT(cit, workers) as pcit:
+        depth = -1
+        while cg.max_degree() - 1 > depth:
+            if depth >= 0 and expired(deadline):
+                cg.partial = True
+                break
+            depth += 1
+            levelDeadline = deadline if depth > 0 else None
+            neighbors = [cg.neighbors(x) for x in range(no_of_var)]
+            pcit.prefetch([
+                (x, y, S)
+                for x in range(no_of_var) if len(neighbors[x]) >= depth - 1
+                for y in neighbors[x]
+                for S in combinations(np.delete(neighbors[x], np.where(neighbors[x] == y)), depth)
+            ], levelDeadline)
+            edge_removal, sepset_updates, tested = [], [], 0
+            try:
+                for x in range(no_of_var):
+                    Neigh_x = neighbors[x]
+                    if len(Neigh_x) < depth - 1:
+                        continue
+                    for y in Neigh_x:
+                        sepsets = set()
+                        if background_knowledge is not None and (
+                                background_knowledge.is_forbidden(cg.G.nodes[x], cg.G.nodes[y])
+                                and background_knowledge.is_forbidden(cg.G.nodes[y], cg.G.nodes[x])):
+                            edge_removal.append((x, y))
+                            edge_removal.append((y, x))
+                        Neigh_x_noy = np.delete(Neigh_x, np.where(Neigh_x == y))
+                        for S in combinations(Neigh_x_noy, depth):
+                            if expired(levelDeadline):
+                                raise DeadlineExceeded()
+                            p = cg.ci_test(x, y, S)
+                            tested += 1
+                            if pvalues is not None and p > pvalues[x, y]:
+                                pvalues[x, y] = pvalues[y, x] = p
+                            if p > alpha:
+                                if verbose:
+                                    print('%d ind %d | %s with p-value %f\n' % (x, y, S, p))
+                                edge_removal.append((x, y))
+                                edge_removal.append((y, x))
+                                for s in S:
+                                    sepsets.add(s)
+                            elif verbose:
+                                print('%d dep %d | %s with p-value %f\n' % (x, y, S, p))
+                        sepset_updates.append((x, y, tuple(sepsets)))
+            except DeadlineExceeded:
+                # the p-values of the dropped level stay cached for the next request
+                cg.partial = True
+                break
+            finally:
+                countTests(depth, tested)
+            for x, y, sepsets in sepset_updates:
+                append_value(cg.sepset, x, y, sepsets)
+                append_value(cg.sepset, y, x, sepsets)
+            for (x, y) in list(set(edge_removal)):
+                edge1 = cg.G.get_edge(cg.G.nodes[x], cg.G.nodes[y])
+                if edge1 is not None:
+                    cg.G.remove_edge(edge1)
+            cg.completed_depth = depth
+    return cg
+
+def fasLevelTests(nodes: List[Node], adjacencies: Dict[Node, Set[Node]], depth: int,
+                  knowledge: Optional[BackgroundKnowledge]) -> List[Test]:
+    """Every test the stable fast adjacency search may run at this depth (it stops early on removals)."""
+    if depth == 0:
+        return [(i, j, ()) for i in range(len(nodes)) for j in range(i + 1, len(nodes))]
+    index = {node: i for i, node in enumerate(nodes)}
+    tests = []
+    for i, node_x in enumerate(nodes):
+        for node_y in adjacencies[node_x]:
+            ppx = Fas.possible_parents(node_x, [z for z in adjacencies[node_x] if z != node_y], knowledge)
+            tests.extend((i, index[node_y], tuple(index[z] for z in S)) for S in combinations(ppx, depth))
+    return tests
+
+@stage('skeleton')
+def fas(data: np.ndarray, nodes: List[Node], independence_test_method=None, alpha: float = 0.05,
+        knowledge: Optional[BackgroundKnowledge] = None, depth: int = -1, verbose: bool = False,
+        workers: Optional[int] = None, pvalues: Optional[np.ndarray] = None,
+        deadline: Optional[float] = None, separated: Optional[Dict[Tuple[int, int], Set[int]]] = None
+        ) -> Tuple[GeneralGraph, Dict[Tuple[int, int], Set[int]]]:
+    """
+    causallearn's stable fas, with the tests of every depth prefetched on a ParallelCIT.
+    pvalues: (d, d) matrix filled with the max p-value of the tests of each pair
+    separated: pairs (i, j), i < j, already found independent with their sepsets, e.g. by a search on a subset of
+        the nodes: they are not tested and not adjacent from depth 0 on, unless the knowledge requires the edge
+    The returned graph is marked with `partial` and `completed_depth`.
+    """
+    if (depth is not None) and type(depth) != int:
+        raise TypeError("'depth' must be 'int' type!")
+    if (knowledge is not None) and type(knowledge) != BackgroundKnowledge:
+        raise TypeError("'background_knowledge' must be 'BackgroundKnowledge' type!")
+    sep_sets: Dict[Tuple[int, int], Set[int]] = {}
+    adjacencies: Dict[Node, Set[Node]] = {node: set() for node in nodes}
+    if depth is None or depth < 0:
+        depth = 1000
+    partial, completed_depth = False, -1
+    with ParallelCIT(independence_test_method, workers) as pcit:
+        for d in range(depth):
+            if d > 0 and expired(deadline):
+                partial = True
+                break
+            levelDeadline = deadline if d > 0 else None
+            test = TrackingCIT(independence_test_method, pvalues, levelDeadline)
+            tests = fasLevelTests(nodes, adjacencies, d, knowledge)
+            if d == 0 and separated:
+                tests = [t for t in tests if t[:2] not in separated]
+                test = SeparatedCIT(test, separated)
+            pcit.prefetch(tests, levelDeadline)
+            # searchAtDepth updates the adjacencies and sepsets in place, keep them to drop an interrupted level
+            kept = {node: set(adj) for node, adj in adjacencies.items()}, dict(sep_sets)
+            try:
+                if d == 0:
+                    more = Fas.searchAtDepth0(data, nodes, adjacencies, sep_sets, test, alpha, verbose, knowledge)
+                else:
+                    more = Fas.searchAtDepth(data, d, nodes, adjacencies, sep_sets, test, alpha, verbose, knowledge)
+            except DeadlineExceeded:
+                adjacencies, sep_sets = kept
+                partial = True
+                break
+            if d == 0 and separated:
+                sep_sets.update((pair, set(S)) for pair, S in separated.items() if pair in sep_sets)
+            completed_depth = d
+            if not more:
+                break
+    graph = GeneralGraph(nodes)
+    for i in range(len(nodes)):
+        for j in range(i + 1, len(nodes)):
+            if nodes[j] in adjacencies[nodes[i]]:
+                graph.add_edge(Edges().undirected_edge(nodes[i], nodes[j]))
+    graph.partial, graph.completed_depth = partial, completed_depth
+    return graph, sep_sets
@@ -0,0 +1,297 @@
+"""
+Offline benchmark of the algorithms of algorithms.DICT on seeded synthetic SEMs.
+
+Every case (algorithm x data kind x rows x fields x density x params) runs in a fresh process through
+jobs.runCausal, the path of the HTTP service, and records wall time, peak memory, the number of CI tests
+and the structural accuracy against the true DAG into a JSON report.
+
+    python benchmark.py --algos PC,GES --rows 1000,10000 --fields 8,16 --kinds linear,mixed \
+        --params '{"PC": {"indep_test": ["fisherz", "chisq"]}}' --out bench.json
+    python benchmark.py ... --baseline bench.json   # exit code 1 on wall time regressions
+    python benchmark.py --smoke   # one small linear case of every algorithm, exit code 1 on errors
+
+Data kinds:
+    linear: linear-Gaussian SEM, quantitative fields
+    discrete: additive modular SEM, ordinal fields and nominal (string) fields
+    mixed: linear SEM whose nodes are alternately kept quantitative, binned to ordinal, or binned to nominal labels
+"""
+import os, sys, json, time, argparse, itertools, platform, resource, traceback
+import multiprocessing as mp
+import numpy as np, pandas as pd
+# cases are measured without the encodings kept by earlier runs (see algorithms.dataset), unless asked for
+os.environ.setdefault('CAUSAL_SHARED_STORE_DIR', '')
+from typing import Any, Dict, List, Optional, Tuple
+
+ALGORITHMS = ['PC', 'XLearner', 'GES', 'ExactSearch', 'GRaSP', 'CAM_UV', 'RCD', 'GIN', 'CD_NOD', 'FuncDepTest']
+KINDS = ['linear', 'discrete', 'mixed']
+# cases beyond these sizes are recorded as skipped, they do not end in a benchmark run
+LIMITS = {
+    'ExactSearch': {'fields': 16},
+    'CAM_UV': {'fields': 12, 'rows': 5000},
+    'RCD': {'fields': 12, 'rows': 5000},
+    'GIN': {'fields': 12, 'rows': 2000},
+    'GRaSP': {'fields': 40},
+}
+# params every case of an algorithm needs
+BASE_PARAMS = {
+    'CD_NOD': {'c_indx': '$id'},
+}
+# --smoke: checks that every algorithm runs and gets an accuracy (but GIN), not a measurement
+SMOKE = {'algos': ALGORITHMS, 'kinds': ['linear'],
+         'rows': [500], 'fields': [5], 'density': [1.0], 'seeds': 1}
+NOMINAL_LABELS = np.array(list('abcdefgh'))
+
+def randomDAG(d: int, density: float, rng: np.random.Generator) -> np.ndarray:
+    """Adjacency matrix A[i, j] = 1 for i -> j, i < j in a random order, with density * d edges on average."""
+    p = min(1.0, 2 * density / max(1, d - 1))
+    A = np.triu(rng.random((d, d)) < p, k=1).astype(int)
+    perm = rng.permutation(d)
+    return A[np.ix_(perm, perm)]
+
+def topological(A: np.ndarray) -> List[int]:
+    order, indegree = [], A.sum(axis=0)
+    ready = [j for j in range(len(A)) if indegree[j] == 0]
+    while ready:
+        i = ready.pop()
+        order.append(i)
+        for j in np.flatnonzero(A[i]):
+            indegree[j] -= 1
+            if indegree[j] == 0:
+                ready.append(j)
+    return order
+
+def linearSEM(A: np.ndarray, n: int, rng: np.random.Generator) -> np.ndarray:
+    d = len(A)
+    W = A * rng.uniform(0.5, 1.5, size=A.shape) * rng.choice([-1, 1], size=A.shape)
+    X = np.zeros((n, d))
+    for j in topological(A):
+        X[:, j] = X @ W[:, j] + rng.normal(size=n)
+        X[:, j] /= X[:, j].std() or 1
+    return X
+
+def discreteSEM(A: np.ndarray, n: int, rng: np.random.Generator) -> np.ndarray:
+    """x_j = (sum of w * parent + noise) mod k_j, the noise is non-zero on 20% of the rows."""
+    d = len(A)
+    card = rng.integers(2, 5, size=d)
+    X = np.zeros((n, d), dtype=np.int64)
+    for j in topological(A):
+        parents = np.flatnonzero(A[:, j])
+        value = X[:, parents] @ rng.integers(1, card[j], size=len(parents)) if len(parents) else rng.integers(0, card[j], size=n)
+        noise = np.where(rng.random(n) < 0.2, rng.integers(0, card[j], size=n), 0)
+        X[:, j] = (value + noise) % card[j]
+    return X
+
+def generate(kind: str, n: int, d: int, density: float, seed: int) -> Tuple[pd.DataFrame, List[Dict], np.ndarray]:
+    """Seeded dataset: (rows, field metas, true DAG adjacency)."""
+    rng = np.random.default_rng(seed)
+    A = randomDAG(d, density, rng)
+    columns, fields = {}, []
+    if kind == 'linear':
+        X = linearSEM(A, n, rng)
+        for j in range(d):
+            columns[f'x{j}'] = X[:, j]
+            fields.append({'fid': f'x{j}', 'name': f'x{j}', 'semanticType': 'quantitative'})
+    elif kind == 'discrete':
+        X = discreteSEM(A, n, rng)
+        for j in range(d):
+            nominal = j % 2 == 1
+            columns[f'x{j}'] = NOMINAL_LABELS[X[:, j]] if nominal else X[:, j]
+            fields.append({'fid': f'x{j}', 'name': f'x{j}', 'semanticType': 'nominal' if nominal else 'ordinal'})
+    elif kind == 'mixed':
+        X = linearSEM(A, n, rng)
+        for j in range(d):
+            binned = np.digitize(X[:, j], np.quantile(X[:, j], [0.25, 0.5, 0.75]))
+            semanticType = ['quantitative', 'ordinal', 'nominal'][j % 3]
+            columns[f'x{j}'] = X[:, j] if semanticType == 'quantitative' else binned if semanticType == 'ordinal' else NOMINAL_LABELS[binned]
+            fields.append({'fid': f'x{j}', 'name': f'x{j}', 'semanticType': semanticType})
+    else:
+        raise ValueError(f"Unknown data kind {kind}")
+    return pd.DataFrame(columns), fields, A
+
+def fieldIndex(fid: str, fids: List[str]) -> Optional[int]:
+    """Input field of a result field: encodings name derived columns `{fid}.[...]`."""
+    for i, f in enumerate(fids):
+        if fid == f or (fid.startswith(f + '.[') and fid.endswith(']')):
+            return i
+    return None
+
+def accuracy(matrix: List[List[float]], resultFields: List[Dict], fids: List[str], A: np.ndarray) -> Optional[Dict[str, Any]]:
+    """
+    Skeleton and arrowhead precision / recall of a result matrix (see CausalAlgorithmData), on the input fields.
+    None for graphs with other nodes than the result fields (latent nodes of GIN).
+    """
+    d = len(fids)
+    # RCD returns its matrices as arrays
+    M = np.zeros((0, 0)) if matrix is None else np.asarray(matrix)
+    if M.shape != (len(resultFields), len(resultFields)):
+        return None
+    index = [fieldIndex(f['fid'], fids) for f in resultFields]
+    skeleton, arrows = np.zeros((d, d), dtype=bool), np.zeros((d, d), dtype=bool)
+    for a, b in zip(*np.nonzero(M)):
+        i, j = index[a], index[b]
+        if i is None or j is None or i == j:
+            continue
+        skeleton[i, j] = skeleton[j, i] = True
+        # M[b, a] = 1 and M[a, b] = -1: a -> b
+        if M[b, a] == 1 and M[a, b] == -1:
+            arrows[i, j] = True
+    truth = (A + A.T) > 0
+    upper = np.triu(np.ones((d, d), dtype=bool), k=1)
+    tp, fp, fn = (skeleton & truth & upper).sum(), (skeleton & ~truth & upper).sum(), (~skeleton & truth & upper).sum()
+    atp, afp = (arrows & (A > 0)).sum(), (arrows & ~(A > 0)).sum()
+    ratio = lambda x, y: None if y == 0 else round(float(x / y), 4)
+    return {
+        'edges': int(upper[truth].sum()),
+        'skeleton': {'precision': ratio(tp, tp + fp), 'recall': ratio(tp, tp + fn),
+                     'f1': ratio(2 * tp, 2 * tp + fp + fn)},
+        'arrows': {'precision': ratio(atp, atp + afp), 'recall': ratio(atp, A.sum())},
+        'skeletonSHD': int(fp + fn),
+    }
+
+def ciTestCount() -> int:
+    """CI tests cached by the shared p-value tables (the 3 metadata entries of a table excluded)."""
+    from algorithms.cit import citCache
+    return sum(len(t) - len([k for k in t if k in ('data_hash', 'method_name', 'parameters_hash')]) for t in citCache.tables.values())
+
+def runCase(case: Dict[str, Any], queue):
+    """Entry of the process of a case: generate the data, run the algorithm as the HTTP service does."""
+    try:
+        import algorithms
+        from algorithms import jobs
+        from algorithms.common import CausalRequest
+        from algorithms.dataset import store
+        df, fields, A = generate(case['kind'], case['rows'], case['fields'], case['density'], case['seed'])
+        fids = [f['fid'] for f in fields]
+        datasetId = store.put(df)
+        algo = algorithms.DICT[case['algo']]
+        item = CausalRequest.parse_obj({
+            'datasetId': datasetId, 'fields': fields, 'focusedFields': fids,
+            'params': {**algo.ParamType().dict(), **case['params']},
+            'profile': True,
+        })
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        data = jobs.runCausal(case['algo'], item)
+        wallTime = time.perf_counter() - start
+        extra = data.extra or {}
+        queue.put({
+            'status': 'ok',
+            'wallTime': round(wallTime, 4),
+            # ru_maxrss is in KiB on Linux; the growth of the peak over the loaded process
+            'peakRssMB': round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024, 1),
+            'ciTests': ciTestCount(),
+            'accuracy': accuracy(data.matrix, [f.dict() for f in data.fields], fids, A),
+            'extra': {k: extra[k] for k in ('partial', 'completedDepth', 'sampling', 'profile') if k in extra},
+        })
+    except Exception as e:
+        queue.put({'status': 'error', 'message': f'{type(e).__name__}: {e}', 'traceback': traceback.format_exc()})
+
+def runIsolated(case: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=runCase, args=(case, queue))
+    proc.start()
+    try:
+        return queue.get(timeout=timeout)
+    except Exception:
+        return {'status': 'timeout', 'message': f'No result within {timeout}s'}
+    finally:
+        proc.join(5)
+        if proc.is_alive():
+            proc.kill()
+
+def skipReason(algo: str, rows: int, fields: int) -> Optional[str]:
+    limit = LIMITS.get(algo, {})
+    if fields > limit.get('fields', fields) or rows > limit.get('rows', rows):
+        return f'{algo} is limited to {limit}'
+    return None
+
+def expandParams(grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    keys = list(grid.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*[grid[k] for k in keys])]
+
+def caseKey(case: Dict[str, Any]) -> str:
+    return json.dumps({k: case[k] for k in ('algo', 'kind', 'rows', 'fields', 'density', 'seed', 'params')}, sort_keys=True)
+
+def cases(args) -> List[Dict[str, Any]]:
+    grids = json.loads(args.params) if args.params else {}
+    res = []
+    for algo, kind, rows, fields, density, seed in itertools.product(
+            args.algos, args.kinds, args.rows, args.fields, args.density, range(args.seeds)):
+        for params in expandParams(grids.get(algo, {})):
+            res.append({'algo': algo, 'kind': kind, 'rows': rows, 'fields': fields, 'density': density,
+                        'seed': seed, 'params': {**BASE_PARAMS.get(algo, {}), **params}})
+    return res
+
+def regressions(report: Dict, baseline: Dict, tolerance: float, minTime: float) -> List[Dict[str, Any]]:
+    """Cases slower than tolerance times their baseline run (baseline runs faster than minTime are ignored)."""
+    base = {caseKey(c): c for c in baseline.get('cases', []) if c.get('status') == 'ok'}
+    res = []
+    for case in report['cases']:
+        old = base.get(caseKey(case), None)
+        if case.get('status') == 'ok' and old is not None and old['wallTime'] >= minTime \
+                and case['wallTime'] > tolerance * old['wallTime']:
+            res.append({'case': caseKey(case), 'wallTime': case['wallTime'], 'baseline': old['wallTime']})
+    return res
+
+def parseList(cast):
+    return lambda s: [cast(v) for v in s.split(',') if v]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--algos', type=parseList(str), default=ALGORITHMS)
+    parser.add_argument('--kinds', type=parseList(str), default=KINDS)
+    parser.add_argument('--rows', type=parseList(int), default=[1000, 10000])
+    parser.add_argument('--fields', type=parseList(int), default=[8])
+    parser.add_argument('--density', type=parseList(float), default=[1.0], help='expected edges per field')
+    parser.add_argument('--seeds', type=int, default=1)
+    parser.add_argument('--params', type=str, default=None,
+                        help='JSON {algo: {param: [values]}}, every combination is run')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds per case')
+    parser.add_argument('--out', type=str, default='benchmark.json')
+    parser.add_argument('--baseline', type=str, default=None, help='report to compare wall times with')
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    parser.add_argument('--min-time', type=float, default=0.5)
+    parser.add_argument('--smoke', action='store_true', help='run the SMOKE cases instead of the grid')
+    args = parser.parse_args()
+    if args.smoke:
+        for k, v in SMOKE.items():
+            setattr(args, k, v)
+
+    report = {
+        'meta': {
+            'startedAt': time.time(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'env': {k: v for k, v in os.environ.items() if k.startswith('CAUSAL_')},
+        },
+        'cases': [],
+    }
+    todo = cases(args)
+    for n, case in enumerate(todo):
+        reason = skipReason(case['algo'], case['rows'], case['fields'])
+        result = {'status': 'skipped', 'message': reason} if reason else runIsolated(case, args.timeout)
+        report['cases'].append({**case, **result})
+        print(f"[{n + 1}/{len(todo)}] {case['algo']} {case['kind']} rows={case['rows']} fields={case['fields']} "
+              f"density={case['density']} {case['params']}: {result['status']} "
+              f"{result.get('wallTime', result.get('message', ''))}", file=sys.stderr)
+        # written after every case, so that an interrupted run keeps its results
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1, default=str)
+    if args.smoke:
+        # GIN's graphs have latent nodes, and no accuracy
+        failed = [c for c in report['cases'] if c['status'] != 'ok' or (c.get('accuracy') is None and c['algo'] != 'GIN')]
+        for c in failed:
+            print(f"smoke: {c['algo']} {c['status']} {c.get('message', 'no accuracy')}", file=sys.stderr)
+        sys.exit(1 if failed else 0)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance, args.min_time)
+        report['regressions'] = found
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1, default=str)
+        for r in found:
+            print(f"regression: {r['case']} {r['baseline']}s -> {r['wallTime']}s", file=sys.stderr)
+        sys.exit(1 if found else 0)
+
+if __name__ == '__main__':
+    main()
@@ -59,7 +59,7 @@ class IFieldMeta(BaseModel):
     semanticType: str
     ''' 'quantitative' | 'nominal' | 'ordinal' | 'temporal' '''
 
-from algorithms.common import OptionalParams, AlgoInterface, getCausalRequest, CausalAlgorithmResponse, CausalAlgorithmData
+from algorithms.common import OptionalParams, AlgoInterface, getCausalRequest, CausalAlgorithmResponse, CausalAlgorithmData, DatasetInfo, DatasetResponse, JobInfo, JobResponse
 
 
 # class CausalRequest(Generic[T], BaseModel):
@@ -1,13 +1,19 @@
 import os, sys, json, time, argparse, math
 import numpy as np, pandas as pd
-from typing import Dict, List, Tuple, Optional, Union, Literal, Generic
+from typing import Dict, List, Tuple, Optional, Union, Literal, Generic, Any
 import traceback
-from fastapi import FastAPI, Response, status
+from fastapi import FastAPI, Request, Response, status
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, Field, Extra
 import interfaces as I
 import algorithms
+from algorithms.dataset import store as datasetStore, readArrow
+from algorithms.cit import fingerprint
+import algorithms.jobs as jobs
+from algorithms.metrics import Profile, profiling, stage, metrics
+from algorithms.response import encodeCausalResponse
 
 debug = os.environ.get('mode', 'prod') == 'dev'
 print("Development Mode" if debug else 'Production Mode', file=sys.stderr)
@@ -64,7 +70,8 @@ def inferRender(p: Dict, req: AlgoListRequest) -> Dict:
         res['options'] = res_opt
     elif t == 'number' or t == 'integer':
         res['dataType'] = 'number'
-        if p.keys().isdisjoint(['maximum', 'minimum', 'exclusiveMinimum', 'exclusiveMaximum']):
+        # a slider needs both ends
+        if p.keys().isdisjoint(['minimum', 'exclusiveMinimum']) or p.keys().isdisjoint(['maximum', 'exclusiveMaximum']):
             res['renderType'] = 'text'
         else:
             res['renderType'] = 'slider'
@@ -83,103 +90,163 @@ def inferRender(p: Dict, req: AlgoListRequest) -> Dict:
     return res
 
 
+def fieldSlots(p: Dict) -> List[int]:
+    """Positions of the '$fields' placeholders among the other options of a schema property."""
+    slots, n = [], 0
+    for o in p.get('options') or []:
+        if o['key'] == '$fields':
+            slots.append(n)
+        else:
+            n += 1
+    return slots
+
+def fieldOptions(req: AlgoListRequest) -> List[Dict]:
+    return [{
+        'key': meta.fid,
+        'text': meta.name if meta.name and len(meta.name) > 0 else meta.fid
+    } for meta in req.fieldMetas or []]
+
+schemaCache: Dict[str, Dict] = {}
+
+def staticSchema(algoName: str) -> Dict:
+    """
+    Schema response of an algorithm without the options of the request fields, built once:
+    response: the JSON of the ServiceSchemaResponse; slots: {item index: fieldSlots}; digest: of the response
+    """
+    if algoName not in schemaCache:
+        if algoName not in algorithms.DICT:
+            raise Exception(f"No such algorithm named {algoName}.")
+        algo: I.AlgoInterface = algorithms.DICT[algoName]
+        schema = algo.ParamType.schema()
+        items, slots = [], {}
+        for key, p in schema['properties'].items():
+            new_p = dict(p)
+            new_p['key'] = key
+            new_p['dataType'] = p['type']
+            new_p['defaultValue'] = p.get('default', None)
+            res = inferRender(new_p, AlgoListRequest())
+            if 'options' in res and fieldSlots(p):
+                slots[len(items)] = fieldSlots(p)
+            new_p.update(res.items())
+            items.append(
+                I.ServiceSchemaItem(
+                    **new_p
+                )
+            )
+        response = jsonable_encoder(I.ServiceSchemaResponse(
+            title=schema['title'],
+            description=schema['description'],
+            items=items,
+            message=schema
+        ))
+        schemaCache[algoName] = {
+            'response': response,
+            'slots': slots,
+            'digest': fingerprint(json.dumps(response, sort_keys=True, default=str)),
+            'dev_only': algo.dev_only,
+        }
+    return schemaCache[algoName]
+
+def getAlgoSchema(algoName: str, req: AlgoListRequest) -> Dict:
+    """The cached schema of the algorithm, with the fields of the request as the options of its '$fields' items."""
+    cached = staticSchema(algoName)
+    options = fieldOptions(req)
+    if not cached['slots'] or not options:
+        return cached['response']
+    items = list(cached['response']['items'])
+    for i, slots in cached['slots'].items():
+        opts = list(items[i]['options'])
+        for slot in reversed(slots):
+            opts[slot:slot] = options
+        items[i] = {**items[i], 'options': opts}
+    return {**cached['response'], 'items': items}
+
+def etagResponse(request: Request, content: Any, etag: str) -> Response:
+    """content as JSON with its ETag, or 304 if the client sent the same ETag in If-None-Match."""
+    etag = f'"{etag}"'
+    headers = {'etag': etag, 'cache-control': 'no-cache'}
+    if etag in [t.strip() for t in request.headers.get('if-none-match', '').split(',')]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return JSONResponse(content=content, headers=headers)
+
+# sync handlers: the first call imports the algorithms, in the thread pool rather than the event loop
 @app.post('/algo/list', response_model=Dict[str, I.ServiceSchemaResponse])
-async def algoList(req: AlgoListRequest, response: Response) -> Dict[str, I.ServiceSchemaResponse]:
-    response.headers['content-type'] = 'application/json'
+def algoList(req: AlgoListRequest, request: Request):
     # print("/algo/list", req)
-    return {
-        algoName: getAlgoSchema(algoName, req)
-        for algoName, algo in algorithms.DICT.items() if algo.dev_only == False or debug == True
-    }
+    names = [algoName for algoName in algorithms.DICT if staticSchema(algoName)['dev_only'] == False or debug == True]
+    return etagResponse(
+        request,
+        {algoName: getAlgoSchema(algoName, req) for algoName in names},
+        fingerprint(*[staticSchema(algoName)['digest'] for algoName in names], fieldOptions(req))
+    )
     
 @app.post('/algo/list/{algoName}', response_model=I.ServiceSchemaResponse)
-async def algoListAlgo(algoName: str, req: AlgoListRequest, response: Response) -> I.ServiceSchemaResponse:
+def algoListAlgo(algoName: str, req: AlgoListRequest, request: Request):
     try:
-        response.headers['content-type'] = 'application/json'
-        return getAlgoSchema(algoName, req)
+        return etagResponse(request, getAlgoSchema(algoName, req), fingerprint(staticSchema(algoName)['digest'], fieldOptions(req)))
     except Exception as e:
-        response.status_code = status.HTTP_400_BAD_REQUEST
-        return {
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={
             "message": str(e)
-        }
-
-
-def getAlgoSchema(algoName: str, req: AlgoListRequest) -> I.ServiceSchemaResponse:
-    algo: I.AlgoInterface = algorithms.__dict__.get(algoName, None)
-    if algo is None:
-        raise f"No such algorithm named {algoName}."
-    schema = algo.ParamType.schema()
-    items = []
-    for key, p in schema['properties'].items():
-        new_p = dict(p)
-        new_p['key'] = key
-        new_p['dataType'] = p['type']
-        new_p['defaultValue'] = p.get('default', None)
-        res = inferRender(new_p, req)
-        new_p.update(res.items())
-        # print('key =', key)
-        # print('res =', res)
-        items.append(
-            I.ServiceSchemaItem(
-                **new_p
-            )
-        )
-    return I.ServiceSchemaResponse(
-        title=schema['title'],
-        description=schema['description'],
-        items=items,
-        message=schema
-    )
-    # return {
-    #     "title":  # algo,
-    #     "description": schema['description'],
-    #     "items": items,
-    #     "message": schema
-    # }
+        })
 
 @app.get('/algo/schema/{algoName}')
-async def algoSchema(algoName: str, response: Response):
-    response.headers['content-type'] = 'application/json'
+def algoSchema(algoName: str, request: Request):
     try:
-        schema = getAlgoSchema(algoName=algoName)
-        return schema
+        cached = staticSchema(algoName)
+        return etagResponse(request, cached['response'], cached['digest'])
     except Exception as e:
-        response.status_code = status.HTTP_400_BAD_REQUEST
-        return {
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={
             "message": str(e)
-        }
+        })
 
-from algorithms.causallearn.PC import PCParams
-from algorithms.causallearn.FCI import FCIParams
 import sys
 import logging
 
-def causal(algoName: str, item: algorithms.CausalRequest, response: Response) -> I.CausalAlgorithmResponse:
+@app.middleware('http')
+async def receivedAt(request: Request, call_next):
+    """Start of the parse stage of the request profiles, see algorithms.metrics"""
+    request.state.receivedAt = time.perf_counter()
+    return await call_next(request)
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def getMetrics():
+    """Prometheus text format, aggregated per algorithm over the requests served by this process."""
+    return metrics.render()
+
+def causal(algoName: str, item: algorithms.CausalRequest, response: Response, profile: Optional[Profile] = None) -> I.CausalAlgorithmResponse:
+    profile = Profile() if profile is None else profile
     try:
-        method: I.AlgoInterface = algorithms.DICT.get(algoName)(item.dataSource, item.fields, item.params)
-        print("causal", item.params, item.focusedFields, item.bgKnowledgesPag)
-        data = method.calc(item.params, item.focusedFields, bgKnowledgesPag=item.bgKnowledgesPag, funcDeps=item.funcDeps)
-        response_data = I.CausalAlgorithmData(
-            orig_matrix=data.get('data'),
-            matrix=data.get('matrix', data.get('data')),
-            fields=data.get('fields'),
-            extra={ 'debug': data if debug else "" }
-        )
-        return I.CausalAlgorithmResponse(
-            success=True,
-            data=response_data
-        )
+        data = jobs.runCausal(algoName, item, debug, timeBudget=jobs.TIME_BUDGET, profile=profile)
+        # encoded here rather than by the framework, so that the serialization is timed
+        with profiling(profile), stage('serialize'):
+            res = JSONResponse(content=encodeCausalResponse(data, item.matrixFormat))
+        metrics.record(algoName, True, profile.dict())
+        return res
     except Exception as e:
         msg = traceback.format_exc()
         print(msg, file=sys.stderr)
+        metrics.record(algoName, False, profile.dict())
         response.status_code = status.HTTP_400_BAD_REQUEST
         return I.CausalAlgorithmResponse(
             success=False,
             message=str(e)
         )
 
-for algoName, algo in algorithms.DICT.items():
-    algorithms.registerCausalRequest(app, algoName, algo, causal, Response)
+def submitCausal(algoName: str, item: algorithms.CausalRequest, response: Response) -> I.JobResponse:
+    try:
+        response.status_code = status.HTTP_202_ACCEPTED
+        return I.JobResponse(success=True, data=jobs.manager.submit(algoName, item))
+    except jobs.QueueFullError as e:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        response.headers['retry-after'] = '10'
+        return I.JobResponse(success=False, message=str(e))
+    except Exception as e:
+        print(traceback.format_exc(), file=sys.stderr)
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return I.JobResponse(success=False, message=str(e))
+
+for algoName in algorithms.DICT:
+    algorithms.registerCausalRequest(app, algoName, causal, Response, submit=submitCausal)
 #     cur_globals = {**globals(), 'algoName': algoName, 'algo': algo }
 #     exec(f'''
 # #@app.post('/causal/{algoName}')
@@ -190,6 +257,85 @@ for algoName, algo in algorithms.DICT.items():
 # ''', cur_globals)
 #     globals()[f'causal{algoName}'] = cur_globals[f'causal{algoName}']
 
+class DatasetUploadRequest(BaseModel):
+    dataSource: List[I.IRow]
+
+@app.post('/dataset', response_model=I.DatasetResponse)
+def uploadDataset(item: DatasetUploadRequest, response: Response) -> I.DatasetResponse:
+    """Store a dataset by its content hash, so that /causal/{algoName} can refer to it by datasetId."""
+    try:
+        datasetId, df = datasetStore.putRows(item.dataSource)
+        return I.DatasetResponse(
+            success=True,
+            data=I.DatasetInfo(datasetId=datasetId, rows=df.shape[0], columns=[str(c) for c in df.columns])
+        )
+    except Exception as e:
+        print(traceback.format_exc(), file=sys.stderr)
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return I.DatasetResponse(success=False, message=str(e))
+
+@app.post('/dataset/arrow', response_model=I.DatasetResponse)
+async def uploadDatasetArrow(request: Request, response: Response) -> I.DatasetResponse:
+    """Same as /dataset, with the table sent as an Arrow IPC body."""
+    try:
+        df, _ = readArrow(await request.body())
+        datasetId = datasetStore.put(df)
+        return I.DatasetResponse(
+            success=True,
+            data=I.DatasetInfo(datasetId=datasetId, rows=df.shape[0], columns=[str(c) for c in df.columns])
+        )
+    except Exception as e:
+        print(traceback.format_exc(), file=sys.stderr)
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return I.DatasetResponse(success=False, message=str(e))
+
+@app.get('/dataset/{datasetId}', response_model=I.DatasetResponse)
+async def datasetInfo(datasetId: str, response: Response) -> I.DatasetResponse:
+    df = datasetStore.get(datasetId)
+    if df is None:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return I.DatasetResponse(success=False, message=f"Dataset {datasetId} not found.")
+    return I.DatasetResponse(
+        success=True,
+        data=I.DatasetInfo(datasetId=datasetId, rows=df.shape[0], columns=[str(c) for c in df.columns])
+    )
+
+@app.get('/job/{jobId}', response_model=I.JobResponse)
+async def jobInfo(jobId: str, response: Response) -> I.JobResponse:
+    info = jobs.manager.info(jobId)
+    if info is None:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return I.JobResponse(success=False, message=f"Job {jobId} not found.")
+    return I.JobResponse(success=True, data=info)
+
+@app.get('/job/{jobId}/result', response_model=I.CausalAlgorithmResponse)
+async def jobResult(jobId: str, response: Response):
+    """202 while the job is queued or running."""
+    info = jobs.manager.info(jobId)
+    if info is None:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return I.CausalAlgorithmResponse(success=False, message=f"Job {jobId} not found.")
+    if info.status not in jobs.JOB_FINISHED:
+        response.status_code = status.HTTP_202_ACCEPTED
+        return I.CausalAlgorithmResponse(success=False, message=f"Job {jobId} is {info.status}.")
+    result = jobs.manager.result(jobId)
+    if result is None:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return I.CausalAlgorithmResponse(success=False, message=info.message)
+    # stored encoded by algorithms.response, not validated again
+    return JSONResponse(content=result, status_code=status.HTTP_200_OK if result['success'] else status.HTTP_400_BAD_REQUEST)
+
+@app.delete('/job/{jobId}', response_model=I.JobResponse)
+async def cancelJob(jobId: str, response: Response) -> I.JobResponse:
+    if not jobs.manager.cancel(jobId):
+        response.status_code = status.HTTP_409_CONFLICT
+        return I.JobResponse(success=False, data=jobs.manager.info(jobId), message=f"Job {jobId} can not be cancelled.")
+    return I.JobResponse(success=True, data=jobs.manager.info(jobId))
+
+@app.on_event('shutdown')
+def shutdownJobs():
+    jobs.manager.shutdown()
+
 @app.get('/')
 async def ping():
     return "pong"
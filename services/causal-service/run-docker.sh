@@ -10,7 +10,8 @@ if [ $? -eq 0 ] ; then
 docker stop run-causal-server
 docker rm run-causal-server
 fi
-docker run -d -p $PORT:8000 -p $PORT2:8000 --env mode=$mode --name run-causal-server causal-server
+# --shm-size: room for the datasets shared by the workers (CAUSAL_SHARED_STORE_MB)
+docker run -d -p $PORT:8000 -p $PORT2:8000 --shm-size=4g --env mode=$mode --name run-causal-server causal-server
 
 # docker wait run-causal-server && \
 # 	docker rm run-causal-server && \